@@ -0,0 +1,3 @@
+"""
+Endpoints HTTP del subgrafo fuera de GraphQL
+"""
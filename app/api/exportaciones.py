@@ -0,0 +1,34 @@
+"""
+Descarga en streaming del detalle de los reportes
+"""
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.models.report_models import FormatoReporte, TipoReporte
+from app.services.exportacion import Exportacion, ExportacionNoDisponible
+
+router = APIRouter(prefix="/exportaciones", tags=["exportaciones"])
+
+
+@router.get("/{tipo}")
+async def exportar(
+    tipo: TipoReporte,
+    fecha_inicio: date,
+    fecha_fin: date,
+    formato: FormatoReporte = FormatoReporte.CSV,
+    doctor_id: Optional[int] = None
+):
+    """Transmite las filas del reporte en CSV, JSON Lines o XLSX a medida que se leen"""
+    try:
+        exportacion = Exportacion(tipo, formato, fecha_inicio, fecha_fin, doctor_id)
+    except ExportacionNoDisponible as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(
+        exportacion.contenido(),
+        media_type=exportacion.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{exportacion.nombre_archivo}"'},
+    )
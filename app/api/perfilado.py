@@ -0,0 +1,67 @@
+"""
+Middleware de perfilado por request (opt-in, con encabezado)
+
+`X-Profile: archivo` guarda `<id>.speedscope.json` y `<id>.memoria.json`
+en `directorio_perfiles` e informa las rutas en encabezados de la
+respuesta; `X-Profile: inline` reemplaza el cuerpo por el perfil.
+"""
+import asyncio
+import json
+import uuid
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+from app.config.settings import settings
+from app.services.perfilado import perfilador
+
+MODOS = ("archivo", "inline")
+
+
+def _escribir(nombre: str, perfil: dict, memoria: list) -> Path:
+    directorio = Path(settings.directorio_perfiles)
+    directorio.mkdir(parents=True, exist_ok=True)
+    ruta = directorio / f"{nombre}.speedscope.json"
+    ruta.write_text(json.dumps(perfil), encoding="utf-8")
+    (directorio / f"{nombre}.memoria.json").write_text(json.dumps(memoria, indent=2), encoding="utf-8")
+    return ruta
+
+
+async def perfilar_request(request: Request, call_next):
+    modo = request.headers.get(settings.perfilado_cabecera, "").lower()
+    if not settings.perfilado_habilitado or not modo:
+        return await call_next(request)
+    if modo not in MODOS:
+        modo = "archivo"
+
+    nombre = f"{request.method} {request.url.path}"
+    sesion = perfilador.iniciar(nombre)
+    if sesion is None:
+        respuesta = await call_next(request)
+        respuesta.headers["x-profile-estado"] = "ocupado"
+        return respuesta
+
+    try:
+        respuesta = await call_next(request)
+        # Consumir el cuerpo dentro del perfil: la serialización también cuenta
+        cuerpo = b"".join([parte async for parte in respuesta.body_iterator])
+    finally:
+        perfil = sesion.terminar()
+
+    speedscope = perfil.speedscope()
+    if modo == "inline":
+        return JSONResponse({
+            "speedscope": speedscope,
+            "memoria": perfil.memoria,
+            "duracionMs": round(perfil.duracion_ms, 3),
+            "status": respuesta.status_code,
+        })
+
+    identificador = uuid.uuid4().hex[:12]
+    ruta = await asyncio.to_thread(_escribir, identificador, speedscope, perfil.memoria)
+    cabeceras = dict(respuesta.headers)
+    cabeceras.pop("content-length", None)
+    cabeceras["x-profile-archivo"] = str(ruta)
+    cabeceras["x-profile-duracion-ms"] = f"{perfil.duracion_ms:.1f}"
+    return Response(cuerpo, status_code=respuesta.status_code, headers=cabeceras)
@@ -0,0 +1,133 @@
+"""
+Descarga de los reportes guardados en el almacén de artefactos
+"""
+import asyncio
+import re
+from pathlib import Path
+from typing import Optional, Tuple
+
+import anyio
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+
+from app.config.settings import settings
+from app.services.artefactos import almacen_artefactos
+
+router = APIRouter(prefix="/reportes", tags=["reportes"])
+
+TIPOS_MEDIA = {
+    ".pdf": "application/pdf",
+    ".json": "application/json",
+}
+
+_RANGO = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangoInsatisfacible(Exception):
+    """El rango pedido empieza después del final del archivo"""
+
+
+def parsear_rango(cabecera: Optional[str], tamano: int) -> Optional[Tuple[int, int]]:
+    """
+    (inicio, fin) inclusive de un encabezado `Range: bytes=...` con un solo
+    rango. Rangos múltiples o mal formados se ignoran y se envía el archivo
+    completo, como permite RFC 9110.
+    """
+    coincidencia = _RANGO.match(cabecera.strip()) if cabecera else None
+    if coincidencia is None:
+        return None
+    inicio, fin = coincidencia.groups()
+    if not inicio:
+        if not fin:
+            return None
+        # Sufijo: los últimos N bytes
+        largo = int(fin)
+        if largo == 0 or tamano == 0:
+            raise RangoInsatisfacible()
+        return max(tamano - largo, 0), tamano - 1
+    inicio = int(inicio)
+    fin = min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or inicio > fin:
+        raise RangoInsatisfacible()
+    return inicio, fin
+
+
+class RespuestaArchivo(Response):
+    """
+    Envía un tramo de un archivo. Si el servidor ASGI ofrece la extensión
+    `http.response.zerocopysend` el kernel copia el archivo al socket
+    (sendfile); si no, se envía por bloques leídos en un hilo.
+    """
+
+    def __init__(self, ruta: Path, inicio: int, largo: int, status_code: int, headers: dict, media_type: str):
+        headers = {**headers, "content-length": str(largo)}
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.ruta = ruta
+        self.inicio = inicio
+        self.largo = largo
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.largo == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.ruta, "rb") as archivo:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": archivo,
+                    "offset": self.inicio,
+                    "count": self.largo,
+                })
+            return
+
+        async with await anyio.open_file(self.ruta, "rb") as archivo:
+            await archivo.seek(self.inicio)
+            restante = self.largo
+            while restante > 0:
+                bloque = await archivo.read(min(settings.exportacion_tamano_bloque, restante))
+                if not bloque:
+                    break
+                restante -= len(bloque)
+                await send({"type": "http.response.body", "body": bloque, "more_body": restante > 0})
+        if restante > 0:
+            # El archivo se acortó mientras se enviaba: cerrar la respuesta
+            await send({"type": "http.response.body", "body": b""})
+
+
+@router.api_route("/{archivo}", methods=["GET", "HEAD"])
+async def descargar_reporte(archivo: str, request: Request):
+    """Devuelve el PDF (o JSON) de un reporte guardado, con soporte de Range"""
+    ruta = await almacen_artefactos.ruta_descarga(archivo)
+    if ruta is None:
+        raise HTTPException(status_code=404, detail="Reporte no encontrado o expirado")
+
+    # Direccionado por contenido: el nombre identifica los bytes para siempre
+    etag = f'"{ruta.stem}"'
+    cabeceras = {
+        "etag": etag,
+        "accept-ranges": "bytes",
+        "cache-control": "private, max-age=31536000, immutable",
+        "content-disposition": f'attachment; filename="{archivo}"',
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"etag": etag})
+
+    tamano = (await asyncio.to_thread(ruta.stat)).st_size
+    cabecera_rango = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range != etag:
+        cabecera_rango = None
+
+    try:
+        rango = parsear_rango(cabecera_rango, tamano)
+    except RangoInsatisfacible:
+        return Response(status_code=416, headers={"content-range": f"bytes */{tamano}"})
+
+    media_type = TIPOS_MEDIA[ruta.suffix]
+    if rango is None:
+        return RespuestaArchivo(ruta, 0, tamano, 200, cabeceras, media_type)
+    inicio, fin = rango
+    cabeceras["content-range"] = f"bytes {inicio}-{fin}/{tamano}"
+    return RespuestaArchivo(ruta, inicio, fin - inicio + 1, 206, cabeceras, media_type)
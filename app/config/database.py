@@ -1,11 +1,16 @@
 """
 Base de datos y configuración de SQLAlchemy
 """
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
 from app.config.settings import settings
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
 import logging
+import time
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -17,20 +22,181 @@ class Base(DeclarativeBase):
     pass
 
 
-# Motor de base de datos asíncrono
-engine = create_async_engine(
-    settings.get_database_url().replace("postgresql://", "postgresql+asyncpg://"),
-    echo=settings.debug,
-    pool_size=10,
-    max_overflow=20,
-    pool_pre_ping=True
+# Clases de carga de trabajo, cada una con su propio motor y pool
+INTERACTIVO = "interactivo"
+REPORTES = "reportes"
+EXPORTACIONES = "exportaciones"
+CARGAS = (INTERACTIVO, REPORTES, EXPORTACIONES)
+# Cargas de solo lectura que pueden ir a una réplica
+CARGAS_LECTURA = (INTERACTIVO, REPORTES)
+
+
+def _crear_motor(carga: str, url: Optional[str] = None) -> AsyncEngine:
+    """
+    Motor con el tamaño de pool y el statement_timeout de la carga
+    (`pool_<carga>_*` en settings). El application_name permite separar
+    las cargas en pg_stat_activity. Con `url` el motor es de una réplica
+    y sus transacciones son de solo lectura.
+    """
+    parametros_servidor = {"application_name": f"veterinaria-kpi-{carga}"}
+    timeout_ms = getattr(settings, f"pool_{carga}_statement_timeout_ms")
+    if timeout_ms > 0:
+        parametros_servidor["statement_timeout"] = str(timeout_ms)
+    if url is not None:
+        parametros_servidor["default_transaction_read_only"] = "on"
+    return create_async_engine(
+        (url or settings.get_database_url()).replace("postgresql://", "postgresql+asyncpg://"),
+        echo=settings.debug,
+        pool_size=getattr(settings, f"pool_{carga}_tamano"),
+        max_overflow=getattr(settings, f"pool_{carga}_desborde"),
+        pool_timeout=settings.pool_espera_maxima_segundos,
+        pool_pre_ping=True,
+        connect_args={"server_settings": parametros_servidor},
+    )
+
+
+# Motores por carga: un reporte de varios años no puede dejar sin conexiones al dashboard
+motores: Dict[str, AsyncEngine] = {carga: _crear_motor(carga) for carga in CARGAS}
+
+# Session makers por carga
+sesiones: Dict[str, async_sessionmaker] = {
+    carga: async_sessionmaker(motor, class_=AsyncSession, expire_on_commit=False)
+    for carga, motor in motores.items()
+}
+
+# Motor y sesiones por defecto: KPIs interactivos y tareas cortas
+engine = motores[INTERACTIVO]
+AsyncSessionLocal = sesiones[INTERACTIVO]
+
+
+@dataclass
+class Replica:
+    """Réplica de lectura, con un pool por cada carga de solo lectura"""
+    nombre: str
+    motores: Dict[str, AsyncEngine]
+    sesiones: Dict[str, async_sessionmaker]
+
+
+def _crear_replica(nombre: str, url: str) -> Replica:
+    motores_replica = {carga: _crear_motor(carga, url) for carga in CARGAS_LECTURA}
+    return Replica(
+        nombre=nombre,
+        motores=motores_replica,
+        sesiones={
+            carga: async_sessionmaker(motor, class_=AsyncSession, expire_on_commit=False)
+            for carga, motor in motores_replica.items()
+        },
+    )
+
+
+# Réplicas de lectura (`replicas_urls`); vacío si todo va a la primaria
+replicas: List[Replica] = [
+    _crear_replica(f"replica{indice}", url)
+    for indice, url in enumerate(settings.replicas_urls, start=1)
+]
+
+
+def todos_los_motores() -> Dict[str, AsyncEngine]:
+    """Motores por etiqueta de pool: `carga` en la primaria y `carga@réplica` en las réplicas"""
+    todos = dict(motores)
+    for replica in replicas:
+        for carga, motor in replica.motores.items():
+            todos[f"{carga}@{replica.nombre}"] = motor
+    return todos
+
+
+class BaseDatosNoDisponible(Exception):
+    """El circuito está abierto y no se envían consultas a la base de datos"""
+    pass
+
+
+# Errores que indican una base de datos lenta o caída (no errores de SQL)
+ERRORES_DISPONIBILIDAD = (
+    asyncio.TimeoutError, OperationalError, InterfaceError, PoolTimeoutError, OSError
 )
 
-# Session maker
-AsyncSessionLocal = async_sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False
+
+class CircuitBreaker:
+    """
+    Circuit breaker para las lecturas de KPIs.
+
+    Tras `umbral_fallos` fallos de disponibilidad consecutivos el circuito se
+    abre y las lecturas fallan de inmediato. Pasado `espera_segundos`, una
+    única sonda `SELECT 1` decide si se vuelve a cerrar.
+    """
+
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, umbral_fallos: int, espera_segundos: float, timeout_segundos: float):
+        self.umbral_fallos = umbral_fallos
+        self.espera_segundos = espera_segundos
+        self.timeout_segundos = timeout_segundos
+        self.estado = self.CERRADO
+        self.fallos_consecutivos = 0
+        self._abierto_desde = 0.0
+        self._lock_sonda = asyncio.Lock()
+
+    def _abrir(self):
+        if self.estado != self.ABIERTO:
+            logger.warning("⚠️ Circuito de base de datos abierto")
+        self.estado = self.ABIERTO
+        self._abierto_desde = time.monotonic()
+
+    def _cerrar(self):
+        if self.estado != self.CERRADO:
+            logger.info("✅ Circuito de base de datos cerrado")
+        self.estado = self.CERRADO
+        self.fallos_consecutivos = 0
+
+    def registrar_exito(self):
+        self._cerrar()
+
+    def registrar_fallo(self):
+        self.fallos_consecutivos += 1
+        if self.fallos_consecutivos >= self.umbral_fallos:
+            self._abrir()
+
+    async def _sondear(self) -> bool:
+        try:
+            async with engine.connect() as conn:
+                await asyncio.wait_for(conn.execute(text("SELECT 1")), self.timeout_segundos)
+            return True
+        except ERRORES_DISPONIBILIDAD:
+            return False
+
+    async def permitir(self):
+        """Lanza BaseDatosNoDisponible si el circuito no deja pasar consultas"""
+        if self.estado == self.CERRADO:
+            return
+        if time.monotonic() - self._abierto_desde < self.espera_segundos or self._lock_sonda.locked():
+            raise BaseDatosNoDisponible("La base de datos no está disponible temporalmente")
+
+        async with self._lock_sonda:
+            self.estado = self.SEMIABIERTO
+            if await self._sondear():
+                self._cerrar()
+            else:
+                self._abrir()
+                raise BaseDatosNoDisponible("La base de datos no respondió a la sonda")
+
+    async def ejecutar(self, consulta: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """Ejecuta una lectura protegida por el circuito y con timeout"""
+        await self.permitir()
+        try:
+            resultado = await asyncio.wait_for(consulta(), timeout or self.timeout_segundos)
+        except ERRORES_DISPONIBILIDAD:
+            self.registrar_fallo()
+            raise
+        self.registrar_exito()
+        return resultado
+
+
+circuit_breaker = CircuitBreaker(
+    umbral_fallos=settings.circuito_umbral_fallos,
+    espera_segundos=settings.circuito_espera_segundos,
+    timeout_segundos=settings.kpi_timeout_segundos,
 )
 
 
@@ -63,5 +229,6 @@ async def close_database():
     """
     Cerrar conexiones de la base de datos
     """
-    await engine.dispose()
+    for motor in todos_los_motores().values():
+        await motor.dispose()
     logger.info("🔒 Conexiones de base de datos cerradas")
\ No newline at end of file
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import field_validator
-from typing import List, Union
+from typing import Dict, List, Union
 import os
 
 
@@ -24,7 +24,168 @@ class Settings(BaseSettings):
     # GraphQL
     enable_introspection: bool = True
     enable_playground: bool = True
-    
+    # Cache LRU de documentos parseados/validados y consultas persistidas (APQ)
+    graphql_cache_documentos: int = 256
+    graphql_max_consultas_persistidas: int = 1000
+    # Manifiesto de operaciones permitidas; vacío = se acepta cualquier consulta
+    graphql_lista_permitida: str = ""
+    # Cache de respuestas completas (ETag/304 en GET), invalidado por la versión de datos
+    cache_respuestas_habilitado: bool = True
+    cache_respuestas_max_entradas: int = 512
+    cache_respuestas_ttl_segundos: float = 30.0
+    version_datos_intervalo_segundos: float = 2.0
+
+    # Métricas de Prometheus en /metrics (máximo de series por métrica)
+    metricas_habilitadas: bool = True
+    metricas_max_series: int = 500
+    # Estadísticas por huella de SQL y log de sentencias lentas (con parámetros)
+    sql_umbral_lento_ms: float = 500.0
+    sql_max_huellas: int = 500
+    # EXPLAIN ANALYZE por request con el encabezado de depuración (nunca en producción)
+    explain_habilitado: bool = False
+    explain_cabecera: str = "X-Debug-Explain"
+    explain_max_sentencias: int = 50
+    # Perfilado de un request con el encabezado (muestreo de CPU/esperas y tracemalloc)
+    perfilado_habilitado: bool = False
+    perfilado_cabecera: str = "X-Profile"
+    perfilado_intervalo_ms: float = 2.0
+    perfilado_memoria_top: int = 25
+    directorio_perfiles: str = "perfiles"
+    # Trazas distribuidas: muestreo en la cabecera; el traceparent del gateway manda
+    trazas_habilitadas: bool = False
+    trazas_muestreo: float = 0.05
+    trazas_exportador: str = "memoria"  # memoria | archivo
+    trazas_archivo: str = "trazas/spans.jsonl"
+    trazas_max_spans_memoria: int = 10000
+
+    # Pools por carga de trabajo (statement_timeout en ms, 0 = sin límite).
+    # Máximo total de conexiones: suma de tamaño + desborde de los tres pools
+    pool_interactivo_tamano: int = 10
+    pool_interactivo_desborde: int = 10
+    pool_interactivo_statement_timeout_ms: int = 15000
+    pool_reportes_tamano: int = 4
+    pool_reportes_desborde: int = 2
+    pool_reportes_statement_timeout_ms: int = 300000
+    pool_exportaciones_tamano: int = 2
+    pool_exportaciones_desborde: int = 2
+    pool_exportaciones_statement_timeout_ms: int = 0
+    # Espera máxima por una conexión antes de fallar con TimeoutError
+    pool_espera_maxima_segundos: float = 30.0
+
+    # Plazo por campo raíz en segundos (`Tipo.campo` para excepciones). Se aplica
+    # como statement_timeout y al vencer se cancela la sentencia en Postgres
+    plazo_operacion_segundos: float = 30.0
+    plazos_campos_segundos: Dict[str, float] = {
+        "Query.generarReporteFinanciero": 90.0,
+        "Query.generarReporteClinico": 90.0,
+        "Query.generarReporteOperacional": 90.0,
+        "Query.generarReporteInventario": 90.0,
+        "Query.generarReporteCompleto": 240.0,
+    }
+    # Cada cuánto se comprueba si el cliente HTTP sigue conectado
+    desconexion_sondeo_segundos: float = 0.5
+
+    # Réplicas de lectura (URLs postgresql:// separadas por comas; vacío = solo primaria).
+    # Los KPIs y reportes leen de la réplica si su retraso no supera el máximo del
+    # campo (`Tipo.campo` para excepciones); si no, de la primaria
+    replicas_urls: Union[List[str], str] = []
+    replicas_intervalo_retraso_segundos: float = 2.0
+    replicas_max_retraso_segundos: float = 30.0
+    replicas_max_retraso_campos: Dict[str, float] = {
+        "Query.dashboardResumen": 5.0,
+        "Query.alertasVacunacion": 10.0,
+    }
+    # Lecturas cubiertas: si un KPI tarda más que su percentil de latencia se
+    # lanza la misma consulta en otra réplica y gana la primera respuesta
+    replicas_cobertura_habilitada: bool = False
+    replicas_cobertura_percentil: float = 0.95
+    replicas_cobertura_minimo_ms: float = 20.0
+    replicas_cobertura_min_muestras: int = 20
+    replicas_cobertura_max_en_vuelo: int = 4
+
+    @field_validator('replicas_urls')
+    @classmethod
+    def parse_replicas_urls(cls, v):
+        """Convierte la cadena de URLs separada por comas en una lista"""
+        if isinstance(v, str):
+            return [url.strip() for url in v.split(',') if url.strip()]
+        return v
+
+    # Conexiones por request GraphQL
+    max_conexiones_por_request: int = 4
+    exponer_metricas_conexion: bool = True
+
+    # Cache de KPIs (TTL en segundos por KPI)
+    cache_kpi_habilitado: bool = True
+    cache_kpi_max_entradas: int = 256
+    cache_kpi_ttl_segundos: float = 30.0
+    cache_kpi_ttls: Dict[str, float] = {
+        "dashboard_resumen": 10.0,
+        "citas_por_mes": 60.0,
+        "mascotas_por_especie": 300.0,
+        "doctor_performance": 60.0,
+        "vacunacion_estadisticas": 60.0,
+        "alertas_vacunacion": 60.0,
+    }
+    # Stale-while-revalidate: segundos tras expirar en que aún se sirve el último valor
+    cache_kpi_servir_obsoleto: bool = True
+    cache_kpi_max_obsolescencia_segundos: float = 3600.0
+
+    # Vistas materializadas (opt-in): lectura de KPIs y refresco periódico
+    kpi_usar_vistas_materializadas: bool = False
+    vistas_refresco_segundos: float = 300.0
+    # Tablas resumen mantenidas por triggers (opt-in, instaladas por init_db.py)
+    kpi_usar_tablas_resumen: bool = False
+
+    # Circuit breaker de lecturas de KPIs
+    kpi_timeout_segundos: float = 10.0
+    circuito_umbral_fallos: int = 5
+    circuito_espera_segundos: float = 30.0
+
+    # Paginación por cursor de alertas de vacunación
+    alertas_pagina_defecto: int = 50
+    alertas_pagina_maxima: int = 500
+
+    # Exportación en streaming (filas por lote del cursor y bloques CSV encolados)
+    exportacion_lote_filas: int = 2000
+    exportacion_bloques_en_vuelo: int = 8
+    exportacion_tamano_bloque: int = 65536
+
+    # Renderizado de PDFs y gráficos en procesos separados
+    render_procesos: int = 2
+    render_max_pendientes: int = 8
+    render_cache_graficos: int = 128
+
+    # Almacén de reportes generados (direccionado por contenido, LRU + TTL)
+    directorio_reportes: str = "reportes_generados"
+    artefactos_max_bytes: int = 1024 * 1024 * 1024
+    artefactos_ttl_segundos: float = 86400.0
+
+    # Admisión de reportes: cupos por tipo (financiero, clinico, ...) y totales,
+    # cola con espera máxima y prioridad de los KPIs interactivos
+    admision_reportes_max_por_tipo: Dict[str, int] = {"inventario": 1}
+    admision_reportes_max_por_tipo_defecto: int = 2
+    admision_reportes_max_total: int = 4
+    admision_reportes_max_en_cola: int = 20
+    admision_reportes_espera_maxima_segundos: float = 20.0
+    admision_reportes_umbral_interactivo: int = 8
+
+    # Cola persistente de reportes (trabajadores por proceso)
+    reportes_trabajadores: int = 2
+    reportes_intervalo_sondeo_segundos: float = 5.0
+    reportes_expiracion_segundos: float = 900.0
+
+    # Reportes programados: tras el corte del período se calculan en la
+    # ventana valle [inicio, inicio + ventana) y se entregan a la hora indicada
+    programacion_habilitada: bool = True
+    programacion_intervalo_segundos: float = 60.0
+    programacion_inicio_valle_horas: float = 1.0
+    programacion_ventana_valle_horas: float = 4.0
+    programacion_hora_entrega: float = 7.0
+    programacion_destino: str = "archivo"  # archivo | smtp_falso
+    programacion_remitente: str = "reportes@veterinaria.local"
+    directorio_entregas: str = "entregas_reportes"
+
     # CORS
     allowed_origins: Union[List[str], str] = [
         "http://localhost:3000",
@@ -0,0 +1,161 @@
+"""
+Cache de respuestas completas de operaciones GraphQL
+
+Solo se cachean queries cuyos campos raíz son lecturas de KPIs o reportes
+(`CAMPOS_CACHEABLES`). La clave es el hash del documento, el nombre de la
+operación y las variables; el ETag agrega la versión de los datos y la
+fecha (varios KPIs dependen de CURRENT_DATE). Si los datos cambian, el
+ETag cambia y las entradas anteriores dejan de servirse.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Optional
+
+from graphql import FieldNode, GraphQLError, OperationDefinitionNode, OperationType, parse
+from strawberry.http import GraphQLRequestData
+
+from app.config.settings import settings
+from app.services.version_datos import vigia_version
+
+# Lecturas deterministas dados los datos y la fecha
+CAMPOS_CACHEABLES = frozenset({
+    "__typename",
+    "_entities",
+    "dashboardResumen",
+    "citasPorMes",
+    "estadisticasMascotasPorEspecie",
+    "doctorPerformance",
+    "vacunacionEstadisticas",
+    "alertasVacunacion",
+    "alertasVacunacionConexion",
+    "kpiDoctor",
+    "kpiMascota",
+    "generarReporteFinanciero",
+    "generarReporteClinico",
+    "generarReporteOperacional",
+    "generarReporteInventario",
+    "generarReporteCompleto",
+    "obtenerTiposReporte",
+})
+
+
+class RespuestaNoModificada(Exception):
+    """El cliente ya tiene la respuesta vigente (If-None-Match); se responde 304"""
+
+    def __init__(self, etag: str, cache_control: str):
+        super().__init__(etag)
+        self.etag = etag
+        self.cache_control = cache_control
+
+
+@lru_cache(maxsize=settings.graphql_cache_documentos)
+def campos_raiz(consulta: str, operacion: Optional[str]) -> Optional[FrozenSet[str]]:
+    """Campos raíz de la query a ejecutar; None si no es una query simple"""
+    try:
+        documento = parse(consulta)
+    except GraphQLError:
+        return None
+    operaciones = [d for d in documento.definitions if isinstance(d, OperationDefinitionNode)]
+    if operacion is not None:
+        operaciones = [o for o in operaciones if o.name and o.name.value == operacion]
+    if len(operaciones) != 1 or operaciones[0].operation != OperationType.QUERY:
+        return None
+    campos = set()
+    for seleccion in operaciones[0].selection_set.selections:
+        # Fragmentos en la raíz: no se analizan, la operación no se cachea
+        if not isinstance(seleccion, FieldNode):
+            return None
+        campos.add(seleccion.name.value)
+    return frozenset(campos)
+
+
+@dataclass
+class OperacionCacheable:
+    clave: str
+    etag: str
+    version: int
+
+
+@dataclass
+class EntradaRespuesta:
+    etag: str
+    datos: Dict[str, Any]
+    creada: float
+
+
+class CacheRespuestas:
+    """LRU de respuestas (`data`) por operación, válidas mientras no cambie el ETag"""
+
+    def __init__(self, max_entradas: int, ttl_segundos: float):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._entradas: "OrderedDict[str, EntradaRespuesta]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.no_modificadas = 0
+
+    @property
+    def cache_control(self) -> str:
+        return f"public, max-age={int(self.ttl_segundos)}"
+
+    def operacion(self, datos: GraphQLRequestData) -> Optional[OperacionCacheable]:
+        """Clave y ETag de la operación, o None si no se puede cachear"""
+        version = vigia_version.version
+        if not settings.cache_respuestas_habilitado or version is None or not datos.query:
+            return None
+        campos = campos_raiz(datos.query, datos.operation_name)
+        if not campos or not campos <= CAMPOS_CACHEABLES:
+            return None
+        clave = hashlib.sha256(json.dumps(
+            [datos.query, datos.operation_name, datos.variables], sort_keys=True, default=str
+        ).encode()).hexdigest()
+        etag = hashlib.sha256(f"{clave}:{version}:{date.today()}".encode()).hexdigest()[:32]
+        return OperacionCacheable(clave=clave, etag=f'"{etag}"', version=version)
+
+    def obtener(self, operacion: OperacionCacheable) -> Optional[Dict[str, Any]]:
+        entrada = self._entradas.get(operacion.clave)
+        if (
+            entrada is None
+            or entrada.etag != operacion.etag
+            or time.monotonic() - entrada.creada > self.ttl_segundos
+        ):
+            self.misses += 1
+            return None
+        self._entradas.move_to_end(operacion.clave)
+        self.hits += 1
+        return entrada.datos
+
+    def guardar(self, operacion: OperacionCacheable, datos: Dict[str, Any]):
+        self._entradas[operacion.clave] = EntradaRespuesta(operacion.etag, datos, time.monotonic())
+        self._entradas.move_to_end(operacion.clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+
+def reporta_obsoletos(extensiones: Optional[Dict[str, Any]]) -> bool:
+    """True si `extensions.frescura` avisa de algún KPI servido con datos obsoletos"""
+    avisos = (extensiones or {}).get("frescura") or {}
+    return any(aviso.get("obsoleto") for aviso in avisos.values())
+
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """Compara un encabezado If-None-Match (lista, `W/` o `*`) con el ETag"""
+    if not if_none_match:
+        return False
+    candidatos = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidatos or any(c.removeprefix("W/") == etag for c in candidatos)
+
+
+# Cache global de respuestas GraphQL
+cache_respuestas = CacheRespuestas(
+    max_entradas=settings.cache_respuestas_max_entradas,
+    ttl_segundos=settings.cache_respuestas_ttl_segundos,
+)
@@ -0,0 +1,217 @@
+"""
+Contexto por request para el schema GraphQL
+Administra las conexiones a la base de datos de toda una operación
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import AsyncIterator, Dict, Any, List, Optional
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
+from strawberry.dataloader import DataLoader
+from strawberry.fastapi import BaseContext
+
+from app.config.database import INTERACTIVO, REPORTES, sesiones
+from app.config.settings import settings
+from app.models.kpi_models import KpiDoctor, KpiMascota
+from app.services.admision import regulador_reportes
+from app.services.kpi_service_real import KPIServiceReal
+from app.services.metricas import conexiones_agotadas, espera_conexion
+from app.services.plazos import aplicar_statement_timeout
+from app.services.replicas import enrutador_replicas
+from app.services.report_service import ReportService
+
+
+@dataclass
+class MetricasConexion:
+    """Métricas de uso de conexiones de un request"""
+    checkouts: int = 0
+    reutilizaciones: int = 0
+    espera_total_ms: float = 0.0
+    espera_maxima_ms: float = 0.0
+    concurrencia_maxima: int = 0
+
+    def registrar_espera(self, espera_ms: float):
+        """Acumula el tiempo de espera por una conexión"""
+        self.espera_total_ms += espera_ms
+        self.espera_maxima_ms = max(self.espera_maxima_ms, espera_ms)
+
+    def como_dict(self) -> Dict[str, Any]:
+        datos = asdict(self)
+        datos["espera_total_ms"] = round(self.espera_total_ms, 3)
+        datos["espera_maxima_ms"] = round(self.espera_maxima_ms, 3)
+        return datos
+
+
+def _timeout_pool_ms(carga: str) -> int:
+    return getattr(settings, f"pool_{carga}_statement_timeout_ms")
+
+
+class CargadoresKPI:
+    """
+    DataLoaders de las entidades de Federation. Las claves pedidas en un
+    mismo ciclo (todo un lote de `_entities`) se cargan con una consulta.
+    """
+
+    def __init__(self, contexto: "RequestContext"):
+        self._contexto = contexto
+        self.doctores = DataLoader(load_fn=self._cargar_doctores)
+        self.mascotas = DataLoader(load_fn=self._cargar_mascotas)
+
+    async def _cargar_doctores(self, ids: List[int]) -> List[Optional[KpiDoctor]]:
+        async with self._contexto.kpi_service(compartida=True) as kpi_service:
+            kpis = await kpi_service.get_kpis_doctores(list(ids))
+        return [kpis.get(doctor_id) for doctor_id in ids]
+
+    async def _cargar_mascotas(self, ids: List[int]) -> List[Optional[KpiMascota]]:
+        async with self._contexto.kpi_service(compartida=True) as kpi_service:
+            kpis = await kpi_service.get_kpis_mascotas(list(ids))
+        return [kpis.get(mascota_id) for mascota_id in ids]
+
+
+class RequestContext(BaseContext):
+    """
+    Contexto GraphQL con alcance de request.
+
+    Los campos raíz independientes se ejecutan en paralelo, cada uno con su
+    propia sesión del pool y limitados por `max_conexiones_por_request`.
+    Los campos ligeros comparten una única sesión que se usa en serie y se
+    devuelve al pool en cuanto no queda ningún campo esperándola.
+
+    Los KPIs usan el pool interactivo y los reportes el suyo, así un reporte
+    pesado no consume las conexiones del dashboard. La sesión compartida
+    siempre es del pool interactivo. Con réplicas configuradas, ambos pools
+    se toman de una réplica con retraso aceptable para el campo.
+    """
+
+    def __init__(self, max_conexiones: Optional[int] = None):
+        super().__init__()
+        self.metricas = MetricasConexion()
+        self._limite = asyncio.Semaphore(max_conexiones or settings.max_conexiones_por_request)
+        self._en_uso = 0
+        self._sesion_compartida: Optional[AsyncSession] = None
+        self._lock_compartida = asyncio.Lock()
+        self._pendientes_compartida = 0
+        self.cargadores = CargadoresKPI(self)
+
+    async def _abrir_sesion(self, carga: str = INTERACTIVO) -> AsyncSession:
+        """
+        Obtiene una sesión del pool de la carga respetando el límite del request,
+        en una réplica si alguna cumple el retraso máximo del campo en curso
+        y ya alcanzó la versión de datos de la respuesta
+        """
+        inicio = time.perf_counter()
+        await self._limite.acquire()
+        sesion = enrutador_replicas.sesiones_lectura(carga)()
+        try:
+            # Forzar el checkout para medir la espera real del pool
+            await sesion.connection()
+            if not await enrutador_replicas.al_dia(sesion):
+                await sesion.close()
+                sesion = sesiones[carga]()
+                await sesion.connection()
+        except BaseException as e:
+            await sesion.close()
+            self._limite.release()
+            if isinstance(e, PoolTimeoutError):
+                conexiones_agotadas.incrementar(carga)
+            raise
+        espera = time.perf_counter() - inicio
+        self.metricas.checkouts += 1
+        self.metricas.registrar_espera(espera * 1000)
+        espera_conexion.observar(espera, carga)
+        return sesion
+
+    async def _liberar_sesion(self, sesion: AsyncSession):
+        try:
+            await sesion.close()
+        finally:
+            self._limite.release()
+
+    def _entrar(self):
+        self._en_uso += 1
+        self.metricas.concurrencia_maxima = max(self.metricas.concurrencia_maxima, self._en_uso)
+
+    def _salir(self):
+        self._en_uso -= 1
+
+    @asynccontextmanager
+    async def sesion(self, compartida: bool = False, carga: str = INTERACTIVO) -> AsyncIterator[AsyncSession]:
+        """
+        Entrega una sesión para un campo, del pool de `carga`.
+        Con `compartida=True` se reutiliza la sesión compartida del request.
+        El statement_timeout se ajusta a lo que le queda al plazo del campo.
+        """
+        if not compartida:
+            sesion = await self._abrir_sesion(carga)
+            self._entrar()
+            try:
+                await aplicar_statement_timeout(sesion, _timeout_pool_ms(carga))
+                yield sesion
+            finally:
+                self._salir()
+                await self._liberar_sesion(sesion)
+            return
+
+        self._pendientes_compartida += 1
+        try:
+            inicio = time.perf_counter()
+            async with self._lock_compartida:
+                if self._sesion_compartida is None:
+                    self._sesion_compartida = await self._abrir_sesion()
+                else:
+                    self.metricas.reutilizaciones += 1
+                    self.metricas.registrar_espera((time.perf_counter() - inicio) * 1000)
+                self._entrar()
+                try:
+                    await aplicar_statement_timeout(self._sesion_compartida, _timeout_pool_ms(INTERACTIVO))
+                    yield self._sesion_compartida
+                except BaseException:
+                    await self._sesion_compartida.rollback()
+                    raise
+                finally:
+                    self._salir()
+                    if self._pendientes_compartida == 1:
+                        sesion, self._sesion_compartida = self._sesion_compartida, None
+                        await self._liberar_sesion(sesion)
+        finally:
+            self._pendientes_compartida -= 1
+
+    @asynccontextmanager
+    async def kpi_service(self, compartida: bool = False) -> AsyncIterator[KPIServiceReal]:
+        """Servicio de KPIs sobre una sesión del request; con prioridad sobre los reportes"""
+        async with regulador_reportes.interactivo(), self.sesion(compartida) as sesion:
+            yield KPIServiceReal(sesion)
+
+    @asynccontextmanager
+    async def report_service(
+        self, compartida: bool = False, tipo: Optional[str] = None
+    ) -> AsyncIterator[ReportService]:
+        """
+        Servicio de reportes sobre una sesión del pool de reportes.
+        Con `tipo` se pide antes el cupo de admisión: un reporte en cola no
+        retiene una conexión del pool (ni una transacción abierta).
+        """
+        if tipo is None:
+            async with self.sesion(compartida, carga=REPORTES) as sesion:
+                yield ReportService(sesion)
+            return
+        async with regulador_reportes.admitir(tipo), self.sesion(compartida, carga=REPORTES) as sesion:
+            yield ReportService(sesion)
+
+    async def cerrar(self):
+        """Devuelve al pool cualquier sesión que siga abierta"""
+        if self._sesion_compartida is not None:
+            sesion, self._sesion_compartida = self._sesion_compartida, None
+            await self._liberar_sesion(sesion)
+
+
+async def get_context() -> AsyncIterator[RequestContext]:
+    """Dependency de FastAPI que crea el contexto de cada request GraphQL"""
+    contexto = RequestContext()
+    try:
+        yield contexto
+    finally:
+        await contexto.cerrar()
@@ -0,0 +1,232 @@
+"""
+Extensiones de Strawberry para el schema GraphQL
+"""
+import time
+from inspect import isawaitable
+from typing import Any, Dict, Tuple
+
+from strawberry.extensions import SchemaExtension
+
+from app.config.settings import settings
+from app.services.estadisticas_sql import campo_actual
+from app.services.explain import captura_actual, explicar, solicita_explain
+from app.services.frescura import iniciar_avisos
+from app.services.metricas import errores_operaciones, latencia_campos, latencia_operaciones
+from app.services.plazos import con_plazo
+from app.services.trazas import span_actual, trazador
+
+# (tipo, campo) -> etiqueta de la métrica, o "" si el campo no se mide
+_campos_medidos: Dict[Tuple[str, str], str] = {}
+
+
+class MetricasConexionExtension(SchemaExtension):
+    """Agrega las métricas de conexiones del request a `extensions` de la respuesta"""
+
+    def get_results(self) -> Dict[str, Any]:
+        metricas = getattr(self.execution_context.context, "metricas", None)
+        if metricas is None or not settings.exponer_metricas_conexion:
+            return {}
+        return {"conexiones": metricas.como_dict()}
+
+
+class FrescuraDatosExtension(SchemaExtension):
+    """
+    Informa en `extensions.frescura` qué KPIs se sirvieron con datos obsoletos
+    o precalculados, junto con su edad en segundos
+    """
+
+    def on_operation(self):
+        self.avisos = iniciar_avisos()
+        yield
+
+    def get_results(self) -> Dict[str, Any]:
+        avisos = getattr(self, "avisos", None)
+        if not avisos:
+            return {}
+        return {"frescura": avisos}
+
+
+def _etiqueta_campo(info) -> str:
+    """
+    Se miden los campos raíz y los que tienen resolver propio; los campos que
+    solo leen un atributo quedan fuera para no encarecer cada valor resuelto
+    """
+    clave = (info.parent_type.name, info.field_name)
+    etiqueta = _campos_medidos.get(clave)
+    if etiqueta is None:
+        campo = info.parent_type.fields.get(info.field_name)
+        definicion = (campo.extensions or {}).get("strawberry-definition") if campo else None
+        raiz = info.parent_type.name in ("Query", "Mutation")
+        medir = raiz or (definicion is not None and definicion.base_resolver is not None)
+        etiqueta = _campos_medidos[clave] = f"{clave[0]}.{clave[1]}" if medir else ""
+    return etiqueta
+
+
+async def _medir_asincrono(resultado, inicio: float, etiqueta: str):
+    # El cuerpo del resolver corre al esperarlo: recién aquí queda etiquetado su SQL
+    token = campo_actual.set(etiqueta)
+    try:
+        return await resultado
+    finally:
+        campo_actual.reset(token)
+        latencia_campos.observar(time.perf_counter() - inicio, etiqueta)
+
+
+def _span_campo(info, etiqueta: str):
+    return trazador.iniciar_span(
+        etiqueta,
+        **{"graphql.field.path": ".".join(str(p) for p in info.path.as_list())},
+    )
+
+
+async def _trazar_asincrono(resultado, inicio: float, etiqueta: str, span):
+    token = span_actual.set(span)
+    error = None
+    try:
+        return await _medir_asincrono(resultado, inicio, etiqueta)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        span_actual.reset(token)
+        trazador.terminar(span, error)
+
+
+class MetricasPrometheusExtension(SchemaExtension):
+    """
+    Latencia por operación y por resolver para /metrics; además etiqueta
+    con el campo en curso las sentencias SQL que emite cada resolver y, si
+    el request se está trazando, abre un span por campo medido
+    """
+
+    def on_operation(self):
+        inicio = time.perf_counter()
+        yield
+        contexto = self.execution_context
+        operacion = contexto.operation_name or "anonima"
+        try:
+            tipo = contexto.operation_type.value
+        except Exception:
+            # Documento inválido: no llegó a haber operación
+            tipo = "invalida"
+        latencia_operaciones.observar(time.perf_counter() - inicio, tipo, operacion)
+        if contexto.result is not None and contexto.result.errors:
+            errores_operaciones.incrementar(operacion)
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        etiqueta = _etiqueta_campo(info)
+        if not etiqueta:
+            return _next(root, info, *args, **kwargs)
+        inicio = time.perf_counter()
+        span = _span_campo(info, etiqueta) if span_actual.get() is not None else None
+        token = campo_actual.set(etiqueta)
+        token_span = span_actual.set(span) if span is not None else None
+        try:
+            resultado = _next(root, info, *args, **kwargs)
+        except BaseException as e:
+            if span is not None:
+                trazador.terminar(span, e)
+            raise
+        finally:
+            campo_actual.reset(token)
+            if token_span is not None:
+                span_actual.reset(token_span)
+        if isawaitable(resultado):
+            if span is not None:
+                return _trazar_asincrono(resultado, inicio, etiqueta, span)
+            return _medir_asincrono(resultado, inicio, etiqueta)
+        latencia_campos.observar(time.perf_counter() - inicio, etiqueta)
+        if span is not None:
+            trazador.terminar(span)
+        return resultado
+
+
+class ExplainExtension(SchemaExtension):
+    """
+    Con `explain_habilitado` y el encabezado de depuración, devuelve en
+    `extensions.explain` el SQL y el plan EXPLAIN ANALYZE de cada sentencia
+    que ejecutaron los resolvers
+    """
+
+    async def on_operation(self):
+        self.planes = None
+        request = getattr(self.execution_context.context, "request", None)
+        if not solicita_explain(getattr(request, "headers", None)):
+            yield
+            return
+
+        captura = []
+        token = captura_actual.set(captura)
+        try:
+            yield
+        finally:
+            captura_actual.reset(token)
+        try:
+            self.planes = await explicar(captura)
+        except Exception as e:
+            self.planes = [{"error": f"No se pudieron obtener los planes: {e}"}]
+
+    def get_results(self) -> Dict[str, Any]:
+        planes = getattr(self, "planes", None)
+        if planes is None:
+            return {}
+        return {"explain": planes}
+
+
+class TrazasExtension(SchemaExtension):
+    """
+    Span raíz de la operación, continuación del `traceparent` del gateway.
+    Los spans de campos, métodos y SQL cuelgan de él a través de
+    `span_actual`; si la traza no se muestrea no se crea ninguno
+    """
+
+    def on_operation(self):
+        request = getattr(self.execution_context.context, "request", None)
+        cabeceras = getattr(request, "headers", None)
+        self.span = trazador.iniciar_traza(
+            "graphql.operation",
+            cabeceras.get("traceparent") if cabeceras is not None else None,
+        )
+        if self.span is None:
+            yield
+            return
+
+        token = span_actual.set(self.span)
+        try:
+            yield
+        finally:
+            span_actual.reset(token)
+            contexto = self.execution_context
+            operacion = contexto.operation_name or "anonima"
+            try:
+                tipo = contexto.operation_type.value
+            except Exception:
+                tipo = "invalida"
+            self.span.nombre = f"{tipo} {operacion}"
+            self.span.atributos.update({
+                "graphql.operation.name": operacion,
+                "graphql.operation.type": tipo,
+            })
+            errores = contexto.result.errors if contexto.result is not None else None
+            if errores:
+                self.span.error = "; ".join(error.message for error in errores[:5])
+            trazador.terminar(self.span)
+
+    def get_results(self) -> Dict[str, Any]:
+        span = getattr(self, "span", None)
+        if span is None:
+            return {}
+        return {"traza": {"traceId": span.trace_id, "spanId": span.span_id}}
+
+
+class PlazosExtension(SchemaExtension):
+    """
+    Aplica a cada campo raíz asíncrono su plazo (ver `app.services.plazos`):
+    al vencer se cancela el resolver y su sentencia en Postgres
+    """
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        resultado = _next(root, info, *args, **kwargs)
+        if info.path.prev is not None or not isawaitable(resultado):
+            return resultado
+        return con_plazo(resultado, f"{info.parent_type.name}.{info.field_name}")
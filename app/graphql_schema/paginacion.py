@@ -0,0 +1,20 @@
+"""
+Cursores opacos para las conexiones paginadas por clave
+"""
+import base64
+from datetime import date
+from typing import Tuple
+
+
+def codificar_cursor(fecha: date, id: int) -> str:
+    """Cursor de la clave (fecha, id)"""
+    return base64.urlsafe_b64encode(f"{fecha.isoformat()}:{id}".encode()).decode()
+
+
+def decodificar_cursor(cursor: str) -> Tuple[date, int]:
+    """Clave (fecha, id) de un cursor; ValueError si no es un cursor válido"""
+    try:
+        fecha, id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return date.fromisoformat(fecha), int(id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Cursor inválido: {cursor}") from e
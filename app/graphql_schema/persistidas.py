@@ -0,0 +1,137 @@
+"""
+Consultas persistidas (APQ) para el router GraphQL
+
+Protocolo de Apollo: el cliente envía solo
+`extensions.persistedQuery.sha256Hash`; si el hash no está registrado se
+responde `PersistedQueryNotFound` y el cliente reintenta con el texto de la
+consulta, que queda registrado bajo su hash.
+
+Con una lista permitida (`graphql_lista_permitida`) solo se aceptan las
+operaciones del manifiesto, ya sea por hash o por texto, y no se registran
+consultas nuevas.
+"""
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorConsultaPersistida(Exception):
+    """Error del protocolo de consultas persistidas, devuelto como error GraphQL"""
+
+    def __init__(self, mensaje: str, codigo: str, status_code: int = 200):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.codigo = codigo
+        self.status_code = status_code
+
+    def como_respuesta(self) -> Dict[str, Any]:
+        return {"errors": [{"message": self.mensaje, "extensions": {"code": self.codigo}}]}
+
+
+def hash_consulta(consulta: str) -> str:
+    return hashlib.sha256(consulta.encode("utf-8")).hexdigest()
+
+
+def cargar_manifiesto(ruta: Path) -> Dict[str, str]:
+    """
+    Lee un manifiesto de operaciones: el formato de Apollo
+    (`{"operations": [{"id": hash, "body": consulta}, ...]}`) o un objeto
+    `{hash: consulta}`. Los hashes se verifican contra el texto.
+    """
+    datos = json.loads(ruta.read_text(encoding="utf-8"))
+    if "operations" in datos:
+        operaciones = {operacion["id"]: operacion["body"] for operacion in datos["operations"]}
+    else:
+        operaciones = dict(datos)
+    for hash_declarado, consulta in operaciones.items():
+        if hash_consulta(consulta) != hash_declarado:
+            raise ValueError(f"El hash {hash_declarado} del manifiesto no corresponde a su consulta")
+    return operaciones
+
+
+class RegistroConsultas:
+    """Consultas registradas por hash, con expulsión LRU"""
+
+    def __init__(self, max_consultas: int, lista_permitida: Optional[Dict[str, str]] = None):
+        self.max_consultas = max_consultas
+        self.solo_permitidas = lista_permitida is not None
+        self._consultas: "OrderedDict[str, str]" = OrderedDict(lista_permitida or {})
+        self.aciertos = 0
+        self.no_encontradas = 0
+        self.registradas = 0
+
+    def __len__(self) -> int:
+        return len(self._consultas)
+
+    def _obtener(self, hash_sha256: str) -> Optional[str]:
+        consulta = self._consultas.get(hash_sha256)
+        if consulta is not None and not self.solo_permitidas:
+            self._consultas.move_to_end(hash_sha256)
+        return consulta
+
+    def _registrar(self, hash_sha256: str, consulta: str):
+        self._consultas[hash_sha256] = consulta
+        self.registradas += 1
+        while len(self._consultas) > self.max_consultas:
+            self._consultas.popitem(last=False)
+
+    def resolver(self, consulta: Optional[str], extensiones: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Texto de la consulta a ejecutar según el cuerpo del request"""
+        persistida = (extensiones or {}).get("persistedQuery")
+        if not persistida:
+            if consulta is not None and self.solo_permitidas:
+                if hash_consulta(consulta) not in self._consultas:
+                    raise ErrorConsultaPersistida(
+                        "Operación no permitida", "PERSISTED_QUERY_NOT_ALLOWED", 400
+                    )
+            return consulta
+
+        if persistida.get("version") != 1:
+            raise ErrorConsultaPersistida(
+                "Versión de persistedQuery no soportada", "PERSISTED_QUERY_NOT_SUPPORTED", 400
+            )
+        hash_sha256 = str(persistida.get("sha256Hash", "")).lower()
+
+        if consulta is None:
+            registrada = self._obtener(hash_sha256)
+            if registrada is None:
+                self.no_encontradas += 1
+                if self.solo_permitidas:
+                    raise ErrorConsultaPersistida(
+                        "Operación no permitida", "PERSISTED_QUERY_NOT_ALLOWED", 400
+                    )
+                raise ErrorConsultaPersistida("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+            self.aciertos += 1
+            return registrada
+
+        if hash_consulta(consulta) != hash_sha256:
+            raise ErrorConsultaPersistida(
+                "provided sha does not match query", "INVALID_PERSISTED_QUERY_HASH", 400
+            )
+        if self.solo_permitidas:
+            if hash_sha256 not in self._consultas:
+                raise ErrorConsultaPersistida(
+                    "Operación no permitida", "PERSISTED_QUERY_NOT_ALLOWED", 400
+                )
+        elif hash_sha256 not in self._consultas:
+            self._registrar(hash_sha256, consulta)
+        return consulta
+
+
+def _crear_registro() -> RegistroConsultas:
+    lista_permitida = None
+    if settings.graphql_lista_permitida:
+        lista_permitida = cargar_manifiesto(Path(settings.graphql_lista_permitida))
+        logger.info(f"🔒 Lista permitida con {len(lista_permitida)} operaciones")
+    return RegistroConsultas(settings.graphql_max_consultas_persistidas, lista_permitida)
+
+
+# Registro global de consultas persistidas
+consultas_persistidas = _crear_registro()
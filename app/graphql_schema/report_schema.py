@@ -2,22 +2,18 @@
 Schema GraphQL extendido para reportes de veterinaria
 """
 import strawberry
+from strawberry.types import Info
 from typing import List, Optional
 from datetime import datetime, date
 from app.models.report_models import (
     ReporteFinanciero, ReporteClinico, ReporteOperacional,
     ReporteInventario, ReporteCompleto, FiltrosReporte,
     ConfiguracionReporte, TipoReporte, FormatoReporte,
-    PeriodoReporte
+    PeriodoReporte, TrabajoReporte, ReporteProgramado
 )
-from app.services.report_service import ReportService
-from app.config.database import get_database
-
-
-async def get_report_service():
-    """Dependency para obtener el servicio de reportes"""
-    async for db in get_database():
-        yield ReportService(db)
+from app.services.exportacion import url_exportacion
+from app.services.trabajos_reporte import cola_reportes
+from app.services.programacion_reportes import programador_reportes
 
 
 @strawberry.type
@@ -27,6 +23,7 @@ class ReportQuery:
     @strawberry.field
     async def generar_reporte_financiero(
         self,
+        info: Info,
         fecha_inicio: date,
         fecha_fin: date,
         doctor_id: Optional[int] = None
@@ -39,12 +36,13 @@ class ReportQuery:
             doctor_id=doctor_id
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=TipoReporte.FINANCIERO.value) as report_service:
             return await report_service.generar_reporte_financiero(filtros)
     
     @strawberry.field
     async def generar_reporte_clinico(
         self,
+        info: Info,
         fecha_inicio: date,
         fecha_fin: date,
         doctor_id: Optional[int] = None,
@@ -59,12 +57,13 @@ class ReportQuery:
             especie=especie
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=TipoReporte.CLINICO.value) as report_service:
             return await report_service.generar_reporte_clinico(filtros)
     
     @strawberry.field
     async def generar_reporte_operacional(
         self,
+        info: Info,
         fecha_inicio: date,
         fecha_fin: date
     ) -> ReporteOperacional:
@@ -75,12 +74,13 @@ class ReportQuery:
             tipo_reporte=TipoReporte.OPERACIONAL
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=TipoReporte.OPERACIONAL.value) as report_service:
             return await report_service.generar_reporte_operacional(filtros)
     
     @strawberry.field
     async def generar_reporte_inventario(
         self,
+        info: Info,
         fecha_inicio: date,
         fecha_fin: date
     ) -> ReporteInventario:
@@ -91,12 +91,13 @@ class ReportQuery:
             tipo_reporte=TipoReporte.INVENTARIO
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=TipoReporte.INVENTARIO.value) as report_service:
             return await report_service.generar_reporte_inventario(filtros)
     
     @strawberry.field
     async def generar_reporte_completo(
         self,
+        info: Info,
         fecha_inicio: date,
         fecha_fin: date,
         tipo_reporte: TipoReporte,
@@ -122,19 +123,20 @@ class ReportQuery:
             incluir_comparaciones=True
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=filtros.tipo_reporte.value) as report_service:
             return await report_service.generar_reporte_completo(filtros, configuracion)
     
     @strawberry.field
-    async def obtener_tipos_reporte(self) -> List[str]:
+    async def obtener_tipos_reporte(self, info: Info) -> List[str]:
         """Obtiene los tipos de reportes disponibles"""
-        async for report_service in get_report_service():
+        async with info.context.report_service(compartida=True) as report_service:
             reportes = await report_service.obtener_reportes_disponibles()
             return [reporte["nombre"] for reporte in reportes]
     
     @strawberry.field
     async def reporte_comparativo_periodos(
         self,
+        info: Info,
         fecha_inicio_1: date,
         fecha_fin_1: date,
         fecha_inicio_2: date,
@@ -157,7 +159,7 @@ class ReportQuery:
             tipo_reporte=tipo_reporte
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=tipo_reporte.value) as report_service:
             if tipo_reporte == TipoReporte.FINANCIERO:
                 reporte_1 = await report_service.generar_reporte_financiero(filtros_1)
                 reporte_2 = await report_service.generar_reporte_financiero(filtros_2)
@@ -166,14 +168,19 @@ class ReportQuery:
         return []
     
     @strawberry.field
-    async def reportes_programados(self) -> List[str]:
+    async def trabajo_reporte(self, id_trabajo: str) -> Optional[TrabajoReporte]:
+        """Estado y progreso de un reporte encolado"""
+        return await cola_reportes.obtener(id_trabajo)
+    
+    @strawberry.field
+    async def resultado_trabajo_reporte(self, id_trabajo: str) -> Optional[ReporteCompleto]:
+        """Reporte de un trabajo completado"""
+        return await cola_reportes.resultado(id_trabajo)
+    
+    @strawberry.field
+    async def reportes_programados(self) -> List[ReporteProgramado]:
         """Obtiene lista de reportes programados automáticamente"""
-        # Implementar según necesidades de programación
-        return [
-            "Reporte Financiero Mensual",
-            "Reporte de Vacunación Semanal",
-            "Reporte Operacional Diario"
-        ]
+        return await programador_reportes.listar()
 
 
 # Mutations para reportes (opcional)
@@ -188,11 +195,9 @@ class ReportMutation:
         frecuencia: PeriodoReporte,
         email_destino: str,
         formato: FormatoReporte = FormatoReporte.PDF
-    ) -> str:
+    ) -> ReporteProgramado:
         """Programa un reporte para generación automática"""
-        
-        # Implementar lógica de programación
-        return f"Reporte {tipo_reporte.value} programado para envío {frecuencia.value} a {email_destino}"
+        return await programador_reportes.programar(tipo_reporte, frecuencia, email_destino, formato)
     
     @strawberry.field
     async def cancelar_reporte_programado(
@@ -200,17 +205,46 @@ class ReportMutation:
         id_programacion: str
     ) -> bool:
         """Cancela un reporte programado"""
-        
-        # Implementar lógica de cancelación
-        return True
+        return await programador_reportes.cancelar(id_programacion)
     
     @strawberry.field
     async def exportar_reporte(
         self,
-        id_reporte: str,
-        formato: FormatoReporte
+        tipo_reporte: TipoReporte,
+        fecha_inicio: date,
+        fecha_fin: date,
+        formato: FormatoReporte = FormatoReporte.CSV,
+        doctor_id: Optional[int] = None
     ) -> str:
-        """Exporta un reporte existente en el formato especificado"""
+        """Devuelve la URL que transmite el detalle del reporte en el formato especificado"""
+        return url_exportacion(tipo_reporte, fecha_inicio, fecha_fin, formato, doctor_id)
+    
+    @strawberry.field
+    async def encolar_reporte_completo(
+        self,
+        fecha_inicio: date,
+        fecha_fin: date,
+        tipo_reporte: TipoReporte,
+        incluir_graficos: bool = True,
+        formato: FormatoReporte = FormatoReporte.PDF,
+        doctor_id: Optional[int] = None,
+        especie: Optional[str] = None
+    ) -> TrabajoReporte:
+        """Encola un reporte completo y devuelve el trabajo"""
+        
+        filtros = FiltrosReporte(
+            fecha_inicio=fecha_inicio,
+            fecha_fin=fecha_fin,
+            tipo_reporte=tipo_reporte,
+            doctor_id=doctor_id,
+            especie=especie,
+            incluir_detalles=True
+        )
+        
+        configuracion = ConfiguracionReporte(
+            incluir_graficos=incluir_graficos,
+            formato_exportacion=formato,
+            incluir_comparaciones=True
+        )
         
-        # Implementar lógica de exportación
-        return f"Reporte exportado en formato {formato.value}"
\ No newline at end of file
+        return await cola_reportes.encolar(filtros, configuracion)
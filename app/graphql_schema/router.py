@@ -0,0 +1,135 @@
+"""
+Router GraphQL del subgrafo
+"""
+import asyncio
+import logging
+from contextlib import suppress
+
+from graphql import GraphQLError
+from strawberry.fastapi import GraphQLRouter
+from strawberry.http import GraphQLRequestData
+from strawberry.http.exceptions import HTTPException
+from strawberry.types import ExecutionResult
+
+from app.config.settings import settings
+from app.graphql_schema.cache_respuestas import (
+    RespuestaNoModificada,
+    cache_respuestas,
+    etag_coincide,
+    reporta_obsoletos,
+)
+from app.graphql_schema.persistidas import consultas_persistidas
+from app.services.admision import ReportesSaturados
+from app.services.explain import solicita_explain
+from app.services.plazos import desconexiones
+from app.services.replicas import version_requerida
+
+logger = logging.getLogger(__name__)
+
+
+class GraphQLRouterPersistido(GraphQLRouter):
+    """
+    GraphQLRouter que acepta consultas persistidas por hash y cachea las
+    respuestas de queries de lectura (ETag / 304 en GET). Si un reporte se
+    rechazó por falta de cupo, la respuesta lleva `Retry-After`; si el
+    cliente se desconecta, la operación se cancela.
+    """
+
+    async def parse_http_body(self, request) -> GraphQLRequestData:
+        # Se parsea una sola vez por request: execute_operation lo necesita
+        # antes de delegar en la implementación base
+        estado = request.request.state
+        if getattr(estado, "datos_graphql", None) is None:
+            estado.datos_graphql = await self._parsear_cuerpo(request)
+        return estado.datos_graphql
+
+    async def _parsear_cuerpo(self, request) -> GraphQLRequestData:
+        content_type = request.content_type or ""
+        if "application/json" in content_type:
+            datos = self.parse_json(await request.get_body())
+        elif request.method == "GET" and not content_type.startswith("multipart/form-data"):
+            datos = self.parse_query_params(request.query_params)
+        else:
+            return await super().parse_http_body(request)
+
+        if not isinstance(datos, dict):
+            raise HTTPException(400, "Se esperaba un objeto JSON")
+        extensiones = datos.get("extensions")
+        if isinstance(extensiones, str):
+            # En GET las extensiones llegan como JSON en la query string
+            extensiones = self.parse_json(extensiones)
+
+        return GraphQLRequestData(
+            query=consultas_persistidas.resolver(datos.get("query"), extensiones),
+            variables=datos.get("variables"),
+            operation_name=datos.get("operationName"),
+        )
+
+    async def execute_operation(self, request, context, root_value) -> ExecutionResult:
+        resultado = await self._ejecutar_vigilando_cliente(request, context, root_value)
+        # Reportes rechazados por falta de cupo: el tiempo de reintento también va en la cabecera
+        reintentos = [
+            error.original_error.reintentar_en
+            for error in resultado.errors or ()
+            if isinstance(error.original_error, ReportesSaturados)
+        ]
+        if reintentos:
+            context.response.headers["retry-after"] = str(max(reintentos))
+        return resultado
+
+    async def _ejecutar_vigilando_cliente(self, request, context, root_value) -> ExecutionResult:
+        """
+        Ejecuta la operación y, si el cliente se desconecta antes de que
+        termine, la cancela para que Postgres deje de trabajar para nadie
+        """
+        ejecucion = asyncio.ensure_future(self._ejecutar_con_cache(request, context, root_value))
+        try:
+            while True:
+                terminadas, _ = await asyncio.wait({ejecucion}, timeout=settings.desconexion_sondeo_segundos)
+                if terminadas:
+                    return ejecucion.result()
+                if await request.is_disconnected():
+                    break
+        finally:
+            if not ejecucion.done():
+                ejecucion.cancel()
+
+        desconexiones.incrementar()
+        logger.info("🔌 Cliente desconectado: se canceló la operación GraphQL")
+        with suppress(asyncio.CancelledError):
+            await ejecucion
+        return ExecutionResult(data=None, errors=[GraphQLError("El cliente se desconectó")])
+
+    async def _ejecutar_con_cache(self, request, context, root_value) -> ExecutionResult:
+        datos = await self.parse_http_body(self.request_adapter_class(request))
+        operacion = cache_respuestas.operacion(datos)
+        # Con EXPLAIN hay que ejecutar los resolvers de verdad
+        if operacion is None or solicita_explain(request.headers):
+            return await super().execute_operation(request, context, root_value)
+
+        if request.method == "GET":
+            # Solo GET es cacheable por el cliente y los proxies
+            if etag_coincide(request.headers.get("if-none-match"), operacion.etag):
+                cache_respuestas.no_modificadas += 1
+                raise RespuestaNoModificada(operacion.etag, cache_respuestas.cache_control)
+            context.response.headers["etag"] = operacion.etag
+            context.response.headers["cache-control"] = cache_respuestas.cache_control
+
+        guardada = cache_respuestas.obtener(operacion)
+        if guardada is not None:
+            return ExecutionResult(data=guardada, errors=None, extensions={"cacheRespuesta": "hit"})
+
+        # Las réplicas que no alcanzaron la versión del ETag no participan
+        token = version_requerida.set(operacion.version)
+        try:
+            resultado = await super().execute_operation(request, context, root_value)
+        finally:
+            version_requerida.reset(token)
+        # Un resultado obsoleto no puede quedar bajo el ETag de la versión actual
+        if resultado.errors or reporta_obsoletos(resultado.extensions):
+            context.response.headers["cache-control"] = "no-store"
+            if "etag" in context.response.headers:
+                del context.response.headers["etag"]
+        elif resultado.data is not None:
+            cache_respuestas.guardar(operacion, resultado.data)
+        return resultado
@@ -3,37 +3,42 @@ Schema GraphQL para KPIs de veterinaria - Compatible con Apollo Federation
 Incluye funcionalidades de KPIs y Reportes
 """
 import strawberry
+from strawberry.extensions import ParserCache, ValidationCache
+from strawberry.printer import print_schema
+from strawberry.types import Info
 from typing import List, Optional
 from datetime import datetime, date
 from app.models.kpi_models import (
     CitasPorMes, MascotasPorEspecie, DoctorPerformance,
-    VacunacionEstadisticas, DashboardResumen, AlertaVacunacion
+    VacunacionEstadisticas, DashboardResumen, AlertaVacunacion,
+    AlertaVacunacionConnection, AlertaVacunacionEdge, FiltroAlertasVacunacion, PageInfo,
+    KpiDoctor, KpiMascota
 )
 from app.models.report_models import (
     ReporteFinanciero, ReporteClinico, ReporteOperacional,
-    ReporteInventario, ReporteCompleto, TipoReporte, FormatoReporte
+    ReporteInventario, ReporteCompleto, TipoReporte, FormatoReporte,
+    FiltrosReporte, ConfiguracionReporte, TrabajoReporte,
+    PeriodoReporte, ReporteProgramado
+)
+from app.models.admin_models import (
+    EstadisticasCacheKPI, EstadisticasRenderizado, EstadisticasConsultasPersistidas,
+    EstadisticasCacheRespuestas, EstadisticaSentenciaSql, OrigenSentenciaSql
+)
+from app.config.settings import settings
+from app.services.cache import cache_kpis
+from app.services.exportacion import url_exportacion
+from app.services.renderizado import renderizador
+from app.services.trabajos_reporte import cola_reportes
+from app.services.programacion_reportes import programador_reportes
+from app.services.version_datos import vigia_version
+from app.services.estadisticas_sql import estadisticas_sql
+from app.graphql_schema.paginacion import codificar_cursor, decodificar_cursor
+from app.graphql_schema.persistidas import consultas_persistidas
+from app.graphql_schema.cache_respuestas import cache_respuestas
+from app.graphql_schema.extensions import (
+    MetricasConexionExtension, FrescuraDatosExtension, MetricasPrometheusExtension, ExplainExtension,
+    TrazasExtension, PlazosExtension,
 )
-from app.services.kpi_service_real import KPIServiceReal
-from app.services.report_service import ReportService
-from app.config.database import get_database
-
-
-async def get_kpi_service():
-    """Dependency para obtener el servicio de KPIs REAL"""
-    async for db in get_database():
-        yield KPIServiceReal(db)
-
-
-async def get_report_service():
-    """Dependency para obtener el servicio de reportes"""
-    async for db in get_database():
-        yield ReportService(db)
-
-
-# Tipo _Service requerido por Apollo Federation
-@strawberry.type
-class _Service:
-    sdl: str
 
 
 @strawberry.type
@@ -43,224 +48,97 @@ class Query:
     Compatible con Apollo Federation
     """
 
-    # Campo _service requerido por Apollo Federation
-    @strawberry.field(name="_service")
-    def service_field(self) -> _Service:
-        """Campo _service requerido por Apollo Federation para composición del schema"""
-        sdl = '''
-            type Query {
-                # KPIs
-                dashboardResumen: DashboardResumen!
-                citasPorMes(anio: Int): [CitasPorMes!]!
-                estadisticasMascotasPorEspecie: [MascotasPorEspecie!]!
-                doctorPerformance(mes: Int, anio: Int): [DoctorPerformance!]!
-                vacunacionEstadisticas: VacunacionEstadisticas!
-                alertasVacunacion(diasLimite: Int = 30): [AlertaVacunacion!]!
-                health: String!
-                
-                # Reportes
-                generarReporteFinanciero(fechaInicio: Date!, fechaFin: Date!, doctorId: Int): ReporteFinanciero!
-                generarReporteClinico(fechaInicio: Date!, fechaFin: Date!, doctorId: Int, especie: String): ReporteClinico!
-                generarReporteOperacional(fechaInicio: Date!, fechaFin: Date!): ReporteOperacional!
-                generarReporteInventario(fechaInicio: Date!, fechaFin: Date!): ReporteInventario!
-                generarReporteCompleto(fechaInicio: Date!, fechaFin: Date!, tipoReporte: TipoReporte!, incluirGraficos: Boolean = true, formato: FormatoReporte = PDF, doctorId: Int, especie: String): ReporteCompleto!
-                obtenerTiposReporte: [String!]!
-            }
-
-            # Tipos KPI
-            type DashboardResumen {
-                totalMascotas: Int!
-                totalCitas: Int!
-                totalClientes: Int!
-                citasHoy: Int!
-                ingresosMes: Float!
-                crecimientoMensual: Float
-            }
-
-            type CitasPorMes {
-                mes: String!
-                anio: Int!
-                totalCitas: Int!
-                citasCompletadas: Int!
-                citasCanceladas: Int!
-                tasaCompletitud: Float!
-            }
-
-            type MascotasPorEspecie {
-                especie: String!
-                totalMascotas: Int!
-                porcentaje: Float!
-            }
-
-            type DoctorPerformance {
-                doctorId: Int!
-                doctorNombre: String!
-                totalCitas: Int!
-                citasCompletadas: Int!
-                tasaCompletitud: Float!
-                promedioDiagnosticosPorCita: Float!
-            }
-
-            type VacunacionEstadisticas {
-                totalVacunaciones: Int!
-                vacunacionesVencidas: Int!
-                vacunacionesProximas: Int!
-                vacunasMasAplicadas: [String!]!
-            }
-
-            type AlertaVacunacion {
-                mascotaId: Int!
-                mascotaNombre: String!
-                clienteNombre: String!
-                tipoVacuna: String!
-                fechaUltima: String
-                fechaProxima: String!
-                diasVencimiento: Int!
-                prioridad: String!
-            }
-
-            # Tipos Reportes
-            type ReporteFinanciero {
-                periodo: String!
-                fechaInicio: Date!
-                fechaFin: Date!
-                ingresosConsultas: Float!
-                ingresosVacunas: Float!
-                ingresosMedicamentos: Float!
-                ingresosCirugia: Float!
-                totalIngresos: Float!
-                costosOperativos: Float!
-                gananciaNeta: Float!
-                margenGanancia: Float!
-                comparacionPeriodoAnterior: Float!
-            }
-
-            type ReporteClinico {
-                periodo: String!
-                fechaInicio: Date!
-                fechaFin: Date!
-                totalConsultas: Int!
-                consultasPorTipo: [String!]!
-                diagnosticosFrecuentes: [String!]!
-                tratamientosAplicados: [String!]!
-                cirugiasRealizadas: Int!
-                vacunasAplicadas: Int!
-                tiempoPromedioConsulta: Float!
-                tasaSeguimiento: Float!
-            }
-
-            type ReporteOperacional {
-                periodo: String!
-                fechaInicio: Date!
-                fechaFin: Date!
-                ocupacionConsultorios: Float!
-                utilizacionEquipos: Float!
-                tiempoEsperaPromedio: Float!
-                cancelaciones: Int!
-                tasaCancelacion: Float!
-                reprogramaciones: Int!
-                satisfaccionCliente: Float
-                eficienciaPersonal: Float!
-            }
-
-            type ReporteInventario {
-                periodo: String!
-                fechaInicio: Date!
-                fechaFin: Date!
-                medicamentosUtilizados: [String!]!
-                stockBajo: [String!]!
-                productosVencidos: [String!]!
-                rotacionInventario: Float!
-                costoInventario: Float!
-                perdidasVencimiento: Float!
-            }
-
-            type ReporteCompleto {
-                metadata: MetadataReporte!
-                resumen: ResumenReporte!
-                reporteFinanciero: ReporteFinanciero
-                reporteClinico: ReporteClinico
-                reporteOperacional: ReporteOperacional
-                reporteInventario: ReporteInventario
-            }
-
-            type MetadataReporte {
-                idReporte: String!
-                fechaGeneracion: String!
-                usuarioSolicitante: String!
-                tiempoProcesamiento: Float!
-                totalRegistros: Int!
-                filtrosAplicados: String!
-            }
-
-            type ResumenReporte {
-                puntosClave: [String!]!
-                tendenciasPrincipales: [String!]!
-                alertas: [String!]!
-                recomendaciones: [String!]!
-                metricasDestacadas: [String!]!
-            }
-
-            enum TipoReporte {
-                FINANCIERO
-                CLINICO
-                OPERACIONAL
-                MARKETING
-                INVENTARIO
-            }
-
-            enum FormatoReporte {
-                PDF
-                EXCEL
-                CSV
-                JSON
-            }
-
-            scalar Date
-        '''
-        return _Service(sdl=sdl.strip())
-
     # === KPI QUERIES ===
     @strawberry.field
-    async def dashboardResumen(self) -> DashboardResumen:
+    async def dashboardResumen(self, info: Info) -> DashboardResumen:
         """Obtiene el resumen principal del dashboard"""
-        async for kpi_service in get_kpi_service():
+        async with info.context.kpi_service() as kpi_service:
             return await kpi_service.get_dashboard_resumen()
 
     @strawberry.field
-    async def citasPorMes(self, anio: Optional[int] = None) -> List[CitasPorMes]:
+    async def citasPorMes(self, info: Info, anio: Optional[int] = None) -> List[CitasPorMes]:
         """Obtiene estadísticas de citas agrupadas por mes"""
-        async for kpi_service in get_kpi_service():
+        async with info.context.kpi_service() as kpi_service:
             return await kpi_service.get_citas_por_mes(anio)
 
     @strawberry.field
-    async def estadisticasMascotasPorEspecie(self) -> List[MascotasPorEspecie]:
+    async def estadisticasMascotasPorEspecie(self, info: Info) -> List[MascotasPorEspecie]:
         """Obtiene estadísticas de mascotas agrupadas por especie"""
-        async for kpi_service in get_kpi_service():
+        async with info.context.kpi_service(compartida=True) as kpi_service:
             return await kpi_service.get_mascotas_por_especie()
 
     @strawberry.field
     async def doctorPerformance(
-        self, 
+        self,
+        info: Info,
         mes: Optional[int] = None, 
         anio: Optional[int] = None
     ) -> List[DoctorPerformance]:
         """Obtiene estadísticas de rendimiento por doctor"""
-        async for kpi_service in get_kpi_service():
+        async with info.context.kpi_service() as kpi_service:
             return await kpi_service.get_doctor_performance(mes, anio)
 
     @strawberry.field
-    async def vacunacionEstadisticas(self) -> VacunacionEstadisticas:
+    async def vacunacionEstadisticas(self, info: Info) -> VacunacionEstadisticas:
         """Obtiene estadísticas de vacunación"""
-        async for kpi_service in get_kpi_service():
+        async with info.context.kpi_service() as kpi_service:
             return await kpi_service.get_vacunacion_estadisticas()
 
-    @strawberry.field
-    async def alertasVacunacion(self, diasLimite: int = 30) -> List[AlertaVacunacion]:
+    @strawberry.field(deprecation_reason="Usar alertasVacunacionConexion")
+    async def alertasVacunacion(self, info: Info, diasLimite: int = 30) -> List[AlertaVacunacion]:
         """Obtiene alertas de vacunaciones próximas o vencidas"""
-        async for kpi_service in get_kpi_service():
+        async with info.context.kpi_service() as kpi_service:
             return await kpi_service.get_alertas_vacunacion(diasLimite)
 
+    @strawberry.field
+    async def alertasVacunacionConexion(
+        self,
+        info: Info,
+        first: Optional[int] = None,
+        after: Optional[str] = None,
+        filtro: Optional[FiltroAlertasVacunacion] = None
+    ) -> AlertaVacunacionConnection:
+        """Alertas de vacunación paginadas por cursor, ordenadas por próxima vacunación"""
+        primero = settings.alertas_pagina_defecto if first is None else first
+        if not 1 <= primero <= settings.alertas_pagina_maxima:
+            raise ValueError(f"first debe estar entre 1 y {settings.alertas_pagina_maxima}")
+        filtro = filtro or FiltroAlertasVacunacion()
+        despues = decodificar_cursor(after) if after else None
+
+        async with info.context.kpi_service() as kpi_service:
+            filas, hay_siguiente = await kpi_service.get_alertas_vacunacion_pagina(
+                primero,
+                despues,
+                dias_limite=filtro.dias_limite,
+                prioridades=[p.value for p in filtro.prioridades] if filtro.prioridades else None,
+                especie=filtro.especie,
+                vacuna=filtro.vacuna
+            )
+
+        edges = [
+            AlertaVacunacionEdge(cursor=codificar_cursor(fecha, id), node=alerta)
+            for fecha, id, alerta in filas
+        ]
+        return AlertaVacunacionConnection(
+            edges=edges,
+            page_info=PageInfo(
+                has_next_page=hay_siguiente,
+                has_previous_page=despues is not None,
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None
+            )
+        )
+
+    @strawberry.field
+    async def kpiDoctor(self, info: Info, doctorId: int) -> Optional[KpiDoctor]:
+        """KPIs históricos de un doctor (también resoluble como entidad `KpiDoctor`)"""
+        return await info.context.cargadores.doctores.load(doctorId)
+
+    @strawberry.field
+    async def kpiMascota(self, info: Info, mascotaId: int) -> Optional[KpiMascota]:
+        """KPIs de una mascota (también resoluble como entidad `KpiMascota`)"""
+        return await info.context.cargadores.mascotas.load(mascotaId)
+
     @strawberry.field
     async def health(self) -> str:
         """Health check del servicio KPI"""
@@ -270,6 +148,7 @@ class Query:
     @strawberry.field
     async def generarReporteFinanciero(
         self,
+        info: Info,
         fechaInicio: date,
         fechaFin: date,
         doctorId: Optional[int] = None
@@ -284,12 +163,13 @@ class Query:
             doctor_id=doctorId
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=TipoReporte.FINANCIERO.value) as report_service:
             return await report_service.generar_reporte_financiero(filtros)
 
     @strawberry.field
     async def generarReporteClinico(
         self,
+        info: Info,
         fechaInicio: date,
         fechaFin: date,
         doctorId: Optional[int] = None,
@@ -306,12 +186,13 @@ class Query:
             especie=especie
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=TipoReporte.CLINICO.value) as report_service:
             return await report_service.generar_reporte_clinico(filtros)
 
     @strawberry.field
     async def generarReporteOperacional(
         self,
+        info: Info,
         fechaInicio: date,
         fechaFin: date
     ) -> ReporteOperacional:
@@ -324,12 +205,13 @@ class Query:
             tipo_reporte=TipoReporte.OPERACIONAL
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=TipoReporte.OPERACIONAL.value) as report_service:
             return await report_service.generar_reporte_operacional(filtros)
 
     @strawberry.field
     async def generarReporteInventario(
         self,
+        info: Info,
         fechaInicio: date,
         fechaFin: date
     ) -> ReporteInventario:
@@ -342,12 +224,13 @@ class Query:
             tipo_reporte=TipoReporte.INVENTARIO
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=TipoReporte.INVENTARIO.value) as report_service:
             return await report_service.generar_reporte_inventario(filtros)
 
     @strawberry.field
     async def generarReporteCompleto(
         self,
+        info: Info,
         fechaInicio: date,
         fechaFin: date,
         tipoReporte: TipoReporte,
@@ -374,16 +257,211 @@ class Query:
             incluir_comparaciones=True
         )
         
-        async for report_service in get_report_service():
+        async with info.context.report_service(tipo=filtros.tipo_reporte.value) as report_service:
             return await report_service.generar_reporte_completo(filtros, configuracion)
 
     @strawberry.field
-    async def obtenerTiposReporte(self) -> List[str]:
+    async def obtenerTiposReporte(self, info: Info) -> List[str]:
         """Obtiene los tipos de reportes disponibles"""
-        async for report_service in get_report_service():
+        async with info.context.report_service(compartida=True) as report_service:
             reportes = await report_service.obtener_reportes_disponibles()
             return [reporte["nombre"] for reporte in reportes]
 
+    @strawberry.field
+    async def trabajoReporte(self, idTrabajo: str) -> Optional[TrabajoReporte]:
+        """Estado y progreso de un reporte encolado con encolarReporteCompleto"""
+        return await cola_reportes.obtener(idTrabajo)
+
+    @strawberry.field
+    async def resultadoTrabajoReporte(self, idTrabajo: str) -> Optional[ReporteCompleto]:
+        """Reporte de un trabajo completado; null si no existe o aún no termina"""
+        return await cola_reportes.resultado(idTrabajo)
+
+    @strawberry.field
+    async def reportesProgramados(self) -> List[ReporteProgramado]:
+        """Reportes programados activos, ordenados por próxima entrega"""
+        return await programador_reportes.listar()
+
+    # === ADMINISTRACIÓN ===
+    @strawberry.field
+    def estadisticasCacheKpi(self) -> EstadisticasCacheKPI:
+        """Contadores de hits, misses y coalescencia del cache de KPIs"""
+        estadisticas = cache_kpis.estadisticas
+        return EstadisticasCacheKPI(
+            entradas=len(cache_kpis),
+            hits=estadisticas.hits,
+            misses=estadisticas.misses,
+            coalescidos=estadisticas.coalescidos,
+            expulsiones=estadisticas.expulsiones,
+            invalidaciones=estadisticas.invalidaciones,
+            tasa_aciertos=round(estadisticas.tasa_aciertos() * 100, 2)
+        )
+
+    @strawberry.field
+    def estadisticasRenderizado(self) -> EstadisticasRenderizado:
+        """Cola, tiempos de render y aciertos de cache del pool de PDFs y gráficos"""
+        metricas = renderizador.metricas
+        trabajos = max(metricas.pdfs + metricas.graficos, 1)
+        return EstadisticasRenderizado(
+            procesos=renderizador.procesos,
+            profundidad_cola=renderizador.profundidad_cola,
+            en_pool=metricas.en_pool,
+            pdfs=metricas.pdfs,
+            graficos=metricas.graficos,
+            graficos_cache=metricas.graficos_cache,
+            errores=metricas.errores,
+            render_ms_promedio=round(metricas.render_ms_total / trabajos, 2),
+            render_ms_max=round(metricas.render_ms_max, 2),
+            espera_ms_promedio=round(metricas.espera_ms_total / trabajos, 2)
+        )
+
+    @strawberry.field
+    def estadisticasConsultasPersistidas(self) -> EstadisticasConsultasPersistidas:
+        """Consultas persistidas registradas y aciertos por hash"""
+        return EstadisticasConsultasPersistidas(
+            registradas=len(consultas_persistidas),
+            aciertos=consultas_persistidas.aciertos,
+            no_encontradas=consultas_persistidas.no_encontradas,
+            solo_permitidas=consultas_persistidas.solo_permitidas
+        )
+
+    @strawberry.field
+    def estadisticasCacheRespuestas(self) -> EstadisticasCacheRespuestas:
+        """Aciertos del cache de respuestas y 304 servidos por ETag"""
+        return EstadisticasCacheRespuestas(
+            entradas=len(cache_respuestas),
+            hits=cache_respuestas.hits,
+            misses=cache_respuestas.misses,
+            no_modificadas=cache_respuestas.no_modificadas,
+            version_datos=vigia_version.version
+        )
+
+    @strawberry.field
+    def sentenciasSql(self, top: int = 10, orden: str = "total") -> List[EstadisticaSentenciaSql]:
+        """
+        Sentencias SQL con más carga, agrupadas por huella. `orden`: total,
+        promedio, maximo, llamadas o filas
+        """
+        return [
+            EstadisticaSentenciaSql(
+                huella=e.huella,
+                sql=e.sql,
+                llamadas=e.llamadas,
+                tiempo_total_ms=round(e.tiempo_total_ms, 3),
+                tiempo_promedio_ms=round(e.tiempo_promedio_ms, 3),
+                tiempo_max_ms=round(e.tiempo_max_ms, 3),
+                filas_total=e.filas_total,
+                filas_promedio=round(e.filas_promedio, 2),
+                lentas=e.lentas,
+                ultima_ejecucion=e.ultima_ejecucion,
+                origenes=[
+                    OrigenSentenciaSql(campo=campo, metodo=metodo, llamadas=llamadas)
+                    for (campo, metodo), llamadas in sorted(e.origenes.items(), key=lambda o: -o[1])
+                ]
+            )
+            for e in estadisticas_sql.top(top, orden)
+        ]
+
+
+@strawberry.type
+class Mutation:
+    """Operaciones administrativas del subgrafo"""
+
+    @strawberry.mutation
+    def invalidarCacheKpi(self, kpi: Optional[str] = None) -> int:
+        """Invalida el cache de un KPI (p. ej. `dashboard_resumen`) o de todos; devuelve las entradas borradas"""
+        return cache_kpis.invalidar(kpi)
+
+    @strawberry.mutation
+    def reiniciarEstadisticasSql(self) -> int:
+        """Reinicia las estadísticas por sentencia SQL; devuelve las huellas descartadas"""
+        return estadisticas_sql.reiniciar()
+
+    @strawberry.mutation
+    def exportarReporte(
+        self,
+        tipoReporte: TipoReporte,
+        fechaInicio: date,
+        fechaFin: date,
+        formato: FormatoReporte = FormatoReporte.CSV,
+        doctorId: Optional[int] = None
+    ) -> str:
+        """URL de descarga en streaming (CSV, JSON Lines o XLSX) del detalle del reporte"""
+        return url_exportacion(tipoReporte, fechaInicio, fechaFin, formato, doctorId)
+
+    @strawberry.mutation
+    async def encolarReporteCompleto(
+        self,
+        fechaInicio: date,
+        fechaFin: date,
+        tipoReporte: TipoReporte,
+        incluirGraficos: bool = True,
+        formato: FormatoReporte = FormatoReporte.PDF,
+        doctorId: Optional[int] = None,
+        especie: Optional[str] = None
+    ) -> TrabajoReporte:
+        """Encola un reporte completo; si ya hay uno idéntico pendiente devuelve ese trabajo"""
+        filtros = FiltrosReporte(
+            fecha_inicio=fechaInicio,
+            fecha_fin=fechaFin,
+            tipo_reporte=tipoReporte,
+            doctor_id=doctorId,
+            especie=especie,
+            incluir_detalles=True
+        )
+        
+        configuracion = ConfiguracionReporte(
+            incluir_graficos=incluirGraficos,
+            formato_exportacion=formato,
+            incluir_comparaciones=True
+        )
+        
+        return await cola_reportes.encolar(filtros, configuracion)
+
+    @strawberry.mutation
+    async def programarReporteAutomatico(
+        self,
+        tipoReporte: TipoReporte,
+        frecuencia: PeriodoReporte,
+        emailDestino: str,
+        formato: FormatoReporte = FormatoReporte.PDF
+    ) -> ReporteProgramado:
+        """Programa un reporte que se calcula tras cada cierre de período y se entrega por el destino configurado"""
+        return await programador_reportes.programar(tipoReporte, frecuencia, emailDestino, formato)
+
+    @strawberry.mutation
+    async def cancelarReporteProgramado(self, idProgramacion: str) -> bool:
+        """Desactiva un reporte programado; devuelve False si no existía o ya estaba cancelado"""
+        return await programador_reportes.cancelar(idProgramacion)
+
+
+class SchemaFederado(strawberry.federation.Schema):
+    """
+    Schema de Apollo Federation 2 cuyo SDL (`_service { sdl }`) se genera una
+    sola vez desde los tipos de Strawberry y se reutiliza en cada consulta
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sdl = print_schema(self)
+        # Strawberry imprime el schema en cada consulta a `_service`
+        self._schema.type_map["_Service"].fields["sdl"].resolve = lambda *_: self.sdl
+
 
 # Schema principal - Compatible con Apollo Federation
-schema = strawberry.Schema(query=Query)
\ No newline at end of file
+schema = SchemaFederado(
+    query=Query,
+    mutation=Mutation,
+    enable_federation_2=True,
+    extensions=[
+        # Los dashboards repiten los mismos documentos: se parsean y validan una vez
+        ParserCache(maxsize=settings.graphql_cache_documentos),
+        ValidationCache(maxsize=settings.graphql_cache_documentos),
+        MetricasConexionExtension,
+        FrescuraDatosExtension,
+        MetricasPrometheusExtension,
+        ExplainExtension,
+        TrazasExtension,
+        PlazosExtension,
+    ]
+)
\ No newline at end of file
@@ -1,14 +1,28 @@
 """
 Aplicación principal del microservicio de KPIs
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from strawberry.fastapi import GraphQLRouter
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from contextlib import asynccontextmanager
 
 from app.config.settings import settings
-from app.config.database import test_connection, close_database
+from app.config.database import test_connection, close_database, circuit_breaker
 from app.graphql_schema.schema import schema
+from app.graphql_schema.context import get_context
+from app.graphql_schema.persistidas import ErrorConsultaPersistida
+from app.graphql_schema.cache_respuestas import RespuestaNoModificada
+from app.graphql_schema.router import GraphQLRouterPersistido
+from app.api import exportaciones, reportes
+from app.api.perfilado import perfilar_request
+from app.services.refresco_vistas import refresco_vistas
+from app.services.replicas import enrutador_replicas
+from app.services.renderizado import renderizador
+from app.services.trabajos_reporte import cola_reportes
+from app.services.programacion_reportes import programador_reportes
+from app.services.version_datos import vigia_version
+from app.services.instrumentacion import instrumentar
+from app.services.metricas import registro_metricas
 
 
 @asynccontextmanager
@@ -25,11 +39,41 @@ async def lifespan(app: FastAPI):
         print("❌ No se pudo conectar a la base de datos")
         # En producción, podrías querer fallar aquí
     
+    # Refresco periódico de vistas materializadas (solo si se leen de ellas)
+    if settings.kpi_usar_vistas_materializadas:
+        refresco_vistas.iniciar()
+        print(f"🔄 Refresco de vistas materializadas cada {settings.vistas_refresco_segundos}s")
+    
+    # Medición del retraso de las réplicas de lectura
+    if enrutador_replicas.replicas:
+        enrutador_replicas.iniciar()
+        print(f"📖 Lecturas en {len(enrutador_replicas.replicas)} réplicas (retraso cada {settings.replicas_intervalo_retraso_segundos}s)")
+    
+    # Versión de datos para el cache de respuestas GraphQL
+    if settings.cache_respuestas_habilitado:
+        vigia_version.iniciar()
+        print(f"🏷️ Cache de respuestas GraphQL (versión de datos cada {settings.version_datos_intervalo_segundos}s)")
+    
+    # Trabajadores de la cola de reportes
+    await cola_reportes.iniciar()
+    print(f"📄 Cola de reportes con {settings.reportes_trabajadores} trabajadores")
+    
+    # Reportes programados
+    if settings.programacion_habilitada:
+        programador_reportes.iniciar()
+        print(f"🗓️ Reportes programados con destino '{settings.programacion_destino}'")
+    
     print("✅ Microservicio de KPIs iniciado correctamente")
     yield
     
     # Shutdown
     print("🔒 Cerrando microservicio de KPIs...")
+    await refresco_vistas.detener()
+    await enrutador_replicas.detener()
+    await vigia_version.detener()
+    await programador_reportes.detener()
+    await cola_reportes.detener()
+    await renderizador.detener()
     await close_database()
     print("✅ Microservicio cerrado correctamente")
 
@@ -43,6 +87,12 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Métricas de SQL, pool y caches para /metrics y estadísticas por sentencia
+instrumentar()
+
+# Perfilado opt-in de requests individuales (X-Profile)
+app.middleware("http")(perfilar_request)
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -52,16 +102,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Router GraphQL
-graphql_router = GraphQLRouter(
+# Router GraphQL (acepta consultas persistidas por hash)
+graphql_router = GraphQLRouterPersistido(
     schema,
     graphiql=settings.enable_playground,
+    context_getter=get_context,
 )
 
 # Incluir router GraphQL
 app.include_router(graphql_router, prefix="/graphql")
 
 
+@app.exception_handler(ErrorConsultaPersistida)
+async def error_consulta_persistida(request: Request, error: ErrorConsultaPersistida):
+    """Responde en el formato que esperan los clientes APQ (p. ej. PersistedQueryNotFound)"""
+    return JSONResponse(error.como_respuesta(), status_code=error.status_code)
+
+
+@app.exception_handler(RespuestaNoModificada)
+async def respuesta_no_modificada(request: Request, respuesta: RespuestaNoModificada):
+    """304 para GETs cuyo ETag sigue vigente: no se ejecutó ningún resolver"""
+    return Response(
+        status_code=304,
+        headers={"etag": respuesta.etag, "cache-control": respuesta.cache_control},
+    )
+
+# Descargas en streaming
+app.include_router(exportaciones.router)
+
+# Descarga de reportes guardados (Range, ETag)
+app.include_router(reportes.router)
+
+
 @app.get("/")
 async def root():
     """Endpoint raíz del subgrafo KPI"""
@@ -72,10 +144,27 @@ async def root():
         "federation_version": settings.federation_version,
         "graphql_endpoint": "/graphql",
         "sdl_endpoint": "/graphql/sdl",
+        "export_endpoint": "/exportaciones/{tipo}",
+        "report_download_endpoint": "/reportes/{archivo}",
+        "metrics_endpoint": "/metrics",
         "health_check": "/health"
     }
 
 
+@app.get("/graphql/sdl", response_class=PlainTextResponse)
+async def sdl():
+    """SDL de Federation del subgrafo, generado al iniciar desde los tipos de Strawberry"""
+    return schema.sdl
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metricas():
+    """Métricas en formato de exposición de Prometheus"""
+    if not settings.metricas_habilitadas:
+        raise HTTPException(status_code=404, detail="Métricas deshabilitadas")
+    return PlainTextResponse(registro_metricas.exponer(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 async def health_check():
     """Health check del microservicio"""
@@ -84,6 +173,7 @@ async def health_check():
         return {
             "status": "healthy" if db_status else "unhealthy",
             "database": "connected" if db_status else "disconnected",
+            "circuit_breaker": circuit_breaker.estado,
             "timestamp": "2024-11-11T00:00:00Z",
             "version": settings.api_version
         }
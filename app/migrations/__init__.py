@@ -0,0 +1,3 @@
+"""
+Migraciones de base de datos propias del subgrafo KPI
+"""
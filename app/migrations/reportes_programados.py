@@ -0,0 +1,47 @@
+"""
+Tabla de reportes programados
+
+Cada fila guarda el próximo corte del período y los momentos (hora local
+del servidor) en que el reporte se precalcula y se entrega.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+TABLA_PROGRAMADOS = """
+CREATE TABLE IF NOT EXISTS reporte_programado (
+    id VARCHAR(36) PRIMARY KEY,
+    tipo_reporte VARCHAR(32) NOT NULL,
+    frecuencia VARCHAR(32) NOT NULL,
+    formato VARCHAR(16) NOT NULL,
+    email_destino TEXT NOT NULL,
+    activo BOOLEAN NOT NULL DEFAULT TRUE,
+    proximo_corte TIMESTAMP NOT NULL,
+    calcular_desde TIMESTAMP NOT NULL,
+    entregar_en TIMESTAMP NOT NULL,
+    trabajo_id VARCHAR(36),
+    ultimo_trabajo_id VARCHAR(36),
+    ultima_entrega TIMESTAMP,
+    ultimo_error TEXT,
+    creado_en TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+INDICES_PROGRAMADOS = (
+    """
+    CREATE INDEX IF NOT EXISTS idx_reporte_programado_calcular
+    ON reporte_programado (calcular_desde)
+    WHERE activo AND trabajo_id IS NULL
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_reporte_programado_entregar
+    ON reporte_programado (entregar_en)
+    WHERE activo AND trabajo_id IS NOT NULL
+    """,
+)
+
+
+async def instalar(conn: AsyncConnection):
+    """Crea la tabla y sus índices; es idempotente"""
+    await conn.execute(text(TABLA_PROGRAMADOS))
+    for indice in INDICES_PROGRAMADOS:
+        await conn.execute(text(indice))
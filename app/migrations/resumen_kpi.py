@@ -0,0 +1,326 @@
+"""
+Tablas resumen de KPIs mantenidas por triggers
+
+- kpi_resumen_global: total de filas y contador de cambios por tabla
+  (también de diagnóstico y tratamiento, que solo usan los reportes, y de
+  los catálogos que leen los KPIs, para que la versión de datos los cubra)
+- kpi_citas_dia: citas por día de reserva y estado
+- kpi_vacunas_dia: vacunaciones pendientes por fecha de próxima vacunación
+
+Los triggers son de sentencia con tablas de transición, de modo que una
+carga masiva actualiza cada fila resumen una sola vez.
+
+Costo en escrituras: cada sentencia sobre una tabla contada actualiza una
+fila resumen, y las transacciones que tocan la misma fila se serializan
+hasta el commit. Por eso kpi_resumen_global se reparte en `RANURAS_CONTEO`
+ranuras por tabla (la sesión elige la suya con `pg_backend_pid()`) que se
+suman al leer. En kpi_citas_dia y kpi_vacunas_dia solo compiten las
+escrituras del mismo día y estado.
+"""
+from typing import List, Optional, Sequence, Union
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+# Tablas contadas en kpi_resumen_global
+TABLAS_CONTADAS = (
+    "mascota", "cliente", "cita", "detalle_vacunacion", "diagnostico", "tratamiento",
+    "doctor", "especie", "vacuna", "carnet_vacunacion",
+)
+
+# Filas por tabla en kpi_resumen_global; los totales son la suma de todas
+RANURAS_CONTEO = 16
+
+TABLAS_RESUMEN = f"""
+CREATE TABLE IF NOT EXISTS kpi_resumen_global (
+    tabla VARCHAR(64) NOT NULL,
+    ranura SMALLINT NOT NULL DEFAULT 0,
+    total BIGINT NOT NULL DEFAULT 0,
+    cambios BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (tabla, ranura)
+);
+
+-- Instalaciones anteriores tenían una sola fila por tabla
+ALTER TABLE kpi_resumen_global ADD COLUMN IF NOT EXISTS ranura SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE kpi_resumen_global DROP CONSTRAINT IF EXISTS kpi_resumen_global_pkey;
+ALTER TABLE kpi_resumen_global ADD PRIMARY KEY (tabla, ranura);
+
+CREATE TABLE IF NOT EXISTS kpi_citas_dia (
+    fecha DATE NOT NULL,
+    estado INTEGER NOT NULL,
+    total BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (fecha, estado)
+);
+
+CREATE TABLE IF NOT EXISTS kpi_vacunas_dia (
+    fecha DATE PRIMARY KEY,
+    total BIGINT NOT NULL DEFAULT 0
+);
+"""
+
+# Conteo global; TG_TABLE_NAME y la ranura de la sesión identifican la fila.
+# Las ramas de plpgsql se planifican al ejecutarse, por eso cada trigger
+# solo necesita declarar las tablas de transición que usa su evento.
+FUNCION_CONTEO = f"""
+CREATE OR REPLACE FUNCTION kpi_contar_filas() RETURNS trigger AS $$
+DECLARE
+    delta BIGINT := 0;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT COUNT(*) INTO delta FROM nuevas;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT -COUNT(*) INTO delta FROM viejas;
+    END IF;
+
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE kpi_resumen_global
+        SET total = 0, cambios = cambios + 1
+        WHERE tabla = TG_TABLE_NAME;
+    ELSE
+        INSERT INTO kpi_resumen_global AS r (tabla, ranura, total, cambios)
+        VALUES (TG_TABLE_NAME, pg_backend_pid() % {RANURAS_CONTEO}, delta, 1)
+        ON CONFLICT (tabla, ranura) DO UPDATE
+        SET total = r.total + EXCLUDED.total, cambios = r.cambios + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+FUNCION_CITAS_DIA = """
+CREATE OR REPLACE FUNCTION kpi_citas_dia_actualizar() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM kpi_citas_dia;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO kpi_citas_dia AS r (fecha, estado, total)
+        SELECT fechareserva::date, estado, -COUNT(*)
+        FROM viejas
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (fecha, estado) DO UPDATE SET total = r.total + EXCLUDED.total;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO kpi_citas_dia AS r (fecha, estado, total)
+        SELECT fechareserva::date, estado, COUNT(*)
+        FROM nuevas
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (fecha, estado) DO UPDATE SET total = r.total + EXCLUDED.total;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+FUNCION_VACUNAS_DIA = """
+CREATE OR REPLACE FUNCTION kpi_vacunas_dia_actualizar() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM kpi_vacunas_dia;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO kpi_vacunas_dia AS r (fecha, total)
+        SELECT proximavacunacion, -COUNT(*)
+        FROM viejas
+        WHERE proximavacunacion IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1
+        ON CONFLICT (fecha) DO UPDATE SET total = r.total + EXCLUDED.total;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO kpi_vacunas_dia AS r (fecha, total)
+        SELECT proximavacunacion, COUNT(*)
+        FROM nuevas
+        WHERE proximavacunacion IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1
+        ON CONFLICT (fecha) DO UPDATE SET total = r.total + EXCLUDED.total;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def _triggers(tabla: str, funcion: str, prefijo: str) -> List[str]:
+    """Sentencias para (re)crear los triggers de sentencia de una tabla"""
+    eventos = {
+        "ins": ("INSERT", "REFERENCING NEW TABLE AS nuevas"),
+        "upd": ("UPDATE", "REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas"),
+        "del": ("DELETE", "REFERENCING OLD TABLE AS viejas"),
+    }
+    sentencias = []
+    for sufijo, (evento, transicion) in eventos.items():
+        nombre = f"{prefijo}_{tabla}_{sufijo}"
+        sentencias.append(f"DROP TRIGGER IF EXISTS {nombre} ON {tabla}")
+        sentencias.append(
+            f"CREATE TRIGGER {nombre} AFTER {evento} ON {tabla} {transicion} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION {funcion}()"
+        )
+    nombre = f"{prefijo}_{tabla}_trunc"
+    sentencias.append(f"DROP TRIGGER IF EXISTS {nombre} ON {tabla}")
+    sentencias.append(
+        f"CREATE TRIGGER {nombre} AFTER TRUNCATE ON {tabla} "
+        f"FOR EACH STATEMENT EXECUTE FUNCTION {funcion}()"
+    )
+    return sentencias
+
+
+def _sentencias(sql: str) -> List[str]:
+    return [sentencia.strip() for sentencia in sql.split(";\n") if sentencia.strip()]
+
+
+async def _bloquear_escrituras(conn: AsyncConnection):
+    """
+    Bloquea las escrituras en las tablas contadas hasta el fin de la
+    transacción, para que ninguna fila quede fuera de los resúmenes ni se
+    cuente dos veces
+    """
+    await conn.execute(text(
+        f"LOCK TABLE {', '.join(TABLAS_CONTADAS)} IN SHARE ROW EXCLUSIVE MODE"
+    ))
+
+
+async def reconstruir(conn: AsyncConnection):
+    """
+    Recalcula todas las tablas resumen a partir de las tablas base.
+    Debe ejecutarse dentro de una transacción: bloquea las escrituras hasta el commit.
+    """
+    await _bloquear_escrituras(conn)
+    for tabla in TABLAS_CONTADAS:
+        # El total queda en la ranura 0; los cambios suben para invalidar lo derivado
+        await conn.execute(text("""
+            UPDATE kpi_resumen_global SET total = 0 WHERE tabla = :tabla AND ranura <> 0
+        """), {"tabla": tabla})
+        await conn.execute(text(f"""
+            INSERT INTO kpi_resumen_global AS r (tabla, ranura, total, cambios)
+            SELECT :tabla, 0, COUNT(*), 1 FROM {tabla}
+            ON CONFLICT (tabla, ranura) DO UPDATE
+            SET total = EXCLUDED.total, cambios = r.cambios + 1
+        """), {"tabla": tabla})
+
+    await conn.execute(text("DELETE FROM kpi_citas_dia"))
+    await conn.execute(text("""
+        INSERT INTO kpi_citas_dia (fecha, estado, total)
+        SELECT fechareserva::date, estado, COUNT(*)
+        FROM cita
+        GROUP BY 1, 2
+    """))
+
+    await conn.execute(text("DELETE FROM kpi_vacunas_dia"))
+    await conn.execute(text("""
+        INSERT INTO kpi_vacunas_dia (fecha, total)
+        SELECT proximavacunacion, COUNT(*)
+        FROM detalle_vacunacion
+        WHERE proximavacunacion IS NOT NULL
+        GROUP BY 1
+    """))
+
+
+async def instalar(conn: AsyncConnection):
+    """
+    Crea tablas, funciones y triggers y carga los resúmenes iniciales.
+    Es idempotente; debe ejecutarse dentro de una transacción.
+    """
+    for sentencia in _sentencias(TABLAS_RESUMEN):
+        await conn.execute(text(sentencia))
+    for funcion in (FUNCION_CONTEO, FUNCION_CITAS_DIA, FUNCION_VACUNAS_DIA):
+        await conn.execute(text(funcion))
+
+    # Bloquear escrituras mientras se instalan triggers y se recalcula
+    await _bloquear_escrituras(conn)
+
+    sentencias = []
+    for tabla in TABLAS_CONTADAS:
+        sentencias += _triggers(tabla, "kpi_contar_filas", "kpi_conteo")
+    sentencias += _triggers("cita", "kpi_citas_dia_actualizar", "kpi_citas_dia")
+    sentencias += _triggers("detalle_vacunacion", "kpi_vacunas_dia_actualizar", "kpi_vacunas_dia")
+    for sentencia in sentencias:
+        await conn.execute(text(sentencia))
+
+    await reconstruir(conn)
+
+
+async def verificar(conn: AsyncConnection) -> List[str]:
+    """Compara los resúmenes con las tablas base y devuelve las diferencias encontradas"""
+    diferencias = []
+
+    for tabla in TABLAS_CONTADAS:
+        resultado = await conn.execute(text(f"""
+            SELECT
+                (SELECT COALESCE(SUM(total), 0) FROM kpi_resumen_global WHERE tabla = :tabla),
+                (SELECT COUNT(*) FROM {tabla})
+        """), {"tabla": tabla})
+        resumen, real = resultado.fetchone()
+        if resumen != real:
+            diferencias.append(f"kpi_resumen_global[{tabla}]: resumen={resumen} real={real}")
+
+    resultado = await conn.execute(text("""
+        SELECT
+            COALESCE(r.fecha, b.fecha), COALESCE(r.estado, b.estado),
+            COALESCE(r.total, 0), COALESCE(b.total, 0)
+        FROM (SELECT fecha, estado, total FROM kpi_citas_dia WHERE total <> 0) r
+        FULL OUTER JOIN (
+            SELECT fechareserva::date as fecha, estado, COUNT(*) as total
+            FROM cita
+            GROUP BY 1, 2
+        ) b ON b.fecha = r.fecha AND b.estado = r.estado
+        WHERE COALESCE(r.total, 0) <> COALESCE(b.total, 0)
+        ORDER BY 1, 2
+    """))
+    for fecha, estado, resumen, real in resultado.fetchall():
+        diferencias.append(f"kpi_citas_dia[{fecha}, estado={estado}]: resumen={resumen} real={real}")
+
+    resultado = await conn.execute(text("""
+        SELECT COALESCE(r.fecha, b.fecha), COALESCE(r.total, 0), COALESCE(b.total, 0)
+        FROM (SELECT fecha, total FROM kpi_vacunas_dia WHERE total <> 0) r
+        FULL OUTER JOIN (
+            SELECT proximavacunacion as fecha, COUNT(*) as total
+            FROM detalle_vacunacion
+            WHERE proximavacunacion IS NOT NULL
+            GROUP BY 1
+        ) b ON b.fecha = r.fecha
+        WHERE COALESCE(r.total, 0) <> COALESCE(b.total, 0)
+        ORDER BY 1
+    """))
+    for fecha, resumen, real in resultado.fetchall():
+        diferencias.append(f"kpi_vacunas_dia[{fecha}]: resumen={resumen} real={real}")
+
+    return diferencias
+
+
+async def version_tablas(conn: Union[AsyncConnection, AsyncSession], tablas: Sequence[str]) -> Optional[int]:
+    """
+    Versión de los datos de `tablas` (suma de sus contadores de cambios),
+    leída en la conexión o sesión que va a leer esos datos. None si las
+    tablas resumen no están instaladas o alguna tabla no tiene contador.
+    """
+    # Consultar una tabla inexistente abortaría la transacción del llamador
+    instalada = await conn.execute(text("SELECT to_regclass('kpi_resumen_global') IS NOT NULL"))
+    if not instalada.scalar():
+        return None
+    resultado = await conn.execute(text("""
+        SELECT COUNT(DISTINCT tabla), COALESCE(SUM(cambios), 0)
+        FROM kpi_resumen_global
+        WHERE tabla = ANY(:tablas)
+    """), {"tablas": list(tablas)})
+    contadas, cambios = resultado.fetchone()
+    return int(cambios) if contadas == len(set(tablas)) else None
+
+
+async def version_datos(conn: Union[AsyncConnection, AsyncSession]) -> int:
+    """
+    Versión de los datos contados: la suma de los contadores de cambios
+    crece con cada sentencia que modifica esas tablas, así que sirve como
+    parte de la clave de cualquier resultado derivado de ellas.
+    """
+    resultado = await conn.execute(text("SELECT COALESCE(SUM(cambios), 0) FROM kpi_resumen_global"))
+    return int(resultado.scalar())
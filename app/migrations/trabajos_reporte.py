@@ -0,0 +1,47 @@
+"""
+Tabla de la cola persistente de trabajos de reportes
+
+Un índice único parcial sobre `clave` (hash de filtros + configuración)
+impide que existan dos trabajos idénticos pendientes o en proceso.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+TABLA_TRABAJOS = """
+CREATE TABLE IF NOT EXISTS reporte_trabajo (
+    id VARCHAR(36) PRIMARY KEY,
+    clave CHAR(64) NOT NULL,
+    estado VARCHAR(16) NOT NULL DEFAULT 'pendiente',
+    progreso REAL NOT NULL DEFAULT 0,
+    filtros JSONB NOT NULL,
+    configuracion JSONB NOT NULL,
+    resultado JSONB,
+    error TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    creado_en TIMESTAMPTZ NOT NULL DEFAULT now(),
+    iniciado_en TIMESTAMPTZ,
+    actualizado_en TIMESTAMPTZ NOT NULL DEFAULT now(),
+    terminado_en TIMESTAMPTZ
+)
+"""
+
+INDICES_TRABAJOS = (
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_reporte_trabajo_clave_activa
+    ON reporte_trabajo (clave)
+    WHERE estado IN ('pendiente', 'en_proceso')
+    """,
+    # Los trabajadores toman el pendiente más antiguo
+    """
+    CREATE INDEX IF NOT EXISTS idx_reporte_trabajo_pendiente
+    ON reporte_trabajo (creado_en)
+    WHERE estado = 'pendiente'
+    """,
+)
+
+
+async def instalar(conn: AsyncConnection):
+    """Crea la tabla y sus índices; es idempotente"""
+    await conn.execute(text(TABLA_TRABAJOS))
+    for indice in INDICES_TRABAJOS:
+        await conn.execute(text(indice))
@@ -0,0 +1,76 @@
+"""
+Modelos GraphQL para operación y administración del subgrafo
+"""
+import strawberry
+from datetime import datetime
+from typing import List, Optional
+
+
+@strawberry.type
+class EstadisticasCacheKPI:
+    """Contadores del cache de KPIs"""
+    entradas: int
+    hits: int
+    misses: int
+    coalescidos: int
+    expulsiones: int
+    invalidaciones: int
+    tasa_aciertos: float = strawberry.field(name="tasaAciertos")
+
+
+@strawberry.type
+class EstadisticasRenderizado:
+    """Actividad del pool de procesos que renderiza PDFs y gráficos"""
+    procesos: int
+    profundidad_cola: int = strawberry.field(name="profundidadCola")
+    en_pool: int = strawberry.field(name="enPool")
+    pdfs: int
+    graficos: int
+    graficos_cache: int = strawberry.field(name="graficosCache")
+    errores: int
+    render_ms_promedio: float = strawberry.field(name="renderMsPromedio")
+    render_ms_max: float = strawberry.field(name="renderMsMax")
+    espera_ms_promedio: float = strawberry.field(name="esperaMsPromedio")
+
+
+@strawberry.type
+class EstadisticasConsultasPersistidas:
+    """Registro de consultas persistidas (APQ) del router GraphQL"""
+    registradas: int
+    aciertos: int
+    no_encontradas: int = strawberry.field(name="noEncontradas")
+    solo_permitidas: bool = strawberry.field(name="soloPermitidas")
+
+
+@strawberry.type
+class EstadisticasCacheRespuestas:
+    """Cache de respuestas GraphQL completas y respuestas 304"""
+    entradas: int
+    hits: int
+    misses: int
+    no_modificadas: int = strawberry.field(name="noModificadas")
+    version_datos: Optional[int] = strawberry.field(name="versionDatos")
+
+
+@strawberry.type
+class OrigenSentenciaSql:
+    """Campo GraphQL y método de servicio que emitieron una sentencia"""
+    campo: Optional[str]
+    metodo: Optional[str]
+    llamadas: int
+
+
+@strawberry.type
+class EstadisticaSentenciaSql:
+    """Acumulados de una sentencia SQL agrupada por huella"""
+    huella: str
+    sql: str
+    llamadas: int
+    tiempo_total_ms: float = strawberry.field(name="tiempoTotalMs")
+    tiempo_promedio_ms: float = strawberry.field(name="tiempoPromedioMs")
+    tiempo_max_ms: float = strawberry.field(name="tiempoMaxMs")
+    filas_total: int = strawberry.field(name="filasTotal")
+    filas_promedio: float = strawberry.field(name="filasPromedio")
+    lentas: int
+    ultima_ejecucion: Optional[datetime] = strawberry.field(name="ultimaEjecucion")
+    origenes: List[OrigenSentenciaSql]
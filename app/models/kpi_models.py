@@ -2,6 +2,7 @@
 Modelos de KPIs usando Strawberry para GraphQL
 """
 import strawberry
+from strawberry.types import Info
 from typing import List, Optional
 from datetime import datetime, date
 from enum import Enum
@@ -116,6 +117,47 @@ class AlertaVacunacion:
     prioridad: str
 
 
+@strawberry.enum
+class PrioridadVacunacion(Enum):
+    """Prioridad de una alerta según los días hasta la próxima vacunación"""
+    VENCIDA = "VENCIDA"
+    URGENTE = "URGENTE"
+    PROXIMA = "PRÓXIMA"
+    NORMAL = "NORMAL"
+
+
+@strawberry.input
+class FiltroAlertasVacunacion:
+    """Filtros de la conexión paginada de alertas de vacunación"""
+    dias_limite: int = strawberry.field(name="diasLimite", default=30)
+    prioridades: Optional[List[PrioridadVacunacion]] = None
+    especie: Optional[str] = None
+    vacuna: Optional[str] = None
+
+
+@strawberry.type
+class PageInfo:
+    """Información de paginación estilo Relay"""
+    has_next_page: bool = strawberry.field(name="hasNextPage")
+    has_previous_page: bool = strawberry.field(name="hasPreviousPage")
+    start_cursor: Optional[str] = strawberry.field(name="startCursor", default=None)
+    end_cursor: Optional[str] = strawberry.field(name="endCursor", default=None)
+
+
+@strawberry.type
+class AlertaVacunacionEdge:
+    """Alerta de vacunación con su cursor"""
+    cursor: str
+    node: AlertaVacunacion
+
+
+@strawberry.type
+class AlertaVacunacionConnection:
+    """Página de alertas de vacunación ordenada por (próxima vacunación, id)"""
+    edges: List[AlertaVacunacionEdge]
+    page_info: PageInfo = strawberry.field(name="pageInfo")
+
+
 @strawberry.type
 class DashboardResumen:
     """Resumen principal para el dashboard"""
@@ -146,4 +188,44 @@ class GraficoData:
     etiqueta: str
     valor: float
     color: Optional[str] = None
-    metadata: Optional[str] = None
\ No newline at end of file
+    metadata: Optional[str] = None
+
+
+# === ENTIDADES DE FEDERATION ===
+# El gateway las resuelve por clave a través de `_entities`; cada lote de
+# representaciones se responde con una sola consulta (ver `CargadoresKPI`)
+
+@strawberry.federation.type(keys=["doctorId"])
+class KpiDoctor:
+    """KPIs históricos de un doctor"""
+    doctor_id: int = strawberry.field(name="doctorId")
+    doctor_nombre: str = strawberry.field(name="doctorNombre")
+    total_citas: int = strawberry.field(name="totalCitas")
+    citas_completadas: int = strawberry.field(name="citasCompletadas")
+    citas_canceladas: int = strawberry.field(name="citasCanceladas")
+    pacientes_atendidos: int = strawberry.field(name="pacientesAtendidos")
+    total_diagnosticos: int = strawberry.field(name="totalDiagnosticos")
+    tasa_completitud: float = strawberry.field(name="tasaCompletitud")
+    ultima_cita: Optional[datetime] = strawberry.field(name="ultimaCita", default=None)
+
+    @classmethod
+    async def resolve_reference(cls, info: Info, doctorId) -> Optional["KpiDoctor"]:
+        return await info.context.cargadores.doctores.load(int(doctorId))
+
+
+@strawberry.federation.type(keys=["mascotaId"])
+class KpiMascota:
+    """KPIs clínicos y de vacunación de una mascota"""
+    mascota_id: int = strawberry.field(name="mascotaId")
+    mascota_nombre: str = strawberry.field(name="mascotaNombre")
+    especie: str
+    total_citas: int = strawberry.field(name="totalCitas")
+    citas_completadas: int = strawberry.field(name="citasCompletadas")
+    total_vacunaciones: int = strawberry.field(name="totalVacunaciones")
+    vacunas_vencidas: int = strawberry.field(name="vacunasVencidas")
+    ultima_cita: Optional[datetime] = strawberry.field(name="ultimaCita", default=None)
+    proxima_vacunacion: Optional[date] = strawberry.field(name="proximaVacunacion", default=None)
+
+    @classmethod
+    async def resolve_reference(cls, info: Info, mascotaId) -> Optional["KpiMascota"]:
+        return await info.context.cargadores.mascotas.load(int(mascotaId))
@@ -232,4 +232,40 @@ class ReporteCompleto:
     reporte_mascota: Optional[ReporteMascota] = None
     reporte_comparativo: Optional[ReporteComparativo] = None
     reporte_predictivo: Optional[ReportePredictivo] = None
-    graficos: Optional[List[str]] = None  # URLs o datos de gráficos
\ No newline at end of file
+    graficos: Optional[List[str]] = None  # URLs o datos de gráficos
+
+@strawberry.enum
+class EstadoTrabajoReporte(Enum):
+    """Estados de un reporte encolado"""
+    PENDIENTE = "pendiente"
+    EN_PROCESO = "en_proceso"
+    COMPLETADO = "completado"
+    FALLIDO = "fallido"
+
+
+@strawberry.type
+class TrabajoReporte:
+    """Reporte completo generado en segundo plano"""
+    id_trabajo: str
+    estado: EstadoTrabajoReporte
+    progreso: float  # 0 a 1
+    tipo_reporte: TipoReporte
+    fecha_creacion: datetime
+    fecha_inicio_proceso: Optional[datetime] = None
+    fecha_fin_proceso: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+@strawberry.type
+class ReporteProgramado:
+    """Reporte que se genera y entrega automáticamente cada período"""
+    id_programacion: str
+    tipo_reporte: TipoReporte
+    frecuencia: PeriodoReporte
+    formato: FormatoReporte
+    email_destino: str
+    activo: bool
+    proxima_entrega: datetime
+    id_ultimo_trabajo: Optional[str] = None  # resultado con resultadoTrabajoReporte
+    ultima_entrega: Optional[datetime] = None
+    ultimo_error: Optional[str] = None
@@ -0,0 +1,207 @@
+"""
+Control de admisión de reportes
+
+A fin de mes los gerentes lanzan muchos reportes a la vez y cada uno ocupa
+CPU del event loop y conexiones durante segundos. El regulador limita los
+reportes en curso por tipo y en total, encola el resto hasta
+`admision_reportes_espera_maxima_segundos` y rechaza con un tiempo de
+reintento cuando la cola está llena o la espera vence.
+
+Los KPIs interactivos tienen prioridad: mientras haya
+`admision_reportes_umbral_interactivo` o más lecturas de KPIs en curso no
+se admite ningún reporte nuevo (los que ya empezaron siguen).
+"""
+import asyncio
+import functools
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Tuple
+
+from app.config.settings import settings
+from app.services.metricas import (
+    Contador, Histograma, Medidor, registro_metricas,
+)
+
+logger = logging.getLogger(__name__)
+
+# Dentro de un reporte admitido, los subreportes no vuelven a pedir cupo
+_admitido: ContextVar[bool] = ContextVar("reporte_admitido", default=False)
+
+admisiones = registro_metricas.registrar(Contador(
+    "kpi_reportes_admision_total",
+    "Reportes por resultado de la admisión (inmediato, encolado, rechazado, vencido)",
+    ("tipo", "resultado"),
+))
+espera_admision = registro_metricas.registrar(Histograma(
+    "kpi_reportes_espera_admision_segundos",
+    "Espera en la cola de admisión de los reportes que llegaron a ejecutarse",
+    ("tipo",),
+))
+
+
+class ReportesSaturados(Exception):
+    """No hay cupo para el reporte; `reintentar_en` segundos es una estimación"""
+
+    def __init__(self, tipo: str, reintentar_en: int, motivo: str):
+        super().__init__(f"No hay cupo para el reporte {tipo} ({motivo}); reintente en {reintentar_en} s")
+        self.tipo = tipo
+        self.reintentar_en = reintentar_en
+        # Strawberry copia estas extensiones al error GraphQL
+        self.extensions = {"code": "REPORTES_SATURADOS", "tipoReporte": tipo, "retryAfter": reintentar_en}
+
+
+class ReguladorReportes:
+    def __init__(
+        self,
+        max_por_tipo: Dict[str, int],
+        max_por_tipo_defecto: int,
+        max_total: int,
+        max_en_cola: int,
+        espera_maxima_segundos: float,
+        umbral_interactivo: int,
+    ):
+        self.max_por_tipo = max_por_tipo
+        self.max_por_tipo_defecto = max_por_tipo_defecto
+        self.max_total = max_total
+        self.max_en_cola = max_en_cola
+        self.espera_maxima_segundos = espera_maxima_segundos
+        self.umbral_interactivo = umbral_interactivo
+        self.en_curso: Dict[str, int] = {}
+        self.interactivos = 0
+        self._cola: Deque[Tuple[str, asyncio.Future]] = deque()
+        # Promedio móvil de la duración de un reporte, para el tiempo de reintento
+        self._duracion_promedio = 5.0
+
+    @property
+    def total_en_curso(self) -> int:
+        return sum(self.en_curso.values())
+
+    @property
+    def en_cola(self) -> int:
+        return len(self._cola)
+
+    def _puede_iniciar(self, tipo: str) -> bool:
+        return (
+            self.interactivos < self.umbral_interactivo
+            and self.total_en_curso < self.max_total
+            and self.en_curso.get(tipo, 0) < self.max_por_tipo.get(tipo, self.max_por_tipo_defecto)
+        )
+
+    def _ocupar(self, tipo: str):
+        self.en_curso[tipo] = self.en_curso.get(tipo, 0) + 1
+
+    def _liberar(self, tipo: str):
+        self.en_curso[tipo] -= 1
+        self._despertar()
+
+    def _despertar(self):
+        # En orden de llegada, pero un tipo sin cupo no frena a los demás
+        for entrada in list(self._cola):
+            tipo, futuro = entrada
+            if futuro.done():
+                continue
+            if not self._puede_iniciar(tipo):
+                if self.interactivos >= self.umbral_interactivo or self.total_en_curso >= self.max_total:
+                    return
+                continue
+            self._ocupar(tipo)
+            futuro.set_result(None)
+            self._cola.remove(entrada)
+
+    def _reintentar_en(self) -> int:
+        rondas = (self.en_cola + 1) / max(self.max_total, 1)
+        return max(1, math.ceil(rondas * self._duracion_promedio))
+
+    @asynccontextmanager
+    async def interactivo(self):
+        """Marca una lectura de KPIs en curso; los reportes nuevos esperan detrás"""
+        self.interactivos += 1
+        try:
+            yield
+        finally:
+            self.interactivos -= 1
+            if self._cola:
+                self._despertar()
+
+    @asynccontextmanager
+    async def admitir(self, tipo: str):
+        """Cupo para generar un reporte de `tipo`; lanza ReportesSaturados si no lo hay"""
+        if _admitido.get():
+            yield
+            return
+
+        llegada = time.perf_counter()
+        futuro = asyncio.get_running_loop().create_future()
+        entrada = (tipo, futuro)
+        self._cola.append(entrada)
+        self._despertar()
+        if futuro.done():
+            admisiones.incrementar(tipo, "inmediato")
+        else:
+            if self.en_cola > self.max_en_cola:
+                self._cola.remove(entrada)
+                admisiones.incrementar(tipo, "rechazado")
+                raise ReportesSaturados(tipo, self._reintentar_en(), "cola llena")
+            try:
+                await asyncio.wait_for(futuro, self.espera_maxima_segundos)
+            except asyncio.TimeoutError:
+                admisiones.incrementar(tipo, "vencido")
+                logger.warning(f"⏳ Reporte {tipo} sin cupo tras {self.espera_maxima_segundos:.0f}s en cola")
+                raise ReportesSaturados(tipo, self._reintentar_en(), "espera vencida")
+            except BaseException:
+                # Cancelado (p. ej. el cliente se fue) justo después de recibir el cupo
+                if futuro.done() and not futuro.cancelled():
+                    self._liberar(tipo)
+                raise
+            finally:
+                if entrada in self._cola:
+                    self._cola.remove(entrada)
+            admisiones.incrementar(tipo, "encolado")
+            espera_admision.observar(time.perf_counter() - llegada, tipo)
+
+        inicio = time.perf_counter()
+        token = _admitido.set(True)
+        try:
+            yield
+        finally:
+            _admitido.reset(token)
+            self._duracion_promedio = 0.8 * self._duracion_promedio + 0.2 * (time.perf_counter() - inicio)
+            self._liberar(tipo)
+
+
+def regulado(tipo: str):
+    """Decorador de métodos de ReportService: la llamada ocupa un cupo de `tipo`"""
+    def decorador(metodo):
+        @functools.wraps(metodo)
+        async def envoltura(*args, **kwargs):
+            async with regulador_reportes.admitir(tipo):
+                return await metodo(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+# Instancia global del regulador de reportes
+regulador_reportes = ReguladorReportes(
+    max_por_tipo=settings.admision_reportes_max_por_tipo,
+    max_por_tipo_defecto=settings.admision_reportes_max_por_tipo_defecto,
+    max_total=settings.admision_reportes_max_total,
+    max_en_cola=settings.admision_reportes_max_en_cola,
+    espera_maxima_segundos=settings.admision_reportes_espera_maxima_segundos,
+    umbral_interactivo=settings.admision_reportes_umbral_interactivo,
+)
+
+registro_metricas.registrar(Medidor(
+    "kpi_reportes_en_curso",
+    "Reportes generándose por tipo",
+    lambda: {(tipo,): cantidad for tipo, cantidad in regulador_reportes.en_curso.items()},
+    ("tipo",),
+))
+registro_metricas.registrar(Medidor(
+    "kpi_reportes_en_cola",
+    "Reportes esperando cupo",
+    lambda: {(): regulador_reportes.en_cola},
+))
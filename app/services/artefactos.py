@@ -0,0 +1,242 @@
+"""
+Almacén en disco de reportes generados, direccionado por contenido
+
+La clave de un reporte es el hash de sus filtros, su configuración y la
+versión de los datos de todas las tablas que leen los reportes (contadores
+de cambios de `kpi_resumen_global`), de modo que una solicitud repetida
+sobre los mismos datos reutiliza el reporte guardado. La versión se lee en
+la sesión del propio reporte, antes de sus consultas: un reporte nunca
+queda guardado bajo una versión más nueva que sus datos. Sin versión
+disponible el reporte no se reutiliza y se guarda bajo una clave única,
+solo para descargarlo.
+
+Cada artefacto es `<clave>.json` (el reporte) y, si se pidió PDF,
+`<clave>.pdf`. El almacén expulsa por LRU al superar `max_bytes` y
+descarta los artefactos con más de `ttl_segundos`.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.settings import settings
+from app.migrations.resumen_kpi import version_tablas
+from app.models.report_models import ConfiguracionReporte, FiltrosReporte, ReporteCompleto
+from app.services.serializacion import a_json, desde_json
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONES = ("json", "pdf")
+# Tablas que leen los reportes; su versión forma parte de la clave
+TABLAS_REPORTES = ("cita", "diagnostico", "tratamiento", "detalle_vacunacion")
+_NOMBRE_ARTEFACTO = re.compile(r"^([0-9a-f]{64})\.(json|pdf)$")
+
+
+@dataclass
+class Artefacto:
+    """Archivos de un reporte guardado"""
+    clave: str
+    tamano: int
+    creado: float  # epoch
+
+    def vencido(self, ttl_segundos: float) -> bool:
+        return time.time() - self.creado > ttl_segundos
+
+
+class AlmacenArtefactos:
+    """
+    Índice LRU en memoria sobre un directorio de artefactos.
+
+    El índice se reconstruye desde el disco al primer uso; un artefacto que
+    otra réplica escribió en el mismo directorio se incorpora al pedirlo.
+    """
+
+    def __init__(self, directorio: str, max_bytes: int, ttl_segundos: float):
+        self.directorio = Path(directorio)
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        self._indice: "OrderedDict[str, Artefacto]" = OrderedDict()
+        self._bytes = 0
+        self._cargado = False
+        self._lock = asyncio.Lock()
+
+    def _ruta(self, clave: str, extension: str) -> Path:
+        return self.directorio / f"{clave}.{extension}"
+
+    def _leer_disco(self, clave: str) -> Optional[Artefacto]:
+        """Artefacto tal como está en disco; el .json se escribe último y marca que está completo"""
+        try:
+            creado = self._ruta(clave, "json").stat().st_mtime
+        except FileNotFoundError:
+            return None
+        tamano = 0
+        for extension in EXTENSIONES:
+            try:
+                tamano += self._ruta(clave, extension).stat().st_size
+            except FileNotFoundError:
+                pass
+        return Artefacto(clave=clave, tamano=tamano, creado=creado)
+
+    def _escanear(self) -> List[Artefacto]:
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        artefactos = []
+        for ruta in self.directorio.glob("*.json"):
+            artefacto = self._leer_disco(ruta.stem)
+            if artefacto is not None and _NOMBRE_ARTEFACTO.match(ruta.name):
+                artefactos.append(artefacto)
+        # Sin registro de accesos previos, el más antiguo se expulsa primero
+        return sorted(artefactos, key=lambda a: a.creado)
+
+    def _agregar(self, artefacto: Artefacto):
+        anterior = self._indice.pop(artefacto.clave, None)
+        if anterior is not None:
+            self._bytes -= anterior.tamano
+        self._indice[artefacto.clave] = artefacto
+        self._bytes += artefacto.tamano
+
+    def _borrar_archivos(self, claves: List[str]):
+        for clave in claves:
+            # Primero el .json: sin él el artefacto deja de estar disponible
+            for extension in ("json", "pdf"):
+                try:
+                    self._ruta(clave, extension).unlink()
+                except FileNotFoundError:
+                    pass
+
+    async def _eliminar(self, claves: List[str]):
+        for clave in claves:
+            artefacto = self._indice.pop(clave, None)
+            if artefacto is not None:
+                self._bytes -= artefacto.tamano
+        await asyncio.to_thread(self._borrar_archivos, claves)
+
+    async def _depurar(self):
+        """Quita vencidos y expulsa los menos usados hasta respetar `max_bytes`"""
+        claves = [c for c, a in self._indice.items() if a.vencido(self.ttl_segundos)]
+        restantes = self._bytes - sum(self._indice[c].tamano for c in claves)
+        for clave, artefacto in self._indice.items():
+            if restantes <= self.max_bytes or len(self._indice) - len(claves) <= 1:
+                break
+            if clave not in claves:
+                logger.info(f"🗑️ Artefacto {clave[:12]} expulsado por tamaño")
+                claves.append(clave)
+                restantes -= artefacto.tamano
+        if claves:
+            await self._eliminar(claves)
+
+    async def _asegurar_cargado(self):
+        if not self._cargado:
+            async with self._lock:
+                if not self._cargado:
+                    for artefacto in await asyncio.to_thread(self._escanear):
+                        self._agregar(artefacto)
+                    self._cargado = True
+
+    async def _vigente(self, clave: str) -> Optional[Artefacto]:
+        """Artefacto disponible (marcado como recién usado) o None"""
+        await self._asegurar_cargado()
+        artefacto = self._indice.get(clave)
+        if artefacto is None:
+            artefacto = await asyncio.to_thread(self._leer_disco, clave)
+            if artefacto is None:
+                return None
+            self._agregar(artefacto)
+        if artefacto.vencido(self.ttl_segundos):
+            await self._eliminar([clave])
+            return None
+        self._indice.move_to_end(clave)
+        return artefacto
+
+    async def clave(
+        self, sesion: AsyncSession, filtros: FiltrosReporte, configuracion: ConfiguracionReporte
+    ) -> Optional[str]:
+        """Clave del reporte para los datos que ve `sesion`; None si no hay versión de datos"""
+        version = await version_tablas(sesion, TABLAS_REPORTES)
+        if version is None:
+            logger.warning("⚠️ Versión de datos no disponible: el reporte no se reutilizará")
+            return None
+        solicitud = {
+            "filtros": a_json(filtros),
+            "configuracion": a_json(configuracion),
+            "version_datos": version,
+        }
+        return hashlib.sha256(json.dumps(solicitud, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def clave_unica() -> str:
+        """Clave que ninguna otra solicitud va a pedir (reportes sin versión de datos)"""
+        return hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+
+    async def obtener(self, clave: str) -> Optional[ReporteCompleto]:
+        """Reporte guardado bajo la clave, si sigue vigente"""
+        if await self._vigente(clave) is None:
+            return None
+        try:
+            contenido = await asyncio.to_thread(self._ruta(clave, "json").read_text, encoding="utf-8")
+        except FileNotFoundError:
+            await self._eliminar([clave])
+            return None
+        return desde_json(ReporteCompleto, json.loads(contenido))
+
+    async def guardar(self, clave: str, reporte: ReporteCompleto, pdf: Optional[bytes] = None):
+        """Guarda el reporte (y su PDF) y completa url_descarga y fecha_expiracion"""
+        await self._asegurar_cargado()
+        reporte.metadata.fecha_expiracion = datetime.now() + timedelta(seconds=self.ttl_segundos)
+        if pdf is not None:
+            reporte.metadata.url_descarga = f"/reportes/{clave}.pdf"
+
+        def escribir():
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            archivos = []
+            if pdf is not None:
+                archivos.append((self._ruta(clave, "pdf"), pdf))
+            archivos.append((
+                self._ruta(clave, "json"),
+                json.dumps(a_json(reporte), ensure_ascii=False).encode("utf-8"),
+            ))
+            for ruta, datos in archivos:
+                temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+                temporal.write_bytes(datos)
+                os.replace(temporal, ruta)
+            return self._leer_disco(clave)
+
+        artefacto = await asyncio.to_thread(escribir)
+        self._agregar(artefacto)
+        await self._depurar()
+
+    async def ruta_descarga(self, nombre: str) -> Optional[Path]:
+        """Ruta del archivo `<clave>.<ext>` si el artefacto está vigente"""
+        coincidencia = _NOMBRE_ARTEFACTO.match(nombre)
+        if coincidencia is None:
+            return None
+        clave, extension = coincidencia.groups()
+        if await self._vigente(clave) is None:
+            return None
+        ruta = self._ruta(clave, extension)
+        return ruta if ruta.is_file() else None
+
+    @property
+    def tamano_total(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._indice)
+
+
+# Instancia global del almacén de reportes
+almacen_artefactos = AlmacenArtefactos(
+    directorio=settings.directorio_reportes,
+    max_bytes=settings.artefactos_max_bytes,
+    ttl_segundos=settings.artefactos_ttl_segundos,
+)
@@ -0,0 +1,285 @@
+"""
+Cache de resultados para los métodos del servicio de KPIs
+TTL por KPI, LRU acotado, single-flight para misses concurrentes y
+stale-while-revalidate protegido por el circuit breaker de la base de datos
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from app.config.database import INTERACTIVO, BaseDatosNoDisponible, circuit_breaker, sesiones
+from app.config.settings import settings
+from app.services.frescura import registrar_frescura
+from app.services.replicas import enrutador_replicas, version_requerida
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EstadisticasCache:
+    """Contadores de uso del cache"""
+    hits: int = 0
+    misses: int = 0
+    coalescidos: int = 0
+    expulsiones: int = 0
+    invalidaciones: int = 0
+    obsoletos: int = 0
+    revalidaciones: int = 0
+
+    def tasa_aciertos(self) -> float:
+        """Fracción de lecturas que no llegaron a la base de datos"""
+        aciertos = self.hits + self.coalescidos + self.obsoletos
+        total = aciertos + self.misses
+        return aciertos / total if total > 0 else 0.0
+
+    def como_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+@dataclass
+class _Entrada:
+    kpi: str
+    valor: Any
+    creado: float
+    expira: float
+
+
+class CacheKPI:
+    """
+    Cache en memoria de resultados de KPIs.
+
+    Las claves combinan el nombre del KPI con sus argumentos normalizados.
+    Cuando varias corrutinas piden la misma clave ausente, solo la primera
+    consulta la base de datos y el resto espera su resultado.
+    """
+
+    def __init__(
+        self,
+        max_entradas: int,
+        ttl_defecto: float,
+        ttls: Dict[str, float],
+        servir_obsoleto: bool = False,
+        max_obsolescencia: float = 0.0
+    ):
+        self.max_entradas = max_entradas
+        self.ttl_defecto = ttl_defecto
+        self.ttls = dict(ttls)
+        self.servir_obsoleto = servir_obsoleto
+        self.max_obsolescencia = max_obsolescencia
+        self.estadisticas = EstadisticasCache()
+        self._tareas: Set[asyncio.Task] = set()
+        self._entradas: "OrderedDict[Hashable, _Entrada]" = OrderedDict()
+        self._en_vuelo: Dict[Hashable, asyncio.Future] = {}
+
+    def ttl(self, kpi: str) -> float:
+        return self.ttls.get(kpi, self.ttl_defecto)
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def _buscar(self, clave: Hashable) -> Tuple[Optional[_Entrada], bool]:
+        """Devuelve (entrada, vigente); las entradas expiradas siguen disponibles como obsoletas"""
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None, False
+        self._entradas.move_to_end(clave)
+        return entrada, entrada.expira > time.monotonic()
+
+    def _servible_obsoleta(self, entrada: _Entrada) -> bool:
+        return (
+            self.servir_obsoleto
+            and time.monotonic() - entrada.expira <= self.max_obsolescencia
+        )
+
+    def _guardar(self, kpi: str, clave: Hashable, valor: Any):
+        ahora = time.monotonic()
+        self._entradas[clave] = _Entrada(kpi, valor, ahora, ahora + self.ttl(kpi))
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+            self.estadisticas.expulsiones += 1
+
+    async def _cargar(self, kpi: str, clave: Hashable, cargar: Callable[[], Awaitable[Any]]) -> Any:
+        """Carga una clave publicando el resultado para los que esperan en `_en_vuelo`"""
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[clave] = futuro
+        try:
+            valor = await cargar()
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except BaseException as error:
+            futuro.set_exception(error)
+            # Evita "Future exception was never retrieved" si nadie esperaba
+            futuro.exception()
+            raise
+        else:
+            self._guardar(kpi, clave, valor)
+            futuro.set_result(valor)
+            return valor
+        finally:
+            self._en_vuelo.pop(clave, None)
+
+    async def _revalidar(self, kpi: str, clave: Hashable, recargar: Callable[[], Awaitable[Any]]):
+        try:
+            await self._cargar(kpi, clave, recargar)
+            self.estadisticas.revalidaciones += 1
+        except asyncio.CancelledError:
+            raise
+        except BaseDatosNoDisponible:
+            logger.debug(f"Revalidación de {kpi} omitida: circuito abierto")
+        except Exception as error:
+            logger.warning(f"⚠️ No se pudo revalidar el KPI {kpi}: {error}")
+
+    def _programar_revalidacion(self, kpi: str, clave: Hashable, recargar: Callable[[], Awaitable[Any]]):
+        if clave in self._en_vuelo:
+            return
+        tarea = asyncio.create_task(self._revalidar(kpi, clave, recargar))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    async def obtener(
+        self,
+        kpi: str,
+        clave: Hashable,
+        cargar: Callable[[], Awaitable[Any]],
+        recargar: Optional[Callable[[], Awaitable[Any]]] = None
+    ) -> Any:
+        """
+        Devuelve el valor cacheado o lo carga una sola vez para todos los que esperan.
+        Si la entrada expiró pero sigue siendo servible, se devuelve marcada como
+        obsoleta y `recargar` (que no depende del request) la refresca en segundo plano.
+        """
+        while True:
+            entrada, vigente = self._buscar(clave)
+            if vigente:
+                self.estadisticas.hits += 1
+                return entrada.valor
+
+            if entrada is not None and recargar is not None and self._servible_obsoleta(entrada):
+                self.estadisticas.obsoletos += 1
+                registrar_frescura(kpi, time.monotonic() - entrada.creado, obsoleto=True, origen="cache")
+                self._programar_revalidacion(kpi, clave, recargar)
+                return entrada.valor
+
+            pendiente = self._en_vuelo.get(clave)
+            if pendiente is None:
+                break
+
+            self.estadisticas.coalescidos += 1
+            try:
+                return await asyncio.shield(pendiente)
+            except asyncio.CancelledError:
+                # Si se canceló quien cargaba, otro toma su lugar
+                if pendiente.cancelled():
+                    continue
+                raise
+
+        self.estadisticas.misses += 1
+        return await self._cargar(kpi, clave, cargar)
+
+    def invalidar(self, kpi: Optional[str] = None) -> int:
+        """Elimina las entradas de un KPI (o todas) y devuelve cuántas se borraron"""
+        if kpi is None:
+            borradas = len(self._entradas)
+            self._entradas.clear()
+        else:
+            claves = [clave for clave, entrada in self._entradas.items() if entrada.kpi == kpi]
+            for clave in claves:
+                del self._entradas[clave]
+            borradas = len(claves)
+        self.estadisticas.invalidaciones += borradas
+        return borradas
+
+
+# Instancia global del cache de KPIs
+cache_kpis = CacheKPI(
+    max_entradas=settings.cache_kpi_max_entradas,
+    ttl_defecto=settings.cache_kpi_ttl_segundos,
+    ttls=settings.cache_kpi_ttls,
+    servir_obsoleto=settings.cache_kpi_servir_obsoleto,
+    max_obsolescencia=settings.cache_kpi_max_obsolescencia_segundos,
+)
+
+
+# Opciones del servicio que eligen el origen de los datos (tablas base, vistas o resúmenes)
+OPCIONES_FUENTE = ("usar_vistas", "usar_resumenes")
+
+
+def _opciones_fuente(servicio) -> Dict[str, Any]:
+    return {nombre: getattr(servicio, nombre) for nombre in OPCIONES_FUENTE if hasattr(servicio, nombre)}
+
+
+def _reconstruir(servicio, sesion):
+    """Mismo servicio sobre otra sesión, leyendo del mismo origen"""
+    return type(servicio)(sesion, **_opciones_fuente(servicio))
+
+
+def _clave(kpi: str, argumentos: Dict[str, Any], opciones: Dict[str, Any]) -> Tuple:
+    return (kpi, tuple(sorted(argumentos.items())), tuple(sorted(opciones.items())))
+
+
+def cache_kpi(kpi: str, normalizar: Optional[Callable[..., Dict[str, Any]]] = None):
+    """
+    Decorador para métodos async de servicios de KPIs.
+    El servicio decorado debe poder construirse con una sesión y sus opciones de
+    origen (`Servicio(db, usar_vistas=..., usar_resumenes=...)`); esas opciones
+    también forman parte de la clave.
+    `normalizar` recibe los argumentos del método y devuelve los que forman la clave,
+    por ejemplo para resolver `anio=None` al año actual.
+    Las lecturas que llegan a la base de datos pueden cubrirse en otra réplica.
+    """
+    def decorador(metodo):
+        firma = inspect.signature(metodo)
+
+        def leer(servicio, args, kwargs):
+            # La cobertura repite la lectura con un servicio nuevo sobre otra sesión
+            return enrutador_replicas.cubrir(
+                kpi,
+                servicio.db,
+                lambda: metodo(servicio, *args, **kwargs),
+                lambda sesion: metodo(_reconstruir(servicio, sesion), *args, **kwargs),
+            )
+
+        @functools.wraps(metodo)
+        async def envoltura(self, *args, **kwargs):
+            # Una respuesta cacheable queda bajo la versión de datos actual: no puede salir de
+            # una entrada vieja. Sin cache la lectura sigue protegida por el circuit breaker
+            if not settings.cache_kpi_habilitado or version_requerida.get() is not None:
+                return await circuit_breaker.ejecutar(lambda: leer(self, args, kwargs))
+
+            enlazados = firma.bind(self, *args, **kwargs)
+            enlazados.apply_defaults()
+            argumentos = {k: v for k, v in enlazados.arguments.items() if k != "self"}
+            if normalizar is not None:
+                argumentos = normalizar(**argumentos)
+
+            async def cargar():
+                return await circuit_breaker.ejecutar(lambda: leer(self, args, kwargs))
+
+            async def recargar():
+                # La revalidación sobrevive al request, así que usa su propia sesión
+                sesion = enrutador_replicas.sesiones_lectura(INTERACTIVO)()
+                try:
+                    await sesion.connection()
+                    if not await enrutador_replicas.al_dia(sesion):
+                        # Igual que el request: réplica atrasada, se revalida en la primaria
+                        await sesion.close()
+                        sesion = sesiones[INTERACTIVO]()
+                    servicio = _reconstruir(self, sesion)
+                    return await circuit_breaker.ejecutar(lambda: metodo(servicio, *args, **kwargs))
+                finally:
+                    await sesion.close()
+
+            clave = _clave(kpi, argumentos, _opciones_fuente(self))
+            return await cache_kpis.obtener(kpi, clave, cargar, recargar)
+
+        envoltura.kpi = kpi
+        return envoltura
+
+    return decorador
@@ -0,0 +1,162 @@
+"""
+Estadísticas por sentencia SQL y log de consultas lentas
+
+Cada sentencia ejecutada por el motor se agrupa por su huella (SQL sin
+literales, ver `huella_sql`) y se atribuye al campo GraphQL y al método de
+servicio que la emitieron. Ambos orígenes viajan en variables de contexto:
+el campo lo fija la extensión de métricas del schema y el método, las
+clases marcadas con `@etiquetar_metodos`.
+"""
+import functools
+import inspect
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.services.trazas import span_actual, trazador
+
+logger = logging.getLogger(__name__)
+
+# Origen de las sentencias ejecutadas en el contexto actual
+campo_actual: ContextVar[Optional[str]] = ContextVar("campo_graphql_actual", default=None)
+metodo_actual: ContextVar[Optional[str]] = ContextVar("metodo_servicio_actual", default=None)
+
+# Orígenes distintos que se conservan por huella
+MAX_ORIGENES = 10
+
+
+def etiquetar_metodos(cls):
+    """
+    Decorador de clase: los métodos async (salvo los dunder) fijan `metodo_actual`
+    mientras se ejecutan, así cada sentencia queda atribuida a
+    `Clase.metodo`. En una traza muestreada cada llamada es además un span
+    hijo del campo que la hizo
+    """
+    for nombre, metodo in list(vars(cls).items()):
+        if nombre.startswith("__") or not inspect.iscoroutinefunction(metodo):
+            continue
+
+        def envolver(metodo, etiqueta):
+            @functools.wraps(metodo)
+            async def envoltura(*args, **kwargs):
+                token = metodo_actual.set(etiqueta)
+                span = trazador.iniciar_span(etiqueta, **{"code.function": etiqueta})
+                if span is None:
+                    try:
+                        return await metodo(*args, **kwargs)
+                    finally:
+                        metodo_actual.reset(token)
+
+                token_span = span_actual.set(span)
+                error = None
+                try:
+                    return await metodo(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    span_actual.reset(token_span)
+                    metodo_actual.reset(token)
+                    trazador.terminar(span, error)
+            return envoltura
+
+        setattr(cls, nombre, envolver(metodo, f"{cls.__name__}.{nombre}"))
+    return cls
+
+
+@dataclass
+class EstadisticaSentencia:
+    """Acumulados de una huella de SQL"""
+    huella: str
+    sql: str
+    llamadas: int = 0
+    tiempo_total_ms: float = 0.0
+    tiempo_max_ms: float = 0.0
+    filas_total: int = 0
+    lentas: int = 0
+    ultima_ejecucion: Optional[datetime] = None
+    origenes: Dict[Tuple[Optional[str], Optional[str]], int] = field(default_factory=dict)
+
+    @property
+    def tiempo_promedio_ms(self) -> float:
+        return self.tiempo_total_ms / self.llamadas if self.llamadas else 0.0
+
+    @property
+    def filas_promedio(self) -> float:
+        return self.filas_total / self.llamadas if self.llamadas else 0.0
+
+
+def _abreviar(valor: Any, largo: int = 500) -> str:
+    texto = repr(valor)
+    return texto if len(texto) <= largo else texto[:largo] + "…"
+
+
+class EstadisticasSQL:
+    """Estadísticas acumuladas por huella desde el inicio o el último reinicio"""
+
+    ORDENES = {
+        "total": lambda e: e.tiempo_total_ms,
+        "promedio": lambda e: e.tiempo_promedio_ms,
+        "maximo": lambda e: e.tiempo_max_ms,
+        "llamadas": lambda e: e.llamadas,
+        "filas": lambda e: e.filas_total,
+    }
+
+    def __init__(self, max_huellas: int, umbral_lento_ms: float):
+        self.max_huellas = max_huellas
+        self.umbral_lento_ms = umbral_lento_ms
+        self._sentencias: Dict[str, EstadisticaSentencia] = {}
+        self.descartadas = 0
+        self.desde = datetime.now()
+
+    def registrar(self, huella: str, sql: str, duracion_ms: float, filas: int, parametros: Any):
+        estadistica = self._sentencias.get(huella)
+        if estadistica is None:
+            if len(self._sentencias) >= self.max_huellas:
+                self.descartadas += 1
+                return
+            estadistica = self._sentencias[huella] = EstadisticaSentencia(huella=huella, sql=" ".join(sql.split()))
+
+        estadistica.llamadas += 1
+        estadistica.tiempo_total_ms += duracion_ms
+        estadistica.tiempo_max_ms = max(estadistica.tiempo_max_ms, duracion_ms)
+        if filas > 0:
+            estadistica.filas_total += filas
+        estadistica.ultima_ejecucion = datetime.now()
+
+        origen = (campo_actual.get(), metodo_actual.get())
+        if origen in estadistica.origenes or len(estadistica.origenes) < MAX_ORIGENES:
+            estadistica.origenes[origen] = estadistica.origenes.get(origen, 0) + 1
+
+        if duracion_ms >= self.umbral_lento_ms:
+            estadistica.lentas += 1
+            logger.warning(
+                f"🐢 SQL lento ({duracion_ms:.1f} ms, {filas} filas) [{huella}] "
+                f"campo={origen[0]} metodo={origen[1]}\n{sql}\nparámetros={_abreviar(parametros)}"
+            )
+
+    def top(self, limite: int = 10, orden: str = "total") -> List[EstadisticaSentencia]:
+        clave = self.ORDENES.get(orden)
+        if clave is None:
+            raise ValueError(f"Orden no válido: {orden} (opciones: {', '.join(self.ORDENES)})")
+        return sorted(self._sentencias.values(), key=clave, reverse=True)[:limite]
+
+    def reiniciar(self) -> int:
+        cantidad = len(self._sentencias)
+        self._sentencias.clear()
+        self.descartadas = 0
+        self.desde = datetime.now()
+        return cantidad
+
+    def __len__(self) -> int:
+        return len(self._sentencias)
+
+
+# Instancia global de estadísticas de SQL
+estadisticas_sql = EstadisticasSQL(
+    max_huellas=settings.sql_max_huellas,
+    umbral_lento_ms=settings.sql_umbral_lento_ms,
+)
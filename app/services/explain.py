@@ -0,0 +1,107 @@
+"""
+Captura opcional de planes de ejecución (EXPLAIN ANALYZE) por request
+
+Con `explain_habilitado` y el encabezado `explain_cabecera` en el request,
+se guardan las sentencias SELECT que ejecutan los resolvers y, al terminar
+la operación, se ejecuta `EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)` de cada
+una con los mismos parámetros. Los planes vuelven en
+`extensions.explain` de la respuesta.
+
+ANALYZE vuelve a ejecutar la sentencia, por eso solo se capturan lecturas
+y todo se corre en una transacción que se descarta. Los planes reflejan el
+cache ya caliente por la primera ejecución.
+"""
+import json
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Mapping, Optional
+
+from app.config.database import engine
+from app.config.settings import settings
+from app.services.estadisticas_sql import campo_actual, metodo_actual
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SentenciaCapturada:
+    sql: str
+    parametros: Any
+    duracion_ms: float
+    campo: Optional[str]
+    metodo: Optional[str]
+
+
+# Sentencias del request en curso; None si no se pidió EXPLAIN
+captura_actual: ContextVar[Optional[List[SentenciaCapturada]]] = ContextVar("captura_explain", default=None)
+
+
+def solicita_explain(cabeceras: Optional[Mapping[str, str]]) -> bool:
+    """El request pidió los planes y la captura está habilitada"""
+    if not settings.explain_habilitado or cabeceras is None:
+        return False
+    return cabeceras.get(settings.explain_cabecera, "").lower() in ("1", "true", "si", "sí")
+
+
+def capturar(sentencia: str, parametros: Any, duracion_ms: float):
+    """Llamado por cada sentencia ejecutada; solo guarda si hay captura activa"""
+    captura = captura_actual.get()
+    if captura is None:
+        return
+    if not sentencia.lstrip()[:6].upper().startswith(("SELECT", "WITH")):
+        return
+    if len(captura) >= settings.explain_max_sentencias:
+        return
+    captura.append(SentenciaCapturada(
+        sql=sentencia,
+        parametros=parametros,
+        duracion_ms=duracion_ms,
+        campo=campo_actual.get(),
+        metodo=metodo_actual.get(),
+    ))
+
+
+def _json(valor: Any) -> Any:
+    if isinstance(valor, (list, tuple)):
+        return [_json(v) for v in valor]
+    if isinstance(valor, (datetime, date, Decimal)):
+        return str(valor)
+    return valor
+
+
+async def explicar(captura: List[SentenciaCapturada]) -> List[Dict[str, Any]]:
+    """Plan de cada sentencia capturada, en el orden en que se ejecutaron"""
+    resultados = []
+    if not captura:
+        return resultados
+    async with engine.connect() as conn:
+        transaccion = await conn.begin()
+        try:
+            for sentencia in captura:
+                entrada = {
+                    "campo": sentencia.campo,
+                    "metodo": sentencia.metodo,
+                    "sql": " ".join(sentencia.sql.split()),
+                    "parametros": _json(sentencia.parametros),
+                    "duracionMs": round(sentencia.duracion_ms, 3),
+                }
+                try:
+                    resultado = await conn.exec_driver_sql(
+                        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sentencia.sql}",
+                        tuple(sentencia.parametros or ()),
+                    )
+                    plan = resultado.scalar()
+                    entrada["plan"] = json.loads(plan) if isinstance(plan, str) else plan
+                except Exception as e:
+                    # Una sentencia que falla aborta la transacción: se reinicia para seguir
+                    logger.warning(f"⚠️ No se pudo obtener el plan de una sentencia: {e}")
+                    entrada["error"] = str(e)
+                    await transaccion.rollback()
+                    transaccion = await conn.begin()
+                resultados.append(entrada)
+        finally:
+            await transaccion.rollback()
+    return resultados
@@ -0,0 +1,293 @@
+"""
+Exportación en streaming del detalle de los reportes
+
+Las filas se leen directamente con asyncpg, sin materializar el resultado:
+- CSV: COPY ... TO STDOUT, el servidor formatea y se reenvía cada bloque
+- JSON Lines: cursor de servidor, una línea por fila
+- XLSX: cursor de servidor hacia un libro openpyxl en modo write-only
+
+La memoria usada depende del tamaño de lote, no de la cantidad de filas.
+"""
+import asyncio
+import json
+import tempfile
+import time
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, AsyncIterator, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from openpyxl import Workbook
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.config.database import EXPORTACIONES, motores
+from app.config.settings import settings
+from app.services.metricas import conexiones_agotadas, espera_conexion
+from app.models.report_models import FormatoReporte, TipoReporte
+
+
+class ExportacionNoDisponible(Exception):
+    """El reporte o el formato pedido no se pueden exportar"""
+
+
+@dataclass(frozen=True)
+class FormatoExportacion:
+    extension: str
+    media_type: str
+
+
+FORMATOS = {
+    FormatoReporte.CSV: FormatoExportacion("csv", "text/csv; charset=utf-8"),
+    FormatoReporte.JSON: FormatoExportacion("jsonl", "application/x-ndjson"),
+    FormatoReporte.EXCEL: FormatoExportacion(
+        "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ),
+}
+
+# Detalle exportable por tipo de reporte.
+# Parámetros: $1 fecha inicio, $2 fecha fin (inclusive), $3 doctor (opcional)
+_FILTRO_CITAS = """
+    c.fechareserva >= $1::date
+    AND c.fechareserva < $2::date + 1
+    AND ($3::int IS NULL OR c.doctor_id = $3::int)
+"""
+
+CONSULTAS = {
+    TipoReporte.FINANCIERO: f"""
+        SELECT
+            c.id as cita_id,
+            c.fechareserva,
+            CONCAT(d.nombre, ' ', d.apellido) as doctor,
+            m.nombre as mascota,
+            CONCAT(cl.nombre, ' ', cl.apellido) as cliente,
+            c.motivo
+        FROM cita c
+        JOIN doctor d ON c.doctor_id = d.id
+        JOIN mascota m ON c.mascota_id = m.id
+        JOIN cliente cl ON m.cliente_id = cl.id
+        WHERE c.estado = 3 AND {_FILTRO_CITAS}
+        ORDER BY c.fechareserva, c.id
+    """,
+    TipoReporte.CLINICO: f"""
+        SELECT
+            diag.id as diagnostico_id,
+            c.id as cita_id,
+            c.fechareserva,
+            CONCAT(d.nombre, ' ', d.apellido) as doctor,
+            m.nombre as mascota,
+            e.descripcion as especie,
+            diag.descripcion as diagnostico,
+            diag.observaciones,
+            (
+                SELECT string_agg(t.nombre, '; ' ORDER BY t.id)
+                FROM tratamiento t
+                WHERE t.diagnostico_id = diag.id
+            ) as tratamientos
+        FROM diagnostico diag
+        JOIN cita c ON diag.cita_id = c.id
+        JOIN doctor d ON c.doctor_id = d.id
+        JOIN mascota m ON c.mascota_id = m.id
+        JOIN especie e ON m.especie_id = e.id
+        WHERE {_FILTRO_CITAS}
+        ORDER BY c.fechareserva, diag.id
+    """,
+    TipoReporte.OPERACIONAL: f"""
+        SELECT
+            c.id as cita_id,
+            c.fechacreacion,
+            c.fechareserva,
+            CASE c.estado
+                WHEN 1 THEN 'PENDIENTE'
+                WHEN 2 THEN 'CONFIRMADA'
+                WHEN 3 THEN 'COMPLETADA'
+                WHEN 4 THEN 'CANCELADA'
+                ELSE c.estado::text
+            END as estado,
+            CONCAT(d.nombre, ' ', d.apellido) as doctor,
+            c.motivo
+        FROM cita c
+        JOIN doctor d ON c.doctor_id = d.id
+        WHERE {_FILTRO_CITAS}
+        ORDER BY c.fechareserva, c.id
+    """,
+    TipoReporte.MARKETING: f"""
+        SELECT
+            cl.id as cliente_id,
+            CONCAT(cl.nombre, ' ', cl.apellido) as cliente,
+            cl.telefono,
+            COUNT(c.id) as citas,
+            MAX(c.fechareserva) as ultima_cita
+        FROM cita c
+        JOIN mascota m ON c.mascota_id = m.id
+        JOIN cliente cl ON m.cliente_id = cl.id
+        WHERE {_FILTRO_CITAS}
+        GROUP BY cl.id, cl.nombre, cl.apellido, cl.telefono
+        ORDER BY cl.id
+    """,
+}
+
+
+@dataclass
+class Exportacion:
+    """Exportación validada, lista para transmitirse"""
+    tipo: TipoReporte
+    formato: FormatoReporte
+    fecha_inicio: date
+    fecha_fin: date
+    doctor_id: Optional[int] = None
+
+    def __post_init__(self):
+        if self.tipo not in CONSULTAS:
+            raise ExportacionNoDisponible(f"El reporte {self.tipo.value} no tiene datos exportables")
+        if self.formato not in FORMATOS:
+            raise ExportacionNoDisponible(
+                f"Formato {self.formato.value} no exportable; use "
+                + ", ".join(f.value for f in FORMATOS)
+            )
+        if self.fecha_fin < self.fecha_inicio:
+            raise ExportacionNoDisponible("fecha_fin es anterior a fecha_inicio")
+
+    @property
+    def media_type(self) -> str:
+        return FORMATOS[self.formato].media_type
+
+    @property
+    def nombre_archivo(self) -> str:
+        return f"{self.tipo.value}_{self.fecha_inicio}_{self.fecha_fin}.{FORMATOS[self.formato].extension}"
+
+    @property
+    def argumentos(self) -> Tuple[Any, ...]:
+        return (self.fecha_inicio, self.fecha_fin, self.doctor_id)
+
+    def contenido(self) -> AsyncIterator[bytes]:
+        """Bloques del archivo exportado"""
+        consulta = CONSULTAS[self.tipo]
+        if self.formato == FormatoReporte.CSV:
+            return _csv(consulta, self.argumentos)
+        if self.formato == FormatoReporte.JSON:
+            return _json_lines(consulta, self.argumentos)
+        return _xlsx(consulta, self.argumentos, titulo=self.tipo.value)
+
+
+def url_exportacion(
+    tipo: TipoReporte,
+    fecha_inicio: date,
+    fecha_fin: date,
+    formato: FormatoReporte,
+    doctor_id: Optional[int] = None
+) -> str:
+    """Valida la exportación y devuelve la ruta del endpoint que la transmite"""
+    exportacion = Exportacion(tipo, formato, fecha_inicio, fecha_fin, doctor_id)
+    parametros = {
+        "fecha_inicio": exportacion.fecha_inicio.isoformat(),
+        "fecha_fin": exportacion.fecha_fin.isoformat(),
+        "formato": exportacion.formato.value,
+    }
+    if doctor_id is not None:
+        parametros["doctor_id"] = doctor_id
+    return f"/exportaciones/{tipo.value}?{urlencode(parametros)}"
+
+
+@asynccontextmanager
+async def _conexion_asyncpg():
+    """Conexión asyncpg del pool de exportaciones, devuelta al pool al terminar"""
+    conn = motores[EXPORTACIONES].connect()
+    inicio = time.perf_counter()
+    try:
+        await conn.start()
+    except PoolTimeoutError:
+        conexiones_agotadas.incrementar(EXPORTACIONES)
+        raise
+    espera_conexion.observar(time.perf_counter() - inicio, EXPORTACIONES)
+    try:
+        crudo = await conn.get_raw_connection()
+        yield crudo.driver_connection
+    finally:
+        await conn.close()
+
+
+async def _csv(consulta: str, argumentos: Tuple[Any, ...]) -> AsyncIterator[bytes]:
+    # copy_from_query entrega cada bloque a `escribir`; la cola acotada
+    # frena la lectura del socket si el cliente consume más lento
+    cola: asyncio.Queue = asyncio.Queue(maxsize=settings.exportacion_bloques_en_vuelo)
+
+    async def escribir(datos: bytes):
+        await cola.put(datos)
+
+    async with _conexion_asyncpg() as conexion:
+        async def copiar():
+            try:
+                await conexion.copy_from_query(
+                    consulta, *argumentos, output=escribir, format="csv", header=True
+                )
+            except asyncio.CancelledError:
+                # El cliente se fue: nadie espera el fin de la cola
+                raise
+            except Exception:
+                await cola.put(None)
+                raise
+            await cola.put(None)
+
+        tarea = asyncio.create_task(copiar())
+        try:
+            while (datos := await cola.get()) is not None:
+                yield datos
+            await tarea
+        finally:
+            if not tarea.done():
+                tarea.cancel()
+                with suppress(asyncio.CancelledError):
+                    await tarea
+
+
+async def _filas(consulta: str, argumentos: Tuple[Any, ...]) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+    """Lotes de filas leídos con un cursor de servidor, junto con los nombres de columna"""
+    async with _conexion_asyncpg() as conexion:
+        async with conexion.transaction(readonly=True):
+            sentencia = await conexion.prepare(consulta)
+            columnas = [atributo.name for atributo in sentencia.get_attributes()]
+            cursor = await sentencia.cursor(*argumentos)
+            vacio = True
+            while lote := await cursor.fetch(settings.exportacion_lote_filas):
+                vacio = False
+                yield columnas, [tuple(registro) for registro in lote]
+            if vacio:
+                # Sin filas igual se entregan las columnas (para el encabezado)
+                yield columnas, []
+
+
+async def _json_lines(consulta: str, argumentos: Tuple[Any, ...]) -> AsyncIterator[bytes]:
+    async for columnas, lote in _filas(consulta, argumentos):
+        if not lote:
+            continue
+        lineas = [
+            json.dumps(dict(zip(columnas, fila)), default=str, ensure_ascii=False)
+            for fila in lote
+        ]
+        yield ("\n".join(lineas) + "\n").encode("utf-8")
+
+
+async def _xlsx(consulta: str, argumentos: Tuple[Any, ...], titulo: str) -> AsyncIterator[bytes]:
+    # En modo write-only openpyxl vuelca cada fila a un archivo temporal; el
+    # contenedor zip recién se arma al guardar, así que la respuesta empieza
+    # cuando termina la consulta (con memoria constante igualmente)
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(titulo)
+    encabezado = False
+
+    def agregar(filas: List[tuple]):
+        for fila in filas:
+            hoja.append(fila)
+
+    async for columnas, lote in _filas(consulta, argumentos):
+        if not encabezado:
+            hoja.append(columnas)
+            encabezado = True
+        await asyncio.to_thread(agregar, lote)
+
+    with tempfile.TemporaryFile() as archivo:
+        await asyncio.to_thread(libro.save, archivo)
+        archivo.seek(0)
+        while datos := await asyncio.to_thread(archivo.read, settings.exportacion_tamano_bloque):
+            yield datos
@@ -0,0 +1,37 @@
+"""
+Frescura de los datos servidos durante una operación GraphQL
+Los servicios registran aquí los resultados obsoletos o precalculados
+"""
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# Avisos de la operación en curso: kpi -> datos de frescura
+_avisos: ContextVar[Optional[Dict[str, Dict[str, Any]]]] = ContextVar("avisos_frescura", default=None)
+
+
+def iniciar_avisos() -> Dict[str, Dict[str, Any]]:
+    """Crea el registro de avisos de una operación y lo devuelve"""
+    avisos: Dict[str, Dict[str, Any]] = {}
+    _avisos.set(avisos)
+    return avisos
+
+
+def registrar_frescura(
+    kpi: str,
+    edad_segundos: float,
+    obsoleto: bool,
+    origen: str,
+    reemplazar: bool = True
+):
+    """
+    Anota la edad del dato servido para un KPI en la operación en curso.
+    Con `reemplazar=False` no pisa un aviso ya registrado (p. ej. el de cache obsoleto).
+    """
+    avisos = _avisos.get()
+    if avisos is None or (not reemplazar and kpi in avisos):
+        return
+    avisos[kpi] = {
+        "obsoleto": obsoleto,
+        "edadSegundos": round(edad_segundos, 1),
+        "origen": origen,
+    }
@@ -0,0 +1,154 @@
+"""
+Conecta las métricas de /metrics, las estadísticas por sentencia y los
+spans de SQL con el motor de SQLAlchemy, el pool de conexiones y los caches
+de la aplicación
+"""
+import time
+
+from sqlalchemy import event
+
+from app.config.database import INTERACTIVO, motores, todos_los_motores
+from app.config.settings import settings
+from app.services.estadisticas_sql import estadisticas_sql
+from app.services.explain import capturar
+from app.services.metricas import (
+    ContadorExterno, Medidor, filas_sql, huella_sql, latencia_sql, registro_metricas,
+)
+from app.services.trazas import span_actual, trazador
+
+_INICIOS = "kpi_metricas_inicios"
+
+
+def _antes_de_ejecutar(conn, cursor, sentencia, parametros, contexto, executemany):
+    conn.info.setdefault(_INICIOS, []).append(time.perf_counter())
+
+
+def _despues_de_ejecutar(conn, cursor, sentencia, parametros, contexto, executemany):
+    duracion = time.perf_counter() - conn.info[_INICIOS].pop()
+    huella = huella_sql(sentencia)
+    # -1 en cursores del lado del servidor (exportaciones en streaming)
+    filas = cursor.rowcount
+    latencia_sql.observar(duracion, huella)
+    if filas >= 0:
+        filas_sql.observar(filas, huella)
+    estadisticas_sql.registrar(huella, sentencia, duracion * 1000, filas, parametros)
+    if not executemany:
+        capturar(sentencia, parametros, duracion * 1000)
+    if span_actual.get() is not None:
+        _span_sql(sentencia, huella, filas, duracion, executemany)
+
+
+def _span_sql(sentencia, huella, filas, duracion, executemany):
+    """Span hoja de la sentencia, fechado hacia atrás con su duración"""
+    span = trazador.iniciar_span(
+        f"SQL {huella}",
+        tipo="CLIENT",
+        inicio_ns=time.time_ns() - int(duracion * 1e9),
+        **{
+            "db.system": "postgresql",
+            "db.statement": " ".join(sentencia.split())[:2000],
+            "db.huella": huella,
+            "db.executemany": executemany,
+        },
+    )
+    if filas >= 0:
+        span.atributos["db.filas"] = filas
+    trazador.terminar(span)
+
+
+def _al_fallar(contexto_error):
+    conexion = contexto_error.connection
+    if conexion is not None and conexion.info.get(_INICIOS):
+        conexion.info[_INICIOS].pop()
+
+
+def _pools():
+    valores = {}
+    for carga, motor in todos_los_motores().items():
+        pool = motor.pool
+        valores[(carga, "en_uso")] = pool.checkedout()
+        valores[(carga, "libres")] = pool.checkedin()
+        # overflow() parte de -pool_size: solo las conexiones por encima del tamaño base
+        valores[(carga, "desborde")] = max(pool.overflow(), 0)
+    return valores
+
+
+def _saturacion():
+    """Conexiones en uso sobre el máximo del pool (tamaño + desborde)"""
+    valores = {}
+    for pool, motor in todos_los_motores().items():
+        carga = pool.split("@")[0]
+        maximo = motor.pool.size() + getattr(settings, f"pool_{carga}_desborde")
+        valores[(pool,)] = motor.pool.checkedout() / maximo if maximo else 0.0
+    return valores
+
+
+def _caches():
+    """(aciertos, fallos) por cache"""
+    from app.graphql_schema.cache_respuestas import cache_respuestas
+    from app.graphql_schema.persistidas import consultas_persistidas
+    from app.services.cache import cache_kpis
+    from app.services.renderizado import renderizador
+
+    estadisticas = cache_kpis.estadisticas
+    return {
+        "kpi": (estadisticas.hits + estadisticas.coalescidos + estadisticas.obsoletos, estadisticas.misses),
+        "respuestas": (cache_respuestas.hits, cache_respuestas.misses),
+        "consultas_persistidas": (consultas_persistidas.aciertos, consultas_persistidas.no_encontradas),
+        "graficos": (renderizador.metricas.graficos_cache, renderizador.metricas.graficos),
+    }
+
+
+def _tasas():
+    tasas = {}
+    for cache, (aciertos, fallos) in _caches().items():
+        total = aciertos + fallos
+        tasas[(cache,)] = aciertos / total if total else 0.0
+    return tasas
+
+
+def instrumentar():
+    """Registra los eventos de cada motor y los medidores leídos al exponer; idempotente"""
+    if event.contains(motores[INTERACTIVO].sync_engine, "before_cursor_execute", _antes_de_ejecutar):
+        return
+    for motor in todos_los_motores().values():
+        event.listen(motor.sync_engine, "before_cursor_execute", _antes_de_ejecutar)
+        event.listen(motor.sync_engine, "after_cursor_execute", _despues_de_ejecutar)
+        event.listen(motor.sync_engine, "handle_error", _al_fallar)
+
+    registro_metricas.registrar(Medidor(
+        "kpi_db_pool_conexiones",
+        "Conexiones de cada pool por estado",
+        _pools,
+        ("pool", "estado"),
+    ))
+    registro_metricas.registrar(Medidor(
+        "kpi_db_pool_tamano",
+        "Tamaño base de cada pool de conexiones",
+        lambda: {(pool,): motor.pool.size() for pool, motor in todos_los_motores().items()},
+        ("pool",),
+    ))
+    registro_metricas.registrar(Medidor(
+        "kpi_db_pool_saturacion",
+        "Fracción del máximo de conexiones de cada pool que está en uso",
+        _saturacion,
+        ("pool",),
+    ))
+    registro_metricas.registrar(ContadorExterno(
+        "kpi_cache_aciertos_total",
+        "Lecturas servidas desde cache",
+        lambda: {(cache,): aciertos for cache, (aciertos, _) in _caches().items()},
+        ("cache",),
+    ))
+    registro_metricas.registrar(ContadorExterno(
+        "kpi_cache_fallos_total",
+        "Lecturas que no estaban en cache",
+        lambda: {(cache,): fallos for cache, (_, fallos) in _caches().items()},
+        ("cache",),
+    ))
+    registro_metricas.registrar(Medidor(
+        "kpi_cache_tasa_aciertos",
+        "Fracción de lecturas servidas desde cache",
+        _tasas,
+        ("cache",),
+    ))
@@ -35,7 +35,10 @@ class KPIService:
             func.sum(case((Cita.estado == 3, 1), else_=0)).label('citas_completadas'),
             func.sum(case((Cita.estado == 4, 1), else_=0)).label('citas_canceladas')
         ).where(
-            extract('year', Cita.fechareserva) == anio
+            and_(
+                Cita.fechareserva >= datetime(anio, 1, 1),
+                Cita.fechareserva < datetime(anio + 1, 1, 1)
+            )
         ).group_by(
             extract('month', Cita.fechareserva),
             extract('year', Cita.fechareserva)
@@ -101,6 +104,8 @@ class KPIService:
             mes = datetime.now().month
         if anio is None:
             anio = datetime.now().year
+        inicio_mes = datetime(anio, mes, 1)
+        fin_mes = datetime(anio + 1, 1, 1) if mes == 12 else datetime(anio, mes + 1, 1)
 
         query = select(
             Doctor.id,
@@ -116,8 +121,8 @@ class KPIService:
             Doctor.__table__.outerjoin(Cita.__table__)
         ).where(
             and_(
-                extract('month', Cita.fechareserva) == mes,
-                extract('year', Cita.fechareserva) == anio
+                Cita.fechareserva >= inicio_mes,
+                Cita.fechareserva < fin_mes
             )
         ).group_by(
             Doctor.id, Doctor.nombre, Doctor.apellido
@@ -219,14 +224,17 @@ class KPIService:
 
         # Citas de hoy
         citas_hoy_query = select(func.count(Cita.id)).where(
-            func.date(Cita.fechareserva) == hoy
+            and_(
+                Cita.fechareserva >= datetime.combine(hoy, datetime.min.time()),
+                Cita.fechareserva < datetime.combine(hoy + timedelta(days=1), datetime.min.time())
+            )
         )
         citas_hoy_result = await self.db.execute(citas_hoy_query)
         citas_hoy = citas_hoy_result.scalar()
 
         # Citas de la semana
         citas_semana_query = select(func.count(Cita.id)).where(
-            func.date(Cita.fechareserva) >= inicio_semana
+            Cita.fechareserva >= datetime.combine(inicio_semana, datetime.min.time())
         )
         citas_semana_result = await self.db.execute(citas_semana_query)
         citas_semana = citas_semana_result.scalar()
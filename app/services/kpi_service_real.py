@@ -1,25 +1,118 @@
 """
 Servicio de KPIs CORREGIDO basado en la estructura REAL de la base de datos
 """
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, date
+import functools
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text, func
 from app.models.kpi_models import (
     DashboardResumen, CitasPorMes, MascotasPorEspecie,
-    DoctorPerformance, VacunacionEstadisticas, AlertaVacunacion
+    DoctorPerformance, VacunacionEstadisticas, AlertaVacunacion,
+    KpiDoctor, KpiMascota
 )
+from app.config.settings import settings
+from app.services.cache import cache_kpi
+from app.services.frescura import registrar_frescura
+from app.services.refresco_vistas import refresco_vistas
+from app.services.replicas import version_requerida
+from app.services.estadisticas_sql import etiquetar_metodos
 
 
+def _normalizar_anio(anio: Optional[int] = None) -> dict:
+    return {"anio": anio if anio is not None else datetime.now().year}
+
+
+def _normalizar_mes_anio(mes: Optional[int] = None, anio: Optional[int] = None) -> dict:
+    ahora = datetime.now()
+    return {
+        "mes": mes if mes is not None else ahora.month,
+        "anio": anio if anio is not None else ahora.year,
+    }
+
+
+# Rango [desde, hasta) de días respecto de hoy que corresponde a cada prioridad
+RANGOS_PRIORIDAD = {
+    "VENCIDA": (None, 0),
+    "URGENTE": (0, 8),
+    "PRÓXIMA": (8, 31),
+    "NORMAL": (31, None),
+}
+
+
+def _alerta_desde_fila(row) -> AlertaVacunacion:
+    # Calcular días de vencimiento (negativo si está vencida)
+    dias_vencimiento = int(row[6])
+    if row[7] == 'VENCIDA':
+        dias_vencimiento = -dias_vencimiento
+    
+    return AlertaVacunacion(
+        mascota_id=int(row[0]),
+        mascota_nombre=str(row[1]),
+        cliente_nombre=str(row[2]),
+        tipo_vacuna=str(row[3]),
+        fecha_ultima=str(row[4]) if row[4] else None,
+        fecha_proxima=str(row[5]),
+        dias_vencimiento=dias_vencimiento,
+        prioridad=str(row[7])
+    )
+
+
+def reporta_edad_vista(kpi: str, vista: str):
+    """
+    En modo de vistas materializadas, informa al cliente la edad del último
+    refresco de la vista (también en los aciertos de cache)
+    """
+    def decorador(metodo):
+        @functools.wraps(metodo)
+        async def envoltura(self, *args, **kwargs):
+            resultado = await metodo(self, *args, **kwargs)
+            if self._fuente(kpi) == "vista":
+                edad = refresco_vistas.edad_segundos(vista)
+                if edad is not None:
+                    registrar_frescura(kpi, edad, obsoleto=False, origen=vista, reemplazar=False)
+            return resultado
+        return envoltura
+    return decorador
+
+
+@etiquetar_metodos
 class KPIServiceReal:
     """Servicio para obtener KPIs basado en la estructura REAL de la base de datos"""
     
-    def __init__(self, db: AsyncSession):
+    # KPIs que pueden leerse de las tablas resumen mantenidas por triggers
+    KPIS_RESUMEN = ("dashboard_resumen", "citas_por_mes")
+    # KPIs que pueden leerse de las vistas materializadas
+    KPIS_VISTA = ("citas_por_mes", "doctor_performance", "alertas_vacunacion")
+    
+    def __init__(
+        self,
+        db: AsyncSession,
+        usar_vistas: Optional[bool] = None,
+        usar_resumenes: Optional[bool] = None
+    ):
         self.db = db
+        # Opt-in: leer de las vistas materializadas en lugar de agregar `cita` completa
+        self.usar_vistas = settings.kpi_usar_vistas_materializadas if usar_vistas is None else usar_vistas
+        # Opt-in: leer de las tablas resumen (exactas y en tiempo real)
+        self.usar_resumenes = settings.kpi_usar_tablas_resumen if usar_resumenes is None else usar_resumenes
+    
+    def _fuente(self, kpi: str) -> str:
+        """Origen de datos de un KPI: "resumen", "vista" o "base"; los resúmenes tienen prioridad"""
+        if self.usar_resumenes and kpi in self.KPIS_RESUMEN:
+            return "resumen"
+        # Las respuestas cacheables dependen de la versión de datos, que no cubre el refresco de las vistas
+        if self.usar_vistas and kpi in self.KPIS_VISTA and version_requerida.get() is None:
+            return "vista"
+        return "base"
     
+    @cache_kpi("dashboard_resumen")
     async def get_dashboard_resumen(self) -> DashboardResumen:
         """Obtiene el resumen del dashboard basado en datos reales"""
         
+        if self._fuente("dashboard_resumen") == "resumen":
+            return await self._get_dashboard_resumen_tablas_resumen()
+        
         # Conteo de mascotas
         query_mascotas = text("SELECT COUNT(*) FROM mascota")
         resultado_mascotas = await self.db.execute(query_mascotas)
@@ -34,7 +127,8 @@ class KPIServiceReal:
         query_citas_hoy = text("""
             SELECT COUNT(*) 
             FROM cita 
-            WHERE DATE(fechareserva) = CURRENT_DATE
+            WHERE fechareserva >= CURRENT_DATE
+                AND fechareserva < CURRENT_DATE + 1
         """)
         resultado_citas_hoy = await self.db.execute(query_citas_hoy)
         citas_hoy = resultado_citas_hoy.scalar() or 0
@@ -53,27 +147,88 @@ class KPIServiceReal:
             crecimiento_mensual=0.0  # No se puede calcular sin precios
         )
     
+    async def _get_dashboard_resumen_tablas_resumen(self) -> DashboardResumen:
+        """Resumen del dashboard leyendo unas pocas filas de las tablas resumen"""
+        
+        query = text("""
+            SELECT
+                (SELECT SUM(total) FROM kpi_resumen_global WHERE tabla = 'mascota'),
+                (SELECT SUM(total) FROM kpi_resumen_global WHERE tabla = 'cliente'),
+                (SELECT SUM(total) FROM kpi_resumen_global WHERE tabla = 'cita'),
+                (SELECT COALESCE(SUM(total), 0) FROM kpi_citas_dia WHERE fecha = CURRENT_DATE)
+        """)
+        resultado = await self.db.execute(query)
+        total_mascotas, total_clientes, total_citas, citas_hoy = resultado.fetchone()
+        
+        return DashboardResumen(
+            total_mascotas=int(total_mascotas or 0),
+            total_clientes=int(total_clientes or 0),
+            total_citas=int(total_citas or 0),
+            citas_hoy=int(citas_hoy or 0),
+            ingresos_mes=0.0,  # No hay datos de precios en la BD real
+            crecimiento_mensual=0.0  # No se puede calcular sin precios
+        )
+    
+    @reporta_edad_vista("citas_por_mes", "vista_citas_mensuales")
+    @cache_kpi("citas_por_mes", normalizar=_normalizar_anio)
     async def get_citas_por_mes(self, anio: Optional[int] = None) -> List[CitasPorMes]:
         """Obtiene estadísticas de citas agrupadas por mes usando estructura real"""
         
         if anio is None:
             anio = datetime.now().year
         
-        query = text("""
-            SELECT 
-                TO_CHAR(fechareserva, 'Month') as mes,
-                EXTRACT(YEAR FROM fechareserva) as anio,
-                COUNT(*) as total_citas,
-                COUNT(CASE WHEN estado = 3 THEN 1 END) as citas_completadas,
-                COUNT(CASE WHEN estado = 4 THEN 1 END) as citas_canceladas
-            FROM cita
-            WHERE EXTRACT(YEAR FROM fechareserva) = :anio
-            GROUP BY 
-                TO_CHAR(fechareserva, 'Month'),
-                EXTRACT(YEAR FROM fechareserva),
-                EXTRACT(MONTH FROM fechareserva)
-            ORDER BY EXTRACT(MONTH FROM fechareserva)
-        """)
+        fuente = self._fuente("citas_por_mes")
+        if fuente == "resumen":
+            query = text("""
+                SELECT
+                    TO_CHAR(make_date(r.anio, r.mes, 1), 'Month') as mes,
+                    r.anio,
+                    SUM(r.total) as total_citas,
+                    SUM(CASE WHEN r.estado = 3 THEN r.total ELSE 0 END) as citas_completadas,
+                    SUM(CASE WHEN r.estado = 4 THEN r.total ELSE 0 END) as citas_canceladas
+                FROM (
+                    SELECT
+                        EXTRACT(YEAR FROM fecha)::int as anio,
+                        EXTRACT(MONTH FROM fecha)::int as mes,
+                        estado,
+                        total
+                    FROM kpi_citas_dia
+                    WHERE fecha >= make_date(CAST(:anio AS integer), 1, 1)
+                        AND fecha < make_date(CAST(:anio AS integer) + 1, 1, 1)
+                ) r
+                GROUP BY r.anio, r.mes
+                HAVING SUM(r.total) > 0
+                ORDER BY r.mes
+            """)
+        elif fuente == "vista":
+            query = text("""
+                SELECT
+                    TO_CHAR(make_date(v.anio, v.mes, 1), 'Month') as mes,
+                    v.anio,
+                    v.total_citas,
+                    v.citas_completadas,
+                    v.citas_canceladas
+                FROM vista_citas_mensuales v
+                WHERE v.anio = :anio
+                ORDER BY v.mes
+            """)
+        else:
+            query = text("""
+                SELECT 
+                    TO_CHAR(fechareserva, 'Month') as mes,
+                    EXTRACT(YEAR FROM fechareserva) as anio,
+                    COUNT(*) as total_citas,
+                    COUNT(CASE WHEN estado = 3 THEN 1 END) as citas_completadas,
+                    COUNT(CASE WHEN estado = 4 THEN 1 END) as citas_canceladas
+                FROM cita
+                WHERE fechareserva >= make_date(CAST(:anio AS integer), 1, 1)
+                    AND fechareserva < make_date(CAST(:anio AS integer) + 1, 1, 1)
+                GROUP BY 
+                    TO_CHAR(fechareserva, 'Month'),
+                    EXTRACT(YEAR FROM fechareserva),
+                    EXTRACT(MONTH FROM fechareserva)
+                ORDER BY EXTRACT(MONTH FROM fechareserva)
+            """)
         
         resultado = await self.db.execute(query, {'anio': anio})
         datos = resultado.fetchall()
@@ -95,6 +250,7 @@ class KPIServiceReal:
         
         return citas_por_mes
     
+    @cache_kpi("mascotas_por_especie")
     async def get_mascotas_por_especie(self) -> List[MascotasPorEspecie]:
         """Obtiene distribución de mascotas por especie usando estructura real"""
         
@@ -122,6 +278,8 @@ class KPIServiceReal:
         
         return mascotas_por_especie
     
+    @reporta_edad_vista("doctor_performance", "vista_doctor_performance")
+    @cache_kpi("doctor_performance", normalizar=_normalizar_mes_anio)
     async def get_doctor_performance(
         self, 
         mes: Optional[int] = None, 
@@ -134,21 +292,37 @@ class KPIServiceReal:
         if mes is None:
             mes = datetime.now().month
         
-        query = text("""
-            SELECT 
-                d.id as doctor_id,
-                CONCAT(d.nombre, ' ', d.apellido) as doctor_nombre,
-                COUNT(c.id) as total_citas,
-                COUNT(CASE WHEN c.estado = 3 THEN 1 END) as citas_completadas,
-                COUNT(DISTINCT diag.id) as total_diagnosticos
-            FROM doctor d
-            LEFT JOIN cita c ON d.id = c.doctor_id
-                AND EXTRACT(MONTH FROM c.fechareserva) = :mes
-                AND EXTRACT(YEAR FROM c.fechareserva) = :anio
-            LEFT JOIN diagnostico diag ON c.id = diag.cita_id
-            GROUP BY d.id, d.nombre, d.apellido
-            ORDER BY total_citas DESC
-        """)
+        if self._fuente("doctor_performance") == "vista":
+            query = text("""
+                SELECT
+                    d.id as doctor_id,
+                    CONCAT(d.nombre, ' ', d.apellido) as doctor_nombre,
+                    COALESCE(v.total_citas, 0) as total_citas,
+                    COALESCE(v.citas_completadas, 0) as citas_completadas,
+                    COALESCE(v.total_diagnosticos, 0) as total_diagnosticos
+                FROM doctor d
+                LEFT JOIN vista_doctor_performance v ON v.doctor_id = d.id
+                    AND v.mes = :mes
+                    AND v.anio = :anio
+                ORDER BY total_citas DESC
+            """)
+        else:
+            query = text("""
+                SELECT 
+                    d.id as doctor_id,
+                    CONCAT(d.nombre, ' ', d.apellido) as doctor_nombre,
+                    COUNT(c.id) as total_citas,
+                    COUNT(CASE WHEN c.estado = 3 THEN 1 END) as citas_completadas,
+                    COUNT(DISTINCT diag.id) as total_diagnosticos
+                FROM doctor d
+                LEFT JOIN cita c ON d.id = c.doctor_id
+                    AND c.fechareserva >= make_date(CAST(:anio AS integer), CAST(:mes AS integer), 1)
+                    AND c.fechareserva < make_date(CAST(:anio AS integer), CAST(:mes AS integer), 1)
+                        + INTERVAL '1 month'
+                LEFT JOIN diagnostico diag ON c.id = diag.cita_id
+                GROUP BY d.id, d.nombre, d.apellido
+                ORDER BY total_citas DESC
+            """)
         
         resultado = await self.db.execute(query, {'mes': mes, 'anio': anio})
         datos = resultado.fetchall()
@@ -173,6 +347,7 @@ class KPIServiceReal:
         
         return performances
     
+    @cache_kpi("vacunacion_estadisticas")
     async def get_vacunacion_estadisticas(self) -> VacunacionEstadisticas:
         """Obtiene estadísticas de vacunación usando estructura real"""
         
@@ -223,10 +398,141 @@ class KPIServiceReal:
             vacunas_mas_aplicadas=vacunas_mas_aplicadas
         )
     
+    @reporta_edad_vista("alertas_vacunacion", "vista_vacunaciones_proximas")
+    @cache_kpi("alertas_vacunacion")
     async def get_alertas_vacunacion(self, dias_limite: int = 30) -> List[AlertaVacunacion]:
         """Obtiene alertas de vacunaciones próximas o vencidas usando estructura real"""
         
-        query = text("""
+        if self._fuente("alertas_vacunacion") == "vista":
+            query = text("""
+                SELECT
+                    v.mascota_id,
+                    v.mascota_nombre,
+                    v.cliente_nombre,
+                    v.vacuna,
+                    v.fechavacunacion as fecha_ultima,
+                    v.proximavacunacion as fecha_proxima,
+                    ABS(v.proximavacunacion - CURRENT_DATE) as dias_diferencia,
+                    CASE 
+                        WHEN v.proximavacunacion < CURRENT_DATE THEN 'VENCIDA'
+                        WHEN v.proximavacunacion <= CURRENT_DATE + INTERVAL '7 days' THEN 'URGENTE'
+                        WHEN v.proximavacunacion <= CURRENT_DATE + INTERVAL '30 days' THEN 'PRÓXIMA'
+                        ELSE 'NORMAL'
+                    END as prioridad
+                FROM vista_vacunaciones_proximas v
+                -- Mismo predicado que la consulta sobre las tablas base
+                WHERE v.proximavacunacion < CURRENT_DATE + GREATEST(CAST(:dias_limite AS integer) + 1, 0)
+                ORDER BY v.proximavacunacion ASC
+            """)
+        else:
+            query = text("""
+                SELECT 
+                    m.id as mascota_id,
+                    m.nombre as mascota_nombre,
+                    CONCAT(c.nombre, ' ', c.apellido) as cliente_nombre,
+                    v.descripcion as vacuna,
+                    dv.fechavacunacion as fecha_ultima,
+                    dv.proximavacunacion as fecha_proxima,
+                    CASE 
+                        WHEN dv.proximavacunacion < CURRENT_DATE 
+                        THEN CURRENT_DATE - dv.proximavacunacion
+                        ELSE dv.proximavacunacion - CURRENT_DATE
+                    END as dias_diferencia,
+                    CASE 
+                        WHEN dv.proximavacunacion < CURRENT_DATE THEN 'VENCIDA'
+                        WHEN dv.proximavacunacion <= CURRENT_DATE + INTERVAL '7 days' THEN 'URGENTE'
+                        WHEN dv.proximavacunacion <= CURRENT_DATE + INTERVAL '30 days' THEN 'PRÓXIMA'
+                        ELSE 'NORMAL'
+                    END as prioridad
+                FROM detalle_vacunacion dv
+                JOIN carnet_vacunacion cv ON dv.carnet_vacunacion_id = cv.id
+                JOIN mascota m ON cv.mascota_id = m.id
+                JOIN cliente c ON m.cliente_id = c.id
+                JOIN vacuna v ON dv.vacuna_id = v.id
+                -- Un solo rango sobre proximavacunacion (equivale a "<= hoy + dias_limite
+                -- o vencida") para que pueda usar idx_detalle_vacunacion_proxima
+                WHERE dv.proximavacunacion < CURRENT_DATE + GREATEST(CAST(:dias_limite AS integer) + 1, 0)
+                ORDER BY 
+                    CASE 
+                        WHEN dv.proximavacunacion < CURRENT_DATE THEN 1
+                        ELSE 2
+                    END,
+                    dv.proximavacunacion ASC
+            """)
+        
+        resultado = await self.db.execute(query, {'dias_limite': dias_limite})
+        datos = resultado.fetchall()
+        
+        return [_alerta_desde_fila(row) for row in datos]
+    
+    async def get_alertas_vacunacion_pagina(
+        self,
+        primero: int,
+        despues: Optional[Tuple[date, int]] = None,
+        dias_limite: int = 30,
+        prioridades: Optional[List[str]] = None,
+        especie: Optional[str] = None,
+        vacuna: Optional[str] = None
+    ) -> Tuple[List[Tuple[date, int, AlertaVacunacion]], bool]:
+        """
+        Página de alertas ordenada por (proximavacunacion, detalle_vacunacion.id).
+        
+        Paginación por clave: la página continúa desde `despues` recorriendo
+        idx_detalle_vacunacion_proxima_id, sin OFFSET. Devuelve cada alerta con
+        su clave y si existe una página siguiente.
+        """
+        condiciones = [
+            "dv.proximavacunacion < CURRENT_DATE + GREATEST(CAST(:dias_limite AS integer) + 1, 0)"
+        ]
+        parametros = {"dias_limite": dias_limite, "limite": primero + 1}
+        
+        if despues is not None:
+            condiciones.append(
+                "(dv.proximavacunacion, dv.id) > (CAST(:despues_fecha AS date), CAST(:despues_id AS integer))"
+            )
+            parametros["despues_fecha"], parametros["despues_id"] = despues
+        
+        if prioridades:
+            rangos = [RANGOS_PRIORIDAD[p] for p in sorted(set(prioridades))]
+            # Cotas externas como condición de índice; el OR descarta los huecos entre rangos
+            if all(desde is not None for desde, _ in rangos):
+                condiciones.append("dv.proximavacunacion >= CURRENT_DATE + CAST(:desde AS integer)")
+                parametros["desde"] = min(desde for desde, _ in rangos)
+            if all(hasta is not None for _, hasta in rangos):
+                condiciones.append("dv.proximavacunacion < CURRENT_DATE + CAST(:hasta AS integer)")
+                parametros["hasta"] = max(hasta for _, hasta in rangos)
+            alternativas = []
+            for i, (desde, hasta) in enumerate(rangos):
+                partes = []
+                if desde is not None:
+                    partes.append(f"dv.proximavacunacion >= CURRENT_DATE + CAST(:desde_{i} AS integer)")
+                    parametros[f"desde_{i}"] = desde
+                if hasta is not None:
+                    partes.append(f"dv.proximavacunacion < CURRENT_DATE + CAST(:hasta_{i} AS integer)")
+                    parametros[f"hasta_{i}"] = hasta
+                alternativas.append(" AND ".join(partes))
+            condiciones.append("(" + " OR ".join(f"({a})" for a in alternativas) + ")")
+        
+        if vacuna is not None:
+            # Resolver los ids antes permite recorrer idx_detalle_vacunacion_vacuna_proxima en orden
+            resultado = await self.db.execute(
+                text("SELECT id FROM vacuna WHERE descripcion = :vacuna"), {"vacuna": vacuna}
+            )
+            vacunas = [row[0] for row in resultado.fetchall()]
+            if not vacunas:
+                return [], False
+            if len(vacunas) == 1:
+                condiciones.append("dv.vacuna_id = :vacuna_id")
+                parametros["vacuna_id"] = vacunas[0]
+            else:
+                condiciones.append("dv.vacuna_id = ANY(CAST(:vacunas AS integer[]))")
+                parametros["vacunas"] = vacunas
+        
+        if especie is not None:
+            condiciones.append("m.especie_id IN (SELECT id FROM especie WHERE descripcion = :especie)")
+            parametros["especie"] = especie
+        
+        query = text(f"""
             SELECT 
                 m.id as mascota_id,
                 m.nombre as mascota_nombre,
@@ -234,51 +540,124 @@ class KPIServiceReal:
                 v.descripcion as vacuna,
                 dv.fechavacunacion as fecha_ultima,
                 dv.proximavacunacion as fecha_proxima,
-                CASE 
-                    WHEN dv.proximavacunacion < CURRENT_DATE 
-                    THEN CURRENT_DATE - dv.proximavacunacion
-                    ELSE dv.proximavacunacion - CURRENT_DATE
-                END as dias_diferencia,
+                ABS(dv.proximavacunacion - CURRENT_DATE) as dias_diferencia,
                 CASE 
                     WHEN dv.proximavacunacion < CURRENT_DATE THEN 'VENCIDA'
                     WHEN dv.proximavacunacion <= CURRENT_DATE + INTERVAL '7 days' THEN 'URGENTE'
                     WHEN dv.proximavacunacion <= CURRENT_DATE + INTERVAL '30 days' THEN 'PRÓXIMA'
                     ELSE 'NORMAL'
-                END as prioridad
+                END as prioridad,
+                dv.id as detalle_vacunacion_id
             FROM detalle_vacunacion dv
             JOIN carnet_vacunacion cv ON dv.carnet_vacunacion_id = cv.id
             JOIN mascota m ON cv.mascota_id = m.id
             JOIN cliente c ON m.cliente_id = c.id
             JOIN vacuna v ON dv.vacuna_id = v.id
-            WHERE dv.proximavacunacion <= CURRENT_DATE + INTERVAL ':dias_limite days'
-                OR dv.proximavacunacion < CURRENT_DATE
-            ORDER BY 
-                CASE 
-                    WHEN dv.proximavacunacion < CURRENT_DATE THEN 1
-                    ELSE 2
-                END,
-                dv.proximavacunacion ASC
+            WHERE {" AND ".join(condiciones)}
+            ORDER BY dv.proximavacunacion, dv.id
+            LIMIT :limite
         """)
         
-        resultado = await self.db.execute(query, {'dias_limite': dias_limite})
+        resultado = await self.db.execute(query, parametros)
         datos = resultado.fetchall()
         
-        alertas = []
-        for row in datos:
-            # Calcular días de vencimiento (negativo si está vencida)
-            dias_vencimiento = int(row[6])
-            if row[7] == 'VENCIDA':
-                dias_vencimiento = -dias_vencimiento
-            
-            alertas.append(AlertaVacunacion(
+        pagina = [(row[5], int(row[8]), _alerta_desde_fila(row)) for row in datos[:primero]]
+        return pagina, len(datos) > primero
+    
+    async def get_kpis_doctores(self, doctor_ids: List[int]) -> Dict[int, KpiDoctor]:
+        """KPIs de varios doctores en una sola consulta (lotes de `_entities`)"""
+        
+        query = text("""
+            SELECT
+                d.id as doctor_id,
+                CONCAT(d.nombre, ' ', d.apellido) as doctor_nombre,
+                COUNT(DISTINCT c.id) as total_citas,
+                COUNT(DISTINCT c.id) FILTER (WHERE c.estado = 3) as citas_completadas,
+                COUNT(DISTINCT c.id) FILTER (WHERE c.estado = 4) as citas_canceladas,
+                COUNT(DISTINCT c.mascota_id) as pacientes_atendidos,
+                COUNT(DISTINCT diag.id) as total_diagnosticos,
+                MAX(c.fechareserva) as ultima_cita
+            FROM doctor d
+            LEFT JOIN cita c ON c.doctor_id = d.id
+            LEFT JOIN diagnostico diag ON diag.cita_id = c.id
+            WHERE d.id = ANY(CAST(:ids AS integer[]))
+            GROUP BY d.id, d.nombre, d.apellido
+        """)
+        
+        resultado = await self.db.execute(query, {"ids": doctor_ids})
+        
+        kpis = {}
+        for row in resultado.fetchall():
+            total_citas = int(row[2])
+            citas_completadas = int(row[3])
+            kpis[int(row[0])] = KpiDoctor(
+                doctor_id=int(row[0]),
+                doctor_nombre=str(row[1]),
+                total_citas=total_citas,
+                citas_completadas=citas_completadas,
+                citas_canceladas=int(row[4]),
+                pacientes_atendidos=int(row[5]),
+                total_diagnosticos=int(row[6]),
+                tasa_completitud=round(citas_completadas / total_citas * 100, 2) if total_citas > 0 else 0.0,
+                ultima_cita=row[7]
+            )
+        return kpis
+    
+    async def get_kpis_mascotas(self, mascota_ids: List[int]) -> Dict[int, KpiMascota]:
+        """KPIs de varias mascotas en una sola consulta (lotes de `_entities`)"""
+        
+        # Citas y vacunas se agregan por separado para no multiplicar filas entre sí
+        query = text("""
+            SELECT
+                m.id as mascota_id,
+                m.nombre as mascota_nombre,
+                e.descripcion as especie,
+                COALESCE(c.total_citas, 0),
+                COALESCE(c.citas_completadas, 0),
+                c.ultima_cita,
+                COALESCE(v.total_vacunaciones, 0),
+                COALESCE(v.vacunas_vencidas, 0),
+                v.proxima_vacunacion
+            FROM mascota m
+            JOIN especie e ON e.id = m.especie_id
+            LEFT JOIN (
+                SELECT
+                    mascota_id,
+                    COUNT(*) as total_citas,
+                    COUNT(*) FILTER (WHERE estado = 3) as citas_completadas,
+                    MAX(fechareserva) as ultima_cita
+                FROM cita
+                WHERE mascota_id = ANY(CAST(:ids AS integer[]))
+                GROUP BY mascota_id
+            ) c ON c.mascota_id = m.id
+            LEFT JOIN (
+                SELECT
+                    cv.mascota_id,
+                    COUNT(*) as total_vacunaciones,
+                    COUNT(*) FILTER (WHERE dv.proximavacunacion < CURRENT_DATE) as vacunas_vencidas,
+                    MIN(dv.proximavacunacion) FILTER (WHERE dv.proximavacunacion >= CURRENT_DATE)
+                        as proxima_vacunacion
+                FROM carnet_vacunacion cv
+                JOIN detalle_vacunacion dv ON dv.carnet_vacunacion_id = cv.id
+                WHERE cv.mascota_id = ANY(CAST(:ids AS integer[]))
+                GROUP BY cv.mascota_id
+            ) v ON v.mascota_id = m.id
+            WHERE m.id = ANY(CAST(:ids AS integer[]))
+        """)
+        
+        resultado = await self.db.execute(query, {"ids": mascota_ids})
+        
+        return {
+            int(row[0]): KpiMascota(
                 mascota_id=int(row[0]),
                 mascota_nombre=str(row[1]),
-                cliente_nombre=str(row[2]),
-                tipo_vacuna=str(row[3]),
-                fecha_ultima=str(row[4]) if row[4] else None,
-                fecha_proxima=str(row[5]),
-                dias_vencimiento=dias_vencimiento,
-                prioridad=str(row[7])
-            ))
-        
-        return alertas
\ No newline at end of file
+                especie=str(row[2]),
+                total_citas=int(row[3]),
+                citas_completadas=int(row[4]),
+                ultima_cita=row[5],
+                total_vacunaciones=int(row[6]),
+                vacunas_vencidas=int(row[7]),
+                proxima_vacunacion=row[8]
+            )
+            for row in resultado.fetchall()
+        }
@@ -0,0 +1,220 @@
+"""
+Métricas en formato de exposición de Prometheus (text/plain 0.0.4)
+
+Registro propio y mínimo: todo se registra desde el event loop (resolvers,
+eventos de SQLAlchemy), así que observar es incrementar un contador en un
+dict, sin locks. Los histogramas guardan conteos por bucket y se acumulan
+recién al exponer. Los valores que ya existen en otros componentes (pool,
+caches) se leen con callbacks al momento del scrape.
+"""
+import hashlib
+import math
+import re
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.config.settings import settings
+
+Etiquetas = Tuple[str, ...]
+
+# Segundos; cubren desde un campo en memoria hasta un reporte completo
+BUCKETS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_FILAS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# Etiqueta que reemplaza a las combinaciones nuevas al superar el máximo de series
+DESBORDE = "__otras__"
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear(valor: float) -> str:
+    if math.isinf(valor):
+        return "+Inf" if valor > 0 else "-Inf"
+    if valor == int(valor):
+        return str(int(valor))
+    return repr(valor)
+
+
+class Metrica:
+    """Base de las métricas: nombre, ayuda, etiquetas y límite de series"""
+
+    tipo = "untyped"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (), max_series: Optional[int] = None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.max_series = max_series or settings.metricas_max_series
+
+    def _serie(self, series: Dict[Etiquetas, object], valores: Etiquetas) -> Etiquetas:
+        # Acota la cardinalidad ante etiquetas que vienen del cliente
+        if valores in series or len(series) < self.max_series:
+            return valores
+        return tuple(DESBORDE for _ in valores)
+
+    def _etiquetas(self, valores: Etiquetas, extra: str = "") -> str:
+        pares = [f'{nombre}="{_escapar(str(valor))}"' for nombre, valor in zip(self.etiquetas, valores)]
+        if extra:
+            pares.append(extra)
+        return "{" + ",".join(pares) + "}" if pares else ""
+
+    def muestras(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def exponer(self) -> List[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}", *self.muestras()]
+
+
+class Contador(Metrica):
+    tipo = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._valores: Dict[Etiquetas, float] = {}
+
+    def incrementar(self, *etiquetas: str, valor: float = 1.0):
+        serie = self._serie(self._valores, etiquetas)
+        self._valores[serie] = self._valores.get(serie, 0.0) + valor
+
+    def muestras(self) -> Iterable[str]:
+        for serie, valor in self._valores.items():
+            yield f"{self.nombre}{self._etiquetas(serie)} {_formatear(valor)}"
+
+
+class Histograma(Metrica):
+    tipo = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = BUCKETS_LATENCIA, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # Por serie: conteos por bucket (el último es +Inf) y suma
+        self._series: Dict[Etiquetas, List[float]] = {}
+
+    def observar(self, valor: float, *etiquetas: str):
+        serie = self._serie(self._series, etiquetas)
+        datos = self._series.get(serie)
+        if datos is None:
+            datos = self._series[serie] = [0.0] * (len(self.buckets) + 2)
+        datos[bisect_left(self.buckets, valor)] += 1
+        datos[-1] += valor
+
+    def muestras(self) -> Iterable[str]:
+        for serie, datos in self._series.items():
+            acumulado = 0.0
+            for limite, conteo in zip((*self.buckets, math.inf), datos):
+                acumulado += conteo
+                etiqueta_le = f'le="{_formatear(limite)}"'
+                yield f"{self.nombre}_bucket{self._etiquetas(serie, etiqueta_le)} {_formatear(acumulado)}"
+            yield f"{self.nombre}_sum{self._etiquetas(serie)} {repr(datos[-1])}"
+            yield f"{self.nombre}_count{self._etiquetas(serie)} {_formatear(acumulado)}"
+
+
+class Medidor(Metrica):
+    """Gauge cuyo valor se lee con una función al exponer"""
+
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, leer: Callable[[], Dict[Etiquetas, float]], etiquetas: Sequence[str] = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.leer = leer
+
+    def muestras(self) -> Iterable[str]:
+        for serie, valor in self.leer().items():
+            yield f"{self.nombre}{self._etiquetas(serie)} {_formatear(float(valor))}"
+
+
+class ContadorExterno(Medidor):
+    """Contador mantenido por otro componente y leído al exponer"""
+
+    tipo = "counter"
+
+
+class RegistroMetricas:
+    """Conjunto de métricas expuestas en /metrics"""
+
+    def __init__(self):
+        self._metricas: Dict[str, Metrica] = {}
+
+    def registrar(self, metrica: Metrica) -> Metrica:
+        self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def exponer(self) -> str:
+        lineas = []
+        for metrica in self._metricas.values():
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+# === HUELLAS DE SQL ===
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_ESPACIOS = re.compile(r"\s+")
+_COMENTARIOS = re.compile(r"--[^\n]*")
+_huellas: Dict[str, str] = {}
+# Texto normalizado de cada huella, para la métrica de información
+textos_sql: Dict[str, str] = {}
+
+
+def huella_sql(sentencia: str) -> str:
+    """
+    Identificador estable de una sentencia: sin comentarios, literales ni
+    diferencias de espacios. Se memoiza por texto, así que en el camino
+    caliente es una búsqueda en un dict.
+    """
+    huella = _huellas.get(sentencia)
+    if huella is None:
+        normalizada = _ESPACIOS.sub(" ", _LITERALES.sub("?", _COMENTARIOS.sub("", sentencia))).strip()
+        huella = hashlib.sha1(normalizada.encode("utf-8")).hexdigest()[:12]
+        if len(_huellas) < settings.metricas_max_series:
+            _huellas[sentencia] = huella
+            textos_sql.setdefault(huella, normalizada)
+    return huella
+
+
+# Registro global y métricas de la aplicación
+registro_metricas = RegistroMetricas()
+
+latencia_operaciones = registro_metricas.registrar(Histograma(
+    "kpi_graphql_operacion_segundos",
+    "Duración de las operaciones GraphQL",
+    ("tipo", "operacion"),
+))
+latencia_campos = registro_metricas.registrar(Histograma(
+    "kpi_graphql_campo_segundos",
+    "Duración de los resolvers GraphQL (campos con resolver propio)",
+    ("campo",),
+))
+errores_operaciones = registro_metricas.registrar(Contador(
+    "kpi_graphql_errores_total",
+    "Operaciones GraphQL que devolvieron errores",
+    ("operacion",),
+))
+latencia_sql = registro_metricas.registrar(Histograma(
+    "kpi_sql_sentencia_segundos",
+    "Duración de las sentencias SQL por huella",
+    ("huella",),
+))
+filas_sql = registro_metricas.registrar(Histograma(
+    "kpi_sql_filas",
+    "Filas devueltas o afectadas por sentencia SQL",
+    ("huella",),
+    buckets=BUCKETS_FILAS,
+))
+espera_conexion = registro_metricas.registrar(Histograma(
+    "kpi_db_espera_conexion_segundos",
+    "Espera por una conexión del pool por carga de trabajo",
+    ("pool",),
+))
+conexiones_agotadas = registro_metricas.registrar(Contador(
+    "kpi_db_pool_agotado_total",
+    "Esperas por una conexión que superaron pool_espera_maxima_segundos",
+    ("pool",),
+))
+registro_metricas.registrar(Medidor(
+    "kpi_sql_sentencia_info",
+    "Texto normalizado de cada huella de SQL",
+    lambda: {(huella, texto[:200]): 1 for huella, texto in textos_sql.items()},
+    ("huella", "sql"),
+))
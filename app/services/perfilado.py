@@ -0,0 +1,215 @@
+"""
+Perfilado de un request: muestreo de CPU, esperas de asyncio y memoria
+
+Un hilo muestrea cada `intervalo` la pila del hilo del event loop. Bajo
+asyncio eso muestra el código que ocupa la CPU (conversión de filas,
+serialización de Strawberry) pero no lo que se está esperando, así que en
+cada muestra también se recorre la cadena de `await` de las tareas creadas
+durante el request: ahí aparece el tiempo esperando a asyncpg.
+
+El resultado es un archivo de speedscope (https://www.speedscope.app) con
+dos perfiles, "CPU" y "Esperas", más las diferencias de tracemalloc entre
+el inicio y el fin del request.
+"""
+import asyncio
+import sys
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+
+Marco = Tuple[str, str, int]  # (función, archivo, línea)
+
+# Funciones del event loop en las que el hilo está ocioso esperando I/O
+_OCIOSO = {"select", "poll", "run_forever", "run_until_complete", "_run_once"}
+MARCO_OCIOSO: Marco = ("[event loop esperando I/O]", "", 0)
+
+
+def _pila_hilo(frame) -> List[Marco]:
+    pila = []
+    while frame is not None:
+        codigo = frame.f_code
+        pila.append((codigo.co_name, codigo.co_filename, frame.f_lineno))
+        frame = frame.f_back
+    pila.reverse()
+    return pila
+
+
+def _pila_espera(tarea: asyncio.Task) -> List[Marco]:
+    """Cadena de awaits de una tarea suspendida, desde la corrutina raíz"""
+    pila = []
+    corrutina = tarea.get_coro()
+    while corrutina is not None:
+        frame = getattr(corrutina, "cr_frame", None) or getattr(corrutina, "gi_frame", None)
+        if frame is None:
+            break
+        pila.append((getattr(corrutina, "__qualname__", frame.f_code.co_name), frame.f_code.co_filename, frame.f_lineno))
+        siguiente = getattr(corrutina, "cr_await", None) or getattr(corrutina, "gi_yieldfrom", None)
+        if siguiente is not None and not hasattr(siguiente, "cr_frame") and not hasattr(siguiente, "gi_frame"):
+            # Futuro de bajo nivel (p. ej. el protocolo de asyncpg o un gather)
+            tipo = type(siguiente).__name__
+            pila.append((f"await {'Future' if tipo == 'FutureIter' else tipo}", "", 0))
+            break
+        corrutina = siguiente
+    return pila
+
+
+@dataclass
+class Perfil:
+    """Muestras de un request y diferencias de memoria"""
+    nombre: str
+    intervalo_ms: float
+    cpu: List[Tuple[List[Marco], float]] = field(default_factory=list)
+    esperas: List[Tuple[List[Marco], float]] = field(default_factory=list)
+    memoria: List[Dict[str, Any]] = field(default_factory=list)
+    duracion_ms: float = 0.0
+
+    def speedscope(self) -> Dict[str, Any]:
+        """Documento en el formato de archivo de speedscope"""
+        indices: Dict[Marco, int] = {}
+        marcos = []
+
+        def indice(marco: Marco) -> int:
+            if marco not in indices:
+                indices[marco] = len(marcos)
+                nombre, archivo, linea = marco
+                marcos.append({"name": nombre, "file": archivo, "line": linea} if archivo else {"name": nombre})
+            return indices[marco]
+
+        def perfil(nombre: str, muestras: List[Tuple[List[Marco], float]]) -> Dict[str, Any]:
+            total = sum(peso for _, peso in muestras)
+            return {
+                "type": "sampled",
+                "name": nombre,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(total, 3),
+                "samples": [[indice(marco) for marco in pila] for pila, _ in muestras],
+                "weights": [round(peso, 3) for _, peso in muestras],
+            }
+
+        perfiles = [
+            perfil(f"CPU - {self.nombre}", self.cpu),
+            perfil(f"Esperas - {self.nombre}", self.esperas),
+        ]
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": marcos},
+            "profiles": perfiles,
+            "name": self.nombre,
+            "activeProfileIndex": 0,
+            "exporter": "veterinaria-kpi",
+        }
+
+
+class Muestreador(threading.Thread):
+    """Hilo que muestrea el event loop hasta que se lo detiene"""
+
+    def __init__(self, perfil: Perfil, loop: asyncio.AbstractEventLoop, tareas_previas: set):
+        super().__init__(name="perfilador", daemon=True)
+        self.perfil = perfil
+        self.loop = loop
+        self.hilo_loop = threading.get_ident()
+        self.tareas_previas = tareas_previas
+        self._detener = threading.Event()
+
+    def _tareas(self) -> List[asyncio.Task]:
+        # all_tasks reintenta si el conjunto cambia mientras se recorre
+        try:
+            tareas = asyncio.all_tasks(self.loop)
+        except RuntimeError:
+            return []
+        return [t for t in tareas if id(t) not in self.tareas_previas and not t.done()]
+
+    def run(self):
+        intervalo = self.perfil.intervalo_ms / 1000
+        anterior = time.perf_counter()
+        while not self._detener.wait(intervalo):
+            ahora = time.perf_counter()
+            peso = (ahora - anterior) * 1000
+            anterior = ahora
+
+            pila = _pila_hilo(sys._current_frames().get(self.hilo_loop))
+            if not pila or pila[-1][0] in _OCIOSO:
+                pila = [MARCO_OCIOSO]
+            self.perfil.cpu.append((pila, peso))
+
+            for tarea in self._tareas():
+                espera = _pila_espera(tarea)
+                if espera:
+                    self.perfil.esperas.append((espera, peso))
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+class Perfilador:
+    """Perfila un request por vez; los demás se atienden sin perfilar"""
+
+    def __init__(self, intervalo_ms: float, memoria_top: int):
+        self.intervalo_ms = intervalo_ms
+        self.memoria_top = memoria_top
+        self._ocupado = False
+
+    @property
+    def ocupado(self) -> bool:
+        return self._ocupado
+
+    def iniciar(self, nombre: str) -> Optional["SesionPerfilado"]:
+        if self._ocupado:
+            return None
+        self._ocupado = True
+        return SesionPerfilado(self, nombre)
+
+
+class SesionPerfilado:
+    def __init__(self, perfilador: Perfilador, nombre: str):
+        self.perfilador = perfilador
+        self.perfil = Perfil(nombre=nombre, intervalo_ms=perfilador.intervalo_ms)
+        loop = asyncio.get_running_loop()
+        tareas_previas = {id(t) for t in asyncio.all_tasks(loop)}
+
+        self._inicio_tracemalloc = not tracemalloc.is_tracing()
+        if self._inicio_tracemalloc:
+            tracemalloc.start()
+        self._memoria_antes = tracemalloc.take_snapshot()
+
+        self._inicio = time.perf_counter()
+        self._muestreador = Muestreador(self.perfil, loop, tareas_previas)
+        self._muestreador.start()
+
+    def terminar(self) -> Perfil:
+        self._muestreador.detener()
+        self.perfil.duracion_ms = (time.perf_counter() - self._inicio) * 1000
+        try:
+            despues = tracemalloc.take_snapshot()
+            # Sin las asignaciones del propio perfilador
+            filtros = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            diferencias = despues.filter_traces(filtros).compare_to(
+                self._memoria_antes.filter_traces(filtros), "lineno"
+            )
+            self.perfil.memoria = [
+                {
+                    "ubicacion": str(diferencia.traceback[0]),
+                    "diferenciaKb": round(diferencia.size_diff / 1024, 1),
+                    "tamanoKb": round(diferencia.size / 1024, 1),
+                    "bloques": diferencia.count,
+                }
+                for diferencia in diferencias[:self.perfilador.memoria_top]
+            ]
+        finally:
+            if self._inicio_tracemalloc:
+                tracemalloc.stop()
+            self.perfilador._ocupado = False
+        return self.perfil
+
+
+# Instancia global del perfilador de requests
+perfilador = Perfilador(
+    intervalo_ms=settings.perfilado_intervalo_ms,
+    memoria_top=settings.perfilado_memoria_top,
+)
@@ -0,0 +1,93 @@
+"""
+Plazos de los campos GraphQL y cancelación del trabajo en Postgres
+
+Cada campo raíz tiene un plazo (`plazo_operacion_segundos`, o el de
+`plazos_campos_segundos` para ese campo). El límite viaja en
+`limite_actual` hasta las sesiones del request, que lo aplican como
+statement_timeout local a la transacción cuando es más corto que el del
+pool. Al vencer el plazo, o si el cliente HTTP se desconecta, se cancela
+la corrutina del resolver; asyncpg envía entonces un CancelRequest y la
+sentencia en curso se interrumpe en el servidor.
+"""
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.settings import settings
+from app.services.metricas import Contador, registro_metricas
+
+# Límite (time.monotonic) del campo raíz en curso; None fuera de un campo con plazo
+limite_actual: ContextVar[Optional[float]] = ContextVar("limite_plazo_actual", default=None)
+
+plazos_vencidos = registro_metricas.registrar(Contador(
+    "kpi_graphql_plazos_vencidos_total",
+    "Campos raíz cancelados por superar su plazo",
+    ("campo",),
+))
+desconexiones = registro_metricas.registrar(Contador(
+    "kpi_graphql_desconexiones_total",
+    "Operaciones canceladas porque el cliente HTTP se desconectó",
+))
+
+# Clave en `AsyncSession.info` del statement_timeout local aplicado
+_TIMEOUT_APLICADO = "kpi_statement_timeout_ms"
+
+
+class PlazoVencido(Exception):
+    """El campo superó su plazo y se canceló"""
+
+    def __init__(self, campo: str, plazo: float):
+        super().__init__(f"{campo} superó su plazo de {plazo:g} s y se canceló")
+        # Strawberry copia estas extensiones al error GraphQL
+        self.extensions = {"code": "PLAZO_VENCIDO", "campo": campo, "plazoSegundos": plazo}
+
+
+def plazo_campo(campo: str) -> float:
+    """Plazo en segundos de un campo raíz (`Tipo.campo`)"""
+    return settings.plazos_campos_segundos.get(campo, settings.plazo_operacion_segundos)
+
+
+async def con_plazo(resultado, campo: str):
+    """Espera el resolver con el plazo del campo; al vencer lo cancela"""
+    plazo = plazo_campo(campo)
+    limite = time.monotonic() + plazo
+    token = limite_actual.set(limite)
+    try:
+        # wait_for corre el resolver en una tarea que copia `limite_actual`
+        return await asyncio.wait_for(resultado, plazo)
+    except asyncio.TimeoutError:
+        if time.monotonic() < limite:
+            # Timeout propio del resolver (p. ej. el circuit breaker), no el plazo
+            raise
+        plazos_vencidos.incrementar(campo)
+        raise PlazoVencido(campo, plazo) from None
+    finally:
+        limite_actual.reset(token)
+
+
+async def aplicar_statement_timeout(sesion: AsyncSession, timeout_pool_ms: int):
+    """
+    Ajusta statement_timeout (local a la transacción) al tiempo que le queda
+    al campo. Si el del pool ya es más corto no se envía nada, salvo para
+    deshacer un valor más corto que dejó otro campo en la sesión compartida.
+    """
+    limite = limite_actual.get()
+    objetivo = None
+    if limite is not None:
+        restante_ms = max(1, int((limite - time.monotonic()) * 1000))
+        if timeout_pool_ms <= 0 or restante_ms < timeout_pool_ms:
+            objetivo = restante_ms
+
+    aplicado = sesion.info.get(_TIMEOUT_APLICADO)
+    if objetivo is None and aplicado is None:
+        return
+    # SET LOCAL no acepta parámetros; set_config(..., true) es equivalente
+    await sesion.execute(
+        text("SELECT set_config('statement_timeout', :valor, true)"),
+        {"valor": str(objetivo if objetivo is not None else timeout_pool_ms)},
+    )
+    sesion.info[_TIMEOUT_APLICADO] = objetivo
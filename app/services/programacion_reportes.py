@@ -0,0 +1,390 @@
+"""
+Programación de reportes automáticos
+
+Cada programación cubre períodos completos (día, semana, mes, trimestre o
+año) que terminan en un corte a medianoche. Tras el corte, el reporte del
+período se encola en la cola de reportes dentro de una ventana de horas
+valle, con un desfase estable por programación para que los reportes que
+vencen juntos (p. ej. todos los mensuales) no lleguen a la base de datos a
+la vez. A la hora de entrega el reporte ya está calculado y se envía a
+través del destino configurado.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from email.message import EmailMessage
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.config.database import engine
+from app.config.settings import settings
+from app.models.report_models import (
+    ConfiguracionReporte, FiltrosReporte, FormatoReporte, PeriodoReporte,
+    ReporteCompleto, ReporteProgramado, TipoReporte
+)
+from app.services.serializacion import a_json
+from app.services.trabajos_reporte import cola_reportes
+
+logger = logging.getLogger(__name__)
+
+
+class ProgramacionInvalida(Exception):
+    """La programación pedida no se puede crear"""
+
+
+def _sumar_meses(dia: date, meses: int) -> date:
+    total = dia.year * 12 + dia.month - 1 + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def siguiente_corte(frecuencia: PeriodoReporte, despues_de: datetime) -> datetime:
+    """Primera medianoche de inicio de período estrictamente posterior a `despues_de`"""
+    dia = despues_de.date()
+    if frecuencia == PeriodoReporte.DIARIO:
+        corte = dia + timedelta(days=1)
+    elif frecuencia == PeriodoReporte.SEMANAL:
+        corte = dia + timedelta(days=7 - dia.weekday())
+    elif frecuencia == PeriodoReporte.MENSUAL:
+        corte = _sumar_meses(dia.replace(day=1), 1)
+    elif frecuencia == PeriodoReporte.TRIMESTRAL:
+        corte = _sumar_meses(dia.replace(day=1), 3 - (dia.month - 1) % 3)
+    elif frecuencia == PeriodoReporte.ANUAL:
+        corte = date(dia.year + 1, 1, 1)
+    else:
+        raise ProgramacionInvalida(f"La frecuencia {frecuencia.value} no se puede programar")
+    return datetime.combine(corte, time.min)
+
+
+def periodo_anterior(frecuencia: PeriodoReporte, corte: datetime) -> Tuple[date, date]:
+    """Fechas (inclusive) del período que termina en `corte`"""
+    fin = corte.date() - timedelta(days=1)
+    if frecuencia == PeriodoReporte.DIARIO:
+        inicio = fin
+    elif frecuencia == PeriodoReporte.SEMANAL:
+        inicio = fin - timedelta(days=6)
+    elif frecuencia == PeriodoReporte.MENSUAL:
+        inicio = _sumar_meses(corte.date(), -1)
+    elif frecuencia == PeriodoReporte.TRIMESTRAL:
+        inicio = _sumar_meses(corte.date(), -3)
+    else:
+        inicio = date(corte.year - 1, 1, 1)
+    return inicio, fin
+
+
+def horarios(id_programacion: str, corte: datetime) -> Tuple[datetime, datetime]:
+    """
+    Momento de cálculo y de entrega del período que termina en `corte`.
+    El desfase dentro de la ventana valle depende solo del id, así que es
+    estable entre reinicios y distinto entre programaciones.
+    """
+    fraccion = int(hashlib.sha256(id_programacion.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    desfase = timedelta(hours=settings.programacion_ventana_valle_horas * fraccion)
+    calcular_desde = corte + timedelta(hours=settings.programacion_inicio_valle_horas) + desfase
+    entregar_en = corte + timedelta(hours=settings.programacion_hora_entrega)
+    return calcular_desde, max(entregar_en, calcular_desde)
+
+
+@dataclass
+class Entrega:
+    """Reporte listo para entregar"""
+    id_programacion: str
+    tipo_reporte: TipoReporte
+    frecuencia: PeriodoReporte
+    email_destino: str
+    id_trabajo: str
+    reporte: ReporteCompleto
+
+    @property
+    def asunto(self) -> str:
+        metadata = self.reporte.metadata
+        return f"Reporte {self.tipo_reporte.value} {self.frecuencia.value} ({metadata.fecha_generacion:%Y-%m-%d})"
+
+    @property
+    def nombre_base(self) -> str:
+        return f"{datetime.now():%Y%m%d%H%M%S}_{self.tipo_reporte.value}_{self.id_trabajo}"
+
+
+class DestinoEntrega:
+    """Destino de los reportes programados; las subclases implementan `enviar`"""
+
+    async def enviar(self, entrega: Entrega):
+        raise NotImplementedError
+
+
+class DestinoArchivo(DestinoEntrega):
+    """Escribe el reporte como JSON en un directorio local"""
+
+    def __init__(self, directorio: str):
+        self.directorio = Path(directorio)
+
+    async def enviar(self, entrega: Entrega):
+        ruta = self.directorio / f"{entrega.nombre_base}.json"
+        contenido = json.dumps({
+            "para": entrega.email_destino,
+            "asunto": entrega.asunto,
+            "reporte": a_json(entrega.reporte),
+        }, ensure_ascii=False, indent=2)
+        await asyncio.to_thread(self.directorio.mkdir, parents=True, exist_ok=True)
+        await asyncio.to_thread(ruta.write_text, contenido, encoding="utf-8")
+        logger.info(f"📬 Reporte programado escrito en {ruta}")
+
+
+class DestinoSmtpFalso(DestinoEntrega):
+    """
+    Arma el correo que se enviaría por SMTP y lo deja como .eml en un
+    buzón local (para desarrollo y pruebas, sin servidor de correo)
+    """
+
+    def __init__(self, directorio: str, remitente: str):
+        self.directorio = Path(directorio)
+        self.remitente = remitente
+
+    async def enviar(self, entrega: Entrega):
+        mensaje = EmailMessage()
+        mensaje["From"] = self.remitente
+        mensaje["To"] = entrega.email_destino
+        mensaje["Subject"] = entrega.asunto
+        resumen = entrega.reporte.resumen
+        cuerpo = "\n".join(f"- {punto}" for punto in resumen.puntos_clave)
+        url = entrega.reporte.metadata.url_descarga
+        if url:
+            cuerpo += f"\n\nDescarga: {url}"
+        mensaje.set_content(cuerpo or "Reporte adjunto.")
+        mensaje.add_attachment(
+            json.dumps(a_json(entrega.reporte), ensure_ascii=False).encode("utf-8"),
+            maintype="application", subtype="json",
+            filename=f"{entrega.tipo_reporte.value}.json"
+        )
+        ruta = self.directorio / f"{entrega.nombre_base}.eml"
+        await asyncio.to_thread(self.directorio.mkdir, parents=True, exist_ok=True)
+        await asyncio.to_thread(ruta.write_bytes, bytes(mensaje))
+        logger.info(f"📧 Correo de reporte programado para {entrega.email_destino} en {ruta}")
+
+
+def crear_destino(nombre: str) -> DestinoEntrega:
+    if nombre == "archivo":
+        return DestinoArchivo(settings.directorio_entregas)
+    if nombre == "smtp_falso":
+        return DestinoSmtpFalso(settings.directorio_entregas, settings.programacion_remitente)
+    raise ValueError(f"Destino de entrega desconocido: {nombre}")
+
+
+def _programado_desde_fila(fila) -> ReporteProgramado:
+    return ReporteProgramado(
+        id_programacion=fila.id,
+        tipo_reporte=TipoReporte(fila.tipo_reporte),
+        frecuencia=PeriodoReporte(fila.frecuencia),
+        formato=FormatoReporte(fila.formato),
+        email_destino=fila.email_destino,
+        activo=fila.activo,
+        proxima_entrega=fila.entregar_en,
+        id_ultimo_trabajo=fila.ultimo_trabajo_id,
+        ultima_entrega=fila.ultima_entrega,
+        ultimo_error=fila.ultimo_error
+    )
+
+
+class ProgramadorReportes:
+    """
+    Revisa cada `intervalo_segundos` las programaciones cuyo cálculo o
+    entrega venció. Las filas se toman con `FOR UPDATE SKIP LOCKED`, de modo
+    que con varias réplicas cada período se encola y entrega una sola vez.
+    """
+
+    def __init__(self, intervalo_segundos: float, destino: DestinoEntrega, espera_segundos: float):
+        self.intervalo_segundos = intervalo_segundos
+        self.destino = destino
+        self.espera_segundos = espera_segundos
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def programar(
+        self,
+        tipo_reporte: TipoReporte,
+        frecuencia: PeriodoReporte,
+        email_destino: str,
+        formato: FormatoReporte
+    ) -> ReporteProgramado:
+        id_programacion = str(uuid.uuid4())
+        corte = siguiente_corte(frecuencia, datetime.now())
+        calcular_desde, entregar_en = horarios(id_programacion, corte)
+        async with engine.begin() as conn:
+            fila = (await conn.execute(text("""
+                INSERT INTO reporte_programado (
+                    id, tipo_reporte, frecuencia, formato, email_destino,
+                    proximo_corte, calcular_desde, entregar_en
+                )
+                VALUES (
+                    :id, :tipo_reporte, :frecuencia, :formato, :email_destino,
+                    :proximo_corte, :calcular_desde, :entregar_en
+                )
+                RETURNING *
+            """), {
+                "id": id_programacion,
+                "tipo_reporte": tipo_reporte.value,
+                "frecuencia": frecuencia.value,
+                "formato": formato.value,
+                "email_destino": email_destino,
+                "proximo_corte": corte,
+                "calcular_desde": calcular_desde,
+                "entregar_en": entregar_en,
+            })).first()
+        return _programado_desde_fila(fila)
+
+    async def cancelar(self, id_programacion: str) -> bool:
+        async with engine.begin() as conn:
+            resultado = await conn.execute(text("""
+                UPDATE reporte_programado SET activo = FALSE
+                WHERE id = :id AND activo
+            """), {"id": id_programacion})
+        return resultado.rowcount > 0
+
+    async def listar(self) -> List[ReporteProgramado]:
+        async with engine.connect() as conn:
+            filas = (await conn.execute(text("""
+                SELECT * FROM reporte_programado
+                WHERE activo
+                ORDER BY entregar_en
+            """))).fetchall()
+        return [_programado_desde_fila(fila) for fila in filas]
+
+    async def precalcular(self, ahora: datetime) -> int:
+        """Encola el reporte de cada período cuyo momento de cálculo llegó"""
+        encolados = 0
+        async with engine.begin() as conn:
+            filas = (await conn.execute(text("""
+                SELECT id, tipo_reporte, frecuencia, formato, email_destino, proximo_corte
+                FROM reporte_programado
+                WHERE activo AND trabajo_id IS NULL AND calcular_desde <= :ahora
+                ORDER BY calcular_desde
+                FOR UPDATE SKIP LOCKED
+            """), {"ahora": ahora})).fetchall()
+            for fila in filas:
+                frecuencia = PeriodoReporte(fila.frecuencia)
+                fecha_inicio, fecha_fin = periodo_anterior(frecuencia, fila.proximo_corte)
+                filtros = FiltrosReporte(
+                    fecha_inicio=fecha_inicio,
+                    fecha_fin=fecha_fin,
+                    tipo_reporte=TipoReporte(fila.tipo_reporte),
+                    incluir_detalles=True
+                )
+                configuracion = ConfiguracionReporte(
+                    formato_exportacion=FormatoReporte(fila.formato),
+                    programar_automatico=True,
+                    frecuencia_automatica=frecuencia
+                )
+                trabajo = await cola_reportes.encolar(filtros, configuracion)
+                await conn.execute(text("""
+                    UPDATE reporte_programado SET trabajo_id = :trabajo WHERE id = :id
+                """), {"trabajo": trabajo.id_trabajo, "id": fila.id})
+                encolados += 1
+        return encolados
+
+    async def entregar(self, ahora: datetime) -> int:
+        """
+        Entrega los reportes ya calculados cuya hora de entrega llegó.
+        Un trabajo que sigue sin terminar `espera_segundos` después de la hora
+        de entrega (o que ya no existe) cuenta como fallido, para que la
+        programación avance al período siguiente.
+        """
+        entregados = 0
+        async with engine.begin() as conn:
+            filas = (await conn.execute(text("""
+                SELECT p.id, p.tipo_reporte, p.frecuencia, p.email_destino,
+                       p.proximo_corte, p.trabajo_id, t.estado, t.error
+                FROM reporte_programado p
+                LEFT JOIN reporte_trabajo t ON t.id = p.trabajo_id
+                WHERE p.activo AND p.trabajo_id IS NOT NULL AND p.entregar_en <= :ahora
+                    AND (
+                        t.estado IN ('completado', 'fallido')
+                        OR t.id IS NULL
+                        OR p.entregar_en <= :vencido
+                    )
+                ORDER BY p.entregar_en
+                FOR UPDATE OF p SKIP LOCKED
+            """), {
+                "ahora": ahora,
+                "vencido": ahora - timedelta(seconds=self.espera_segundos),
+            })).fetchall()
+            for fila in filas:
+                error = fila.error
+                if fila.estado is None:
+                    error = "El trabajo del reporte ya no existe"
+                elif fila.estado not in ("completado", "fallido"):
+                    error = f"Reporte sin terminar {self.espera_segundos:.0f}s después de la hora de entrega"
+                if fila.estado == "completado":
+                    try:
+                        await self.destino.enviar(Entrega(
+                            id_programacion=fila.id,
+                            tipo_reporte=TipoReporte(fila.tipo_reporte),
+                            frecuencia=PeriodoReporte(fila.frecuencia),
+                            email_destino=fila.email_destino,
+                            id_trabajo=fila.trabajo_id,
+                            reporte=await cola_reportes.resultado(fila.trabajo_id)
+                        ))
+                        entregados += 1
+                    except Exception as e:
+                        error = f"Entrega fallida: {e}"
+                if error:
+                    logger.error(f"❌ Reporte programado {fila.id}: {error}")
+
+                corte = siguiente_corte(PeriodoReporte(fila.frecuencia), fila.proximo_corte)
+                calcular_desde, entregar_en = horarios(fila.id, corte)
+                await conn.execute(text("""
+                    UPDATE reporte_programado
+                    SET proximo_corte = :corte, calcular_desde = :calcular_desde,
+                        entregar_en = :entregar_en, trabajo_id = NULL,
+                        ultimo_trabajo_id = :trabajo, ultima_entrega = :ahora,
+                        ultimo_error = :error
+                    WHERE id = :id
+                """), {
+                    "corte": corte,
+                    "calcular_desde": calcular_desde,
+                    "entregar_en": entregar_en,
+                    "trabajo": fila.trabajo_id,
+                    "ahora": ahora,
+                    "error": error,
+                    "id": fila.id,
+                })
+        return entregados
+
+    async def revisar(self):
+        ahora = datetime.now()
+        encolados = await self.precalcular(ahora)
+        entregados = await self.entregar(ahora)
+        if encolados or entregados:
+            logger.info(f"🗓️ Reportes programados: {encolados} encolados, {entregados} entregados")
+
+    async def _ciclo(self):
+        while True:
+            try:
+                await self.revisar()
+            except Exception as e:
+                logger.error(f"❌ Error revisando reportes programados: {e}")
+            await asyncio.sleep(self.intervalo_segundos)
+
+    def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+
+# Instancia global del programador de reportes
+programador_reportes = ProgramadorReportes(
+    intervalo_segundos=settings.programacion_intervalo_segundos,
+    destino=crear_destino(settings.programacion_destino),
+    espera_segundos=settings.reportes_expiracion_segundos,
+)
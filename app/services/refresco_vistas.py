@@ -0,0 +1,102 @@
+"""
+Refresco periódico de las vistas materializadas de KPIs
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+from app.config.database import REPORTES, engine, motores
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Vistas materializadas creadas por init_db.py
+VISTAS_KPI = (
+    "vista_citas_mensuales",
+    "vista_doctor_performance",
+    "vista_vacunaciones_proximas",
+)
+
+
+class RefrescoVistas:
+    """
+    Programador en proceso que ejecuta `REFRESH MATERIALIZED VIEW CONCURRENTLY`
+    cada `intervalo_segundos` y registra el momento del último refresco.
+
+    Un advisory lock por vista evita que varias réplicas del servicio
+    refresquen la misma vista a la vez; los tiempos de refresco se leen de
+    `kpi_refresco_vistas` para conocer también los de otros procesos.
+    """
+
+    def __init__(self, intervalo_segundos: float):
+        self.intervalo_segundos = intervalo_segundos
+        self.ultimo_refresco: Dict[str, datetime] = {}
+        self._tarea: Optional[asyncio.Task] = None
+
+    def edad_segundos(self, vista: str) -> Optional[float]:
+        """Segundos desde el último refresco conocido de la vista"""
+        refrescada = self.ultimo_refresco.get(vista)
+        if refrescada is None:
+            return None
+        return (datetime.now(timezone.utc) - refrescada).total_seconds()
+
+    async def refrescar(self, vista: str) -> bool:
+        """Refresca una vista; devuelve False si otro proceso ya lo está haciendo"""
+        # REFRESH puede durar más que el statement_timeout del pool interactivo
+        async with motores[REPORTES].begin() as conn:
+            bloqueada = await conn.execute(
+                text("SELECT pg_try_advisory_xact_lock(hashtext(:vista))"), {"vista": vista}
+            )
+            if not bloqueada.scalar():
+                return False
+            await conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {vista}"))
+            await conn.execute(text("""
+                INSERT INTO kpi_refresco_vistas (vista, refrescada_en)
+                VALUES (:vista, now())
+                ON CONFLICT (vista) DO UPDATE SET refrescada_en = EXCLUDED.refrescada_en
+            """), {"vista": vista})
+        return True
+
+    async def cargar_ultimos_refrescos(self):
+        """Lee de la base de datos el último refresco de cada vista"""
+        async with engine.connect() as conn:
+            resultado = await conn.execute(text("SELECT vista, refrescada_en FROM kpi_refresco_vistas"))
+            for vista, refrescada_en in resultado.fetchall():
+                self.ultimo_refresco[vista] = refrescada_en
+
+    async def refrescar_todas(self):
+        for vista in VISTAS_KPI:
+            try:
+                if await self.refrescar(vista):
+                    logger.info(f"🔄 Vista materializada {vista} refrescada")
+            except Exception as e:
+                logger.error(f"❌ Error refrescando {vista}: {e}")
+        try:
+            await self.cargar_ultimos_refrescos()
+        except Exception as e:
+            logger.error(f"❌ Error leyendo kpi_refresco_vistas: {e}")
+
+    async def _ciclo(self):
+        while True:
+            await self.refrescar_todas()
+            await asyncio.sleep(self.intervalo_segundos)
+
+    def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+
+# Instancia global del programador de refrescos
+refresco_vistas = RefrescoVistas(intervalo_segundos=settings.vistas_refresco_segundos)
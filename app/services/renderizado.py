@@ -0,0 +1,318 @@
+"""
+Renderizado de PDFs y gráficos de reportes en un pool de procesos
+
+matplotlib y weasyprint son CPU-bound y detendrían el event loop, así que
+se ejecutan en un ProcessPoolExecutor acotado. Cada worker compila las
+plantillas Jinja2 una sola vez (su Environment vive lo que vive el proceso)
+y los gráficos ya renderizados se reutilizan por hash de sus datos.
+"""
+import asyncio
+import base64
+import dataclasses
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.models.report_models import ConfiguracionReporte, FormatoReporte, ReporteCompleto
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO_PLANTILLAS = Path(__file__).resolve().parent.parent / "templates"
+PLANTILLA_REPORTE = "reporte_completo.html"
+
+
+# --- Funciones que corren en los workers ---
+# matplotlib, jinja2 y weasyprint se importan solo dentro de los workers
+# para no cargarlos en el proceso de la API.
+
+_entorno = None
+
+
+def _iniciar_worker():
+    global _entorno
+    import matplotlib
+    matplotlib.use("Agg")
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    _entorno = Environment(
+        loader=FileSystemLoader(str(DIRECTORIO_PLANTILLAS)),
+        autoescape=select_autoescape(["html"]),
+        auto_reload=False,
+    )
+
+
+def _grafico_png(especificacion: Dict[str, Any]) -> Tuple[bytes, float]:
+    """PNG de un gráfico de barras o torta; devuelve también los ms de render"""
+    inicio = time.perf_counter()
+    import matplotlib.pyplot as plt
+
+    figura, eje = plt.subplots(figsize=(8, 4), dpi=100)
+    try:
+        etiquetas, valores = especificacion["etiquetas"], especificacion["valores"]
+        if especificacion["tipo"] == "torta":
+            eje.pie(valores, labels=etiquetas, autopct="%1.1f%%")
+            eje.axis("equal")
+        else:
+            eje.bar(etiquetas, valores, color="#3b7dd8")
+            eje.tick_params(axis="x", labelrotation=30)
+        eje.set_title(especificacion["titulo"])
+        figura.tight_layout()
+        buffer = io.BytesIO()
+        figura.savefig(buffer, format="png")
+    finally:
+        plt.close(figura)
+    return buffer.getvalue(), (time.perf_counter() - inicio) * 1000
+
+
+def _pdf(plantilla: str, contexto: Dict[str, Any]) -> Tuple[bytes, float]:
+    """PDF de una plantilla HTML; devuelve también los ms de render"""
+    inicio = time.perf_counter()
+    from weasyprint import HTML
+
+    html = _entorno.get_template(plantilla).render(**contexto)
+    pdf = HTML(string=html, base_url=str(DIRECTORIO_PLANTILLAS)).write_pdf()
+    return pdf, (time.perf_counter() - inicio) * 1000
+
+
+# --- Lado de la API ---
+
+@dataclass
+class MetricasRenderizado:
+    """Contadores y tiempos del pool de renderizado"""
+    pdfs: int = 0
+    graficos: int = 0
+    graficos_cache: int = 0
+    errores: int = 0
+    esperando: int = 0
+    en_pool: int = 0
+    render_ms_total: float = 0.0
+    render_ms_max: float = 0.0
+    espera_ms_total: float = 0.0
+
+    def como_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class Renderizador:
+    """
+    Envía trabajos de render a un ProcessPoolExecutor creado bajo demanda.
+
+    A lo sumo `max_pendientes` trabajos están en el pool a la vez; el resto
+    espera su turno en el event loop sin ocupar memoria del pool.
+    """
+
+    def __init__(self, procesos: int, max_pendientes: int, max_graficos_cache: int):
+        self.procesos = procesos
+        self.max_graficos_cache = max_graficos_cache
+        self.metricas = MetricasRenderizado()
+        self._cupos = asyncio.Semaphore(max_pendientes)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._graficos: "OrderedDict[str, bytes]" = OrderedDict()
+
+    @property
+    def profundidad_cola(self) -> int:
+        """Trabajos que todavía no empezaron a ejecutarse"""
+        return self.metricas.esperando + max(0, self.metricas.en_pool - self.procesos)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: los workers no heredan el event loop ni conexiones abiertas
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.procesos,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_iniciar_worker,
+            )
+        return self._pool
+
+    async def _ejecutar(self, funcion: Callable, *args) -> bytes:
+        encolado = time.perf_counter()
+        self.metricas.esperando += 1
+        try:
+            await self._cupos.acquire()
+        finally:
+            self.metricas.esperando -= 1
+
+        self.metricas.en_pool += 1
+        try:
+            loop = asyncio.get_running_loop()
+            resultado, render_ms = await loop.run_in_executor(self._executor(), funcion, *args)
+        except BrokenProcessPool:
+            # Un worker murió (p. ej. OOM); el pool se recrea en el próximo trabajo
+            logger.error("💥 Pool de renderizado roto; se recreará")
+            self._pool = None
+            self.metricas.errores += 1
+            raise
+        except Exception:
+            self.metricas.errores += 1
+            raise
+        finally:
+            self.metricas.en_pool -= 1
+            self._cupos.release()
+
+        total_ms = (time.perf_counter() - encolado) * 1000
+        self.metricas.render_ms_total += render_ms
+        self.metricas.render_ms_max = max(self.metricas.render_ms_max, render_ms)
+        self.metricas.espera_ms_total += max(0.0, total_ms - render_ms)
+        return resultado
+
+    async def grafico(self, especificacion: Dict[str, Any]) -> bytes:
+        """PNG del gráfico, reutilizando uno previo con los mismos datos"""
+        clave = hashlib.sha256(
+            json.dumps(especificacion, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        png = self._graficos.get(clave)
+        if png is not None:
+            self._graficos.move_to_end(clave)
+            self.metricas.graficos_cache += 1
+            return png
+
+        png = await self._ejecutar(_grafico_png, especificacion)
+        self.metricas.graficos += 1
+        self._graficos[clave] = png
+        while len(self._graficos) > self.max_graficos_cache:
+            self._graficos.popitem(last=False)
+        return png
+
+    async def pdf(self, plantilla: str, contexto: Dict[str, Any]) -> bytes:
+        pdf = await self._ejecutar(_pdf, plantilla, contexto)
+        self.metricas.pdfs += 1
+        return pdf
+
+    async def detener(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Instancia global del renderizador
+renderizador = Renderizador(
+    procesos=settings.render_procesos,
+    max_pendientes=settings.render_max_pendientes,
+    max_graficos_cache=settings.render_cache_graficos,
+)
+
+
+def _pares(elementos: List[str], etiqueta: str, valor: str) -> Tuple[List[str], List[float]]:
+    """Etiquetas y valores de una lista de objetos JSON serializados"""
+    datos = [json.loads(elemento) for elemento in elementos]
+    return [str(d[etiqueta]) for d in datos], [float(d[valor]) for d in datos]
+
+
+def especificaciones_graficos(reporte: ReporteCompleto) -> List[Dict[str, Any]]:
+    """Gráficos a incluir según las secciones presentes en el reporte"""
+    graficos = []
+
+    if reporte.reporte_financiero:
+        f = reporte.reporte_financiero
+        graficos.append({
+            "tipo": "barras",
+            "titulo": "Ingresos y costos",
+            "etiquetas": ["Consultas", "Vacunas", "Medicamentos", "Cirugía", "Costos", "Ganancia neta"],
+            "valores": [
+                f.ingresos_consultas, f.ingresos_vacunas, f.ingresos_medicamentos,
+                f.ingresos_cirugia, f.costos_operativos, f.ganancia_neta,
+            ],
+        })
+
+    if reporte.reporte_clinico:
+        c = reporte.reporte_clinico
+        etiquetas, valores = _pares(c.diagnosticos_frecuentes, "diagnostico", "frecuencia")
+        if valores:
+            graficos.append({
+                "tipo": "barras", "titulo": "Diagnósticos más frecuentes",
+                "etiquetas": etiquetas, "valores": valores,
+            })
+        etiquetas, valores = _pares(c.tratamientos_aplicados, "tratamiento", "cantidad")
+        if valores:
+            graficos.append({
+                "tipo": "torta", "titulo": "Tratamientos aplicados",
+                "etiquetas": etiquetas, "valores": valores,
+            })
+
+    if reporte.reporte_operacional:
+        o = reporte.reporte_operacional
+        graficos.append({
+            "tipo": "barras",
+            "titulo": "Indicadores operacionales (%)",
+            "etiquetas": ["Ocupación", "Utilización equipos", "Cancelación", "Eficiencia personal"],
+            "valores": [
+                o.ocupacion_consultorios, o.utilizacion_equipos,
+                o.tasa_cancelacion, o.eficiencia_personal,
+            ],
+        })
+
+    if reporte.reporte_inventario:
+        etiquetas, valores = _pares(
+            reporte.reporte_inventario.medicamentos_utilizados, "medicamento", "cantidad"
+        )
+        if valores:
+            graficos.append({
+                "tipo": "barras", "titulo": "Medicamentos utilizados",
+                "etiquetas": etiquetas, "valores": valores,
+            })
+
+    return graficos
+
+
+def _campos(seccion: Any) -> List[Tuple[str, Any]]:
+    return [
+        (campo.name.replace("_", " ").capitalize(), getattr(seccion, campo.name))
+        for campo in dataclasses.fields(seccion)
+    ]
+
+
+def contexto_pdf(reporte: ReporteCompleto, titulo: str, graficos: List[str]) -> Dict[str, Any]:
+    """Contexto serializable (se envía al worker) para la plantilla del reporte"""
+    secciones = [
+        {"titulo": nombre, "campos": _campos(seccion)}
+        for nombre, seccion in (
+            ("Financiero", reporte.reporte_financiero),
+            ("Clínico", reporte.reporte_clinico),
+            ("Operacional", reporte.reporte_operacional),
+            ("Inventario", reporte.reporte_inventario),
+        )
+        if seccion is not None
+    ]
+    resumen = reporte.resumen
+    return {
+        "titulo": titulo,
+        "metadata": asdict(reporte.metadata),
+        "resumen": [
+            ("Puntos clave", resumen.puntos_clave),
+            ("Tendencias", resumen.tendencias_principales),
+            ("Alertas", resumen.alertas),
+            ("Recomendaciones", resumen.recomendaciones),
+        ],
+        "secciones": secciones,
+        "graficos": graficos,
+    }
+
+
+async def renderizar_reporte(
+    reporte: ReporteCompleto,
+    configuracion: ConfiguracionReporte
+) -> Optional[bytes]:
+    """Agrega los gráficos al reporte y devuelve su PDF si la configuración lo pide"""
+    graficos = []
+    if configuracion.incluir_graficos:
+        pngs = await asyncio.gather(*(
+            renderizador.grafico(especificacion)
+            for especificacion in especificaciones_graficos(reporte)
+        ))
+        graficos = [base64.b64encode(png).decode() for png in pngs]
+        reporte.graficos = [f"data:image/png;base64,{grafico}" for grafico in graficos]
+
+    if configuracion.formato_exportacion == FormatoReporte.PDF:
+        titulo = configuracion.titulo_personalizado or "Reporte de la veterinaria"
+        return await renderizador.pdf(PLANTILLA_REPORTE, contexto_pdf(reporte, titulo, graficos))
+    return None
@@ -0,0 +1,317 @@
+"""
+Enrutamiento de lecturas a réplicas según su retraso de replicación
+
+Las sesiones de KPIs y reportes se abren en una réplica cuyo retraso no
+supere el máximo aceptable del campo GraphQL en curso
+(`replicas_max_retraso_campos`, o `replicas_max_retraso_segundos`); si
+ninguna lo cumple se usa la primaria. El retraso de cada réplica se mide
+cada `replicas_intervalo_retraso_segundos` con
+`pg_last_xact_replay_timestamp()` y una medición vieja deja la réplica
+fuera hasta la siguiente.
+
+Con `replicas_cobertura_habilitada`, una lectura de KPI que tarda más que
+el percentil `replicas_cobertura_percentil` de sus duraciones recientes se
+repite en otra réplica y gana la primera respuesta; la perdedora se
+cancela y su conexión se descarta del pool.
+
+Una respuesta que entra al cache de respuestas se etiqueta con la versión
+de datos de la primaria (`version_requerida`). Las sesiones de réplica de
+esa operación leen primero la versión en su propia conexión; si la réplica
+todavía no la alcanzó, sus datos serían más viejos que la etiqueta y la
+lectura va a la primaria.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.config.database import CARGAS_LECTURA, INTERACTIVO, Replica, replicas, sesiones
+from app.config.settings import settings
+from app.migrations.resumen_kpi import version_datos
+from app.services.estadisticas_sql import campo_actual
+from app.services.metricas import Contador, Medidor, registro_metricas
+
+logger = logging.getLogger(__name__)
+
+# Versión de datos con la que se etiquetará la respuesta en curso; None si no se cachea
+version_requerida: ContextVar[Optional[int]] = ContextVar("version_datos_requerida", default=None)
+
+lecturas = registro_metricas.registrar(Contador(
+    "kpi_db_lecturas_total",
+    "Sesiones de lectura abiertas por destino (primaria o réplica)",
+    ("destino",),
+))
+desvios_primaria = registro_metricas.registrar(Contador(
+    "kpi_db_replicas_desvios_total",
+    "Lecturas enviadas a la primaria por motivo (retraso, no_disponible, version)",
+    ("motivo",),
+))
+coberturas = registro_metricas.registrar(Contador(
+    "kpi_db_coberturas_total",
+    "Lecturas cubiertas en otra réplica por resultado (lanzada, ganada)",
+    ("kpi", "resultado"),
+))
+
+# 0 en la primaria o si la réplica ya aplicó todo lo recibido (sin escrituras no hay retraso)
+_CONSULTA_RETRASO = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+class ReplicaAtrasada(Exception):
+    """La réplica no alcanzó la versión de datos de la respuesta en curso"""
+    pass
+
+
+# Duraciones recientes por KPI para calcular el percentil de cobertura
+_MAX_DURACIONES = 200
+
+
+class EnrutadorReplicas:
+    """Elige réplica o primaria para cada sesión de lectura y cubre las lecturas lentas"""
+
+    def __init__(
+        self,
+        replicas: List[Replica],
+        intervalo_segundos: float,
+        max_retraso_defecto: float,
+        max_retraso_campos: Dict[str, float],
+        cobertura_habilitada: bool,
+        cobertura_percentil: float,
+        cobertura_minimo_segundos: float,
+        cobertura_min_muestras: int,
+        cobertura_max_en_vuelo: int,
+    ):
+        self.replicas = replicas
+        self.intervalo_segundos = intervalo_segundos
+        self.max_retraso_defecto = max_retraso_defecto
+        self.max_retraso_campos = max_retraso_campos
+        self.cobertura_habilitada = cobertura_habilitada
+        self.cobertura_percentil = cobertura_percentil
+        self.cobertura_minimo_segundos = cobertura_minimo_segundos
+        self.cobertura_min_muestras = cobertura_min_muestras
+        self.cobertura_max_en_vuelo = cobertura_max_en_vuelo
+        # Último retraso medido por réplica y cuándo se midió (time.monotonic)
+        self.retrasos: Dict[str, float] = {}
+        self._medido_en: Dict[str, float] = {}
+        self.coberturas_en_vuelo = 0
+        self._duraciones: Dict[str, Deque[float]] = {}
+        self._turno = itertools.count()
+        self._tarea: Optional[asyncio.Task] = None
+
+    def retraso(self, replica: Replica) -> Optional[float]:
+        """Retraso en segundos de la réplica; None si no hay una medición reciente"""
+        medido_en = self._medido_en.get(replica.nombre)
+        if medido_en is None or time.monotonic() - medido_en > 3 * self.intervalo_segundos:
+            return None
+        return self.retrasos[replica.nombre]
+
+    def max_retraso(self, campo: Optional[str]) -> float:
+        return self.max_retraso_campos.get(campo, self.max_retraso_defecto)
+
+    def elegir(self, max_retraso: float, excluir: Set[str] = frozenset()) -> Optional[Replica]:
+        """Réplica (por turnos) con retraso aceptable; None si ninguna sirve"""
+        candidatas = [
+            replica for replica in self.replicas
+            if replica.nombre not in excluir
+            and (retraso := self.retraso(replica)) is not None and retraso <= max_retraso
+        ]
+        if not candidatas:
+            return None
+        return candidatas[next(self._turno) % len(candidatas)]
+
+    def sesiones_lectura(self, carga: str, campo: Optional[str] = None) -> async_sessionmaker:
+        """
+        Session maker para leer en `carga`: de una réplica si alguna cumple el
+        retraso máximo del campo (por defecto el campo GraphQL en curso), o de
+        la primaria. Las mutaciones siempre leen de la primaria.
+        """
+        if not self.replicas or carga not in CARGAS_LECTURA:
+            return sesiones[carga]
+        campo = campo if campo is not None else campo_actual.get()
+        if campo and campo.startswith("Mutation."):
+            lecturas.incrementar("primaria")
+            return sesiones[carga]
+
+        replica = self.elegir(self.max_retraso(campo))
+        if replica is None:
+            medidas = any(self.retraso(r) is not None for r in self.replicas)
+            desvios_primaria.incrementar("retraso" if medidas else "no_disponible")
+            lecturas.incrementar("primaria")
+            return sesiones[carga]
+        lecturas.incrementar(replica.nombre)
+        return replica.sesiones[carga]
+
+    def _nombre_replica(self, sesion: AsyncSession) -> Optional[str]:
+        for replica in self.replicas:
+            if sesion.bind in replica.motores.values():
+                return replica.nombre
+        return None
+
+    async def al_dia(self, sesion: AsyncSession) -> bool:
+        """
+        False si `sesion` es de una réplica que no alcanzó `version_requerida`.
+        La versión se lee en la conexión de la sesión, antes que sus datos.
+        """
+        minima = version_requerida.get()
+        if minima is None or self._nombre_replica(sesion) is None:
+            return True
+        if await version_datos(sesion) >= minima:
+            return True
+        desvios_primaria.incrementar("version")
+        return False
+
+    def _espera_cobertura(self, kpi: str) -> Optional[float]:
+        """Percentil de duración del KPI; None si todavía hay pocas muestras"""
+        duraciones = self._duraciones.get(kpi)
+        if duraciones is None or len(duraciones) < self.cobertura_min_muestras:
+            return None
+        ordenadas = sorted(duraciones)
+        indice = min(len(ordenadas) - 1, int(len(ordenadas) * self.cobertura_percentil))
+        return max(ordenadas[indice], self.cobertura_minimo_segundos)
+
+    def _registrar_duracion(self, kpi: str, segundos: float):
+        duraciones = self._duraciones.get(kpi)
+        if duraciones is None:
+            duraciones = self._duraciones[kpi] = deque(maxlen=_MAX_DURACIONES)
+        duraciones.append(segundos)
+
+    def _cobertura_terminada(self, _tarea):
+        self.coberturas_en_vuelo -= 1
+
+    async def _en_replica(self, replica: Replica, consulta: Callable[[AsyncSession], Awaitable[Any]]):
+        async with replica.sesiones[INTERACTIVO]() as sesion:
+            try:
+                if not await self.al_dia(sesion):
+                    raise ReplicaAtrasada(replica.nombre)
+                return await consulta(sesion)
+            except asyncio.CancelledError:
+                # La sentencia se canceló a medias: la conexión no vuelve al pool
+                await sesion.invalidate()
+                raise
+
+    async def cubrir(
+        self,
+        kpi: str,
+        sesion: AsyncSession,
+        original: Callable[[], Awaitable[Any]],
+        cubierta: Callable[[AsyncSession], Awaitable[Any]],
+    ) -> Any:
+        """
+        Ejecuta `original()` sobre `sesion`; si tarda más que el percentil del
+        KPI, lanza `cubierta(otra_sesion)` en otra réplica y devuelve la
+        primera respuesta correcta
+        """
+        espera = self._espera_cobertura(kpi) if self.cobertura_habilitada and self.replicas else None
+        inicio = time.perf_counter()
+        if espera is None:
+            resultado = await original()
+            self._registrar_duracion(kpi, time.perf_counter() - inicio)
+            return resultado
+
+        tarea_original = asyncio.ensure_future(original())
+        tarea_cubierta = None
+        try:
+            hechas, _ = await asyncio.wait({tarea_original}, timeout=espera)
+            if not hechas and self.coberturas_en_vuelo < self.cobertura_max_en_vuelo:
+                excluir = {self._nombre_replica(sesion)}
+                replica = self.elegir(self.max_retraso(campo_actual.get()), excluir)
+                if replica is not None:
+                    self.coberturas_en_vuelo += 1
+                    tarea_cubierta = asyncio.ensure_future(self._en_replica(replica, cubierta))
+                    tarea_cubierta.add_done_callback(self._cobertura_terminada)
+                    coberturas.incrementar(kpi, "lanzada")
+
+            pendientes = {tarea_original} | ({tarea_cubierta} if tarea_cubierta else set())
+            while pendientes:
+                hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in hechas:
+                    if tarea.exception() is None:
+                        if tarea is tarea_cubierta:
+                            coberturas.incrementar(kpi, "ganada")
+                        self._registrar_duracion(kpi, time.perf_counter() - inicio)
+                        return tarea.result()
+            # Ambas fallaron: el error que importa es el de la lectura original
+            raise tarea_original.exception()
+        finally:
+            await self._cancelar_perdedoras(sesion, tarea_original, tarea_cubierta)
+
+    async def _cancelar_perdedoras(self, sesion: AsyncSession, original: asyncio.Future, cubierta: Optional[asyncio.Future]):
+        perdedoras = [tarea for tarea in (original, cubierta) if tarea is not None and not tarea.done()]
+        for tarea in perdedoras:
+            tarea.cancel()
+        await asyncio.gather(*perdedoras, return_exceptions=True)
+        if original in perdedoras:
+            # La sesión del request quedó con una sentencia cancelada: pedir otra conexión
+            await sesion.invalidate()
+
+    async def _medir(self, replica: Replica):
+        try:
+            async with replica.motores[INTERACTIVO].connect() as conn:
+                resultado = await asyncio.wait_for(conn.execute(_CONSULTA_RETRASO), self.intervalo_segundos)
+                retraso = resultado.scalar()
+        except Exception as e:
+            if self._medido_en.pop(replica.nombre, None) is not None:
+                logger.error(f"❌ Réplica {replica.nombre} no disponible: {e}")
+            return
+        if retraso is None:
+            # Todavía no aplicó ninguna transacción: sin retraso conocido
+            self._medido_en.pop(replica.nombre, None)
+            return
+        if replica.nombre not in self._medido_en:
+            logger.info(f"📖 Réplica {replica.nombre} disponible (retraso {float(retraso):.1f}s)")
+        self.retrasos[replica.nombre] = float(retraso)
+        self._medido_en[replica.nombre] = time.monotonic()
+
+    async def _ciclo(self):
+        while True:
+            await asyncio.gather(*(self._medir(replica) for replica in self.replicas))
+            await asyncio.sleep(self.intervalo_segundos)
+
+    def iniciar(self):
+        if self._tarea is None and self.replicas:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+
+# Instancia global del enrutador de réplicas
+enrutador_replicas = EnrutadorReplicas(
+    replicas=replicas,
+    intervalo_segundos=settings.replicas_intervalo_retraso_segundos,
+    max_retraso_defecto=settings.replicas_max_retraso_segundos,
+    max_retraso_campos=settings.replicas_max_retraso_campos,
+    cobertura_habilitada=settings.replicas_cobertura_habilitada,
+    cobertura_percentil=settings.replicas_cobertura_percentil,
+    cobertura_minimo_segundos=settings.replicas_cobertura_minimo_ms / 1000,
+    cobertura_min_muestras=settings.replicas_cobertura_min_muestras,
+    cobertura_max_en_vuelo=settings.replicas_cobertura_max_en_vuelo,
+)
+
+registro_metricas.registrar(Medidor(
+    "kpi_db_replica_retraso_segundos",
+    "Último retraso de replicación medido por réplica",
+    lambda: {
+        (replica.nombre,): retraso
+        for replica in enrutador_replicas.replicas
+        if (retraso := enrutador_replicas.retraso(replica)) is not None
+    },
+    ("replica",),
+))
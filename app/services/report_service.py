@@ -1,7 +1,7 @@
 """
 Servicio para generación de reportes veterinarios
 """
-from typing import List, Optional, Dict, Any
+from typing import Awaitable, Callable, List, Optional, Dict, Any
 from datetime import datetime, date, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text, func, and_, or_
@@ -12,11 +12,16 @@ from app.models.report_models import (
     FiltrosReporte, ConfiguracionReporte, MetadataReporte,
     ResumenReporte, TipoReporte, PeriodoReporte
 )
+from app.services.artefactos import almacen_artefactos
+from app.services.renderizado import renderizar_reporte
+from app.services.estadisticas_sql import etiquetar_metodos
+from app.services.admision import regulado, regulador_reportes
 import json
 import uuid
 from decimal import Decimal
 
 
+@etiquetar_metodos
 class ReportService:
     """Servicio para generar reportes de la veterinaria"""
     
@@ -26,62 +31,90 @@ class ReportService:
     async def generar_reporte_completo(
         self,
         filtros: FiltrosReporte,
-        configuracion: ConfiguracionReporte
+        configuracion: ConfiguracionReporte,
+        al_avanzar: Optional[Callable[[float], Awaitable[None]]] = None
     ) -> ReporteCompleto:
-        """Genera un reporte completo según los filtros y configuración"""
-        
-        # Generar metadata
-        metadata = MetadataReporte(
-            id_reporte=str(uuid.uuid4()),
-            fecha_generacion=datetime.now(),
-            usuario_solicitante="usuario_actual",  # Implementar autenticación
-            tiempo_procesamiento=0.0,
-            total_registros=0,
-            filtros_aplicados=json.dumps(filtros.__dict__)
-        )
-        
-        tiempo_inicio = datetime.now()
-        
-        # Generar reportes específicos según el tipo
-        reporte_financiero = None
-        reporte_clinico = None
-        reporte_operacional = None
-        reporte_inventario = None
-        reporte_cliente = None
-        reporte_mascota = None
-        reporte_comparativo = None
-        reporte_predictivo = None
-        
-        if filtros.tipo_reporte == TipoReporte.FINANCIERO:
-            reporte_financiero = await self.generar_reporte_financiero(filtros)
-        elif filtros.tipo_reporte == TipoReporte.CLINICO:
-            reporte_clinico = await self.generar_reporte_clinico(filtros)
-        elif filtros.tipo_reporte == TipoReporte.OPERACIONAL:
-            reporte_operacional = await self.generar_reporte_operacional(filtros)
-        elif filtros.tipo_reporte == TipoReporte.INVENTARIO:
-            reporte_inventario = await self.generar_reporte_inventario(filtros)
-        # Agregar más tipos según necesidad
-        
-        # Generar resumen ejecutivo
-        resumen = await self.generar_resumen_ejecutivo(filtros)
-        
-        # Calcular tiempo de procesamiento
-        tiempo_fin = datetime.now()
-        metadata.tiempo_procesamiento = (tiempo_fin - tiempo_inicio).total_seconds()
-        
-        return ReporteCompleto(
-            metadata=metadata,
-            resumen=resumen,
-            reporte_financiero=reporte_financiero,
-            reporte_clinico=reporte_clinico,
-            reporte_operacional=reporte_operacional,
-            reporte_inventario=reporte_inventario,
-            reporte_cliente=reporte_cliente,
-            reporte_mascota=reporte_mascota,
-            reporte_comparativo=reporte_comparativo,
-            reporte_predictivo=reporte_predictivo
-        )
+        """
+        Genera un reporte completo según los filtros y configuración.
+        `al_avanzar` recibe el progreso (0 a 1) al terminar cada etapa.
+        Si ya hay un reporte guardado para los mismos datos se devuelve ese.
+        """
+        
+        async def avanzar(progreso: float):
+            if al_avanzar is not None:
+                await al_avanzar(progreso)
+        
+        clave = await almacen_artefactos.clave(self.db, filtros, configuracion)
+        if clave is not None:
+            almacenado = await almacen_artefactos.obtener(clave)
+            if almacenado is not None:
+                return almacenado
+        
+        # Los llamadores del servicio ya tienen el cupo (se pide antes de abrir
+        # la sesión) y esto no hace nada; solo lo toma si se llama sin él
+        async with regulador_reportes.admitir(filtros.tipo_reporte.value):
+            # Generar metadata
+            metadata = MetadataReporte(
+                id_reporte=str(uuid.uuid4()),
+                fecha_generacion=datetime.now(),
+                usuario_solicitante="usuario_actual",  # Implementar autenticación
+                tiempo_procesamiento=0.0,
+                total_registros=0,
+                filtros_aplicados=json.dumps(filtros.__dict__, default=str)
+            )
+        
+            tiempo_inicio = datetime.now()
+        
+            # Generar reportes específicos según el tipo
+            reporte_financiero = None
+            reporte_clinico = None
+            reporte_operacional = None
+            reporte_inventario = None
+            reporte_cliente = None
+            reporte_mascota = None
+            reporte_comparativo = None
+            reporte_predictivo = None
+        
+            if filtros.tipo_reporte == TipoReporte.FINANCIERO:
+                reporte_financiero = await self.generar_reporte_financiero(filtros)
+            elif filtros.tipo_reporte == TipoReporte.CLINICO:
+                reporte_clinico = await self.generar_reporte_clinico(filtros)
+            elif filtros.tipo_reporte == TipoReporte.OPERACIONAL:
+                reporte_operacional = await self.generar_reporte_operacional(filtros)
+            elif filtros.tipo_reporte == TipoReporte.INVENTARIO:
+                reporte_inventario = await self.generar_reporte_inventario(filtros)
+            # Agregar más tipos según necesidad
+            await avanzar(0.5)
+        
+            # Generar resumen ejecutivo
+            resumen = await self.generar_resumen_ejecutivo(filtros)
+            await avanzar(0.6)
+        
+            # Calcular tiempo de procesamiento
+            tiempo_fin = datetime.now()
+            metadata.tiempo_procesamiento = (tiempo_fin - tiempo_inicio).total_seconds()
+        
+            reporte = ReporteCompleto(
+                metadata=metadata,
+                resumen=resumen,
+                reporte_financiero=reporte_financiero,
+                reporte_clinico=reporte_clinico,
+                reporte_operacional=reporte_operacional,
+                reporte_inventario=reporte_inventario,
+                reporte_cliente=reporte_cliente,
+                reporte_mascota=reporte_mascota,
+                reporte_comparativo=reporte_comparativo,
+                reporte_predictivo=reporte_predictivo
+            )
+        
+            # Gráficos y PDF se generan en el pool de procesos de renderizado
+            pdf = await renderizar_reporte(reporte, configuracion)
+            # Sin versión de datos se guarda igual, pero solo para su descarga
+            await almacen_artefactos.guardar(clave or almacen_artefactos.clave_unica(), reporte, pdf)
+        
+            return reporte
     
+    @regulado(TipoReporte.FINANCIERO.value)
     async def generar_reporte_financiero(self, filtros: FiltrosReporte) -> ReporteFinanciero:
         """Genera reporte financiero - LIMITADO por falta de datos de precios en BD real"""
         
@@ -149,6 +182,7 @@ class ReportService:
             comparacion_periodo_anterior=comparacion
         )
     
+    @regulado(TipoReporte.CLINICO.value)
     async def generar_reporte_clinico(self, filtros: FiltrosReporte) -> ReporteClinico:
         """Genera reporte clínico basado en estructura real de BD"""
         
@@ -245,6 +279,7 @@ class ReportService:
             tasa_seguimiento=85.0  # Estimación - no hay datos reales
         )
     
+    @regulado(TipoReporte.OPERACIONAL.value)
     async def generar_reporte_operacional(self, filtros: FiltrosReporte) -> ReporteOperacional:
         """Genera reporte operacional basado en estructura real de BD"""
         
@@ -292,6 +327,7 @@ class ReportService:
             eficiencia_personal=round((completadas / total_citas * 100), 2) if total_citas > 0 else 0
         )
     
+    @regulado(TipoReporte.INVENTARIO.value)
     async def generar_reporte_inventario(self, filtros: FiltrosReporte) -> ReporteInventario:
         """Genera reporte de inventario (simulado - requiere tablas de inventario)"""
         
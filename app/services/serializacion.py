@@ -0,0 +1,53 @@
+"""
+Serialización JSON de los tipos strawberry de reportes
+
+Los tipos GraphQL son dataclasses; se guardan como JSON (colas, artefactos,
+entregas) y se reconstruyen a partir de sus anotaciones de tipo.
+"""
+import dataclasses
+import json
+import typing
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, List
+
+
+def _serializar(valor: Any) -> Any:
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, Enum):
+        return valor.value
+    raise TypeError(f"No serializable: {type(valor).__name__}")
+
+
+def a_json(objeto: Any) -> Any:
+    """Tipo strawberry (dataclass) a estructura JSON"""
+    return json.loads(json.dumps(dataclasses.asdict(objeto), default=_serializar))
+
+
+def desde_json(tipo: Any, valor: Any) -> Any:
+    """Reconstruye un tipo strawberry (dataclass) a partir de `a_json`"""
+    if valor is None:
+        return None
+    origen = typing.get_origin(tipo)
+    if origen is typing.Union:
+        tipo = next(argumento for argumento in typing.get_args(tipo) if argumento is not type(None))
+        return desde_json(tipo, valor)
+    if origen in (list, List):
+        (elemento,) = typing.get_args(tipo)
+        return [desde_json(elemento, v) for v in valor]
+    if dataclasses.is_dataclass(tipo):
+        tipos = typing.get_type_hints(tipo)
+        return tipo(**{
+            campo.name: desde_json(tipos[campo.name], valor[campo.name])
+            for campo in dataclasses.fields(tipo)
+            if campo.name in valor
+        })
+    if isinstance(tipo, type) and issubclass(tipo, Enum):
+        return tipo(valor)
+    # datetime antes que date: datetime es subclase de date
+    if tipo is datetime:
+        return datetime.fromisoformat(valor)
+    if tipo is date:
+        return date.fromisoformat(valor)
+    return valor
@@ -0,0 +1,250 @@
+"""
+Cola persistente de trabajos de reportes
+
+`encolarReporteCompleto` guarda filtros y configuración en `reporte_trabajo`
+y devuelve el id del trabajo sin esperar al reporte. Un conjunto acotado de
+trabajadores asyncio toma los pendientes con `FOR UPDATE SKIP LOCKED` (así
+varias réplicas comparten la misma cola), actualiza el progreso y guarda el
+reporte serializado como JSON para consultarlo después.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from contextlib import suppress
+from typing import List, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from app.config.database import REPORTES, engine
+from app.config.settings import settings
+from app.models.report_models import (
+    ConfiguracionReporte, EstadoTrabajoReporte, FiltrosReporte,
+    ReporteCompleto, TipoReporte, TrabajoReporte
+)
+from app.services.admision import ReportesSaturados, regulador_reportes
+from app.services.replicas import enrutador_replicas
+from app.services.report_service import ReportService
+from app.services.serializacion import a_json, desde_json
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_ACTIVOS = "('pendiente', 'en_proceso')"
+
+
+def clave_trabajo(filtros: FiltrosReporte, configuracion: ConfiguracionReporte) -> str:
+    """Hash de la solicitud; dos solicitudes iguales comparten trabajo"""
+    solicitud = {"filtros": a_json(filtros), "configuracion": a_json(configuracion)}
+    return hashlib.sha256(json.dumps(solicitud, sort_keys=True).encode()).hexdigest()
+
+
+def _trabajo_desde_fila(fila) -> TrabajoReporte:
+    return TrabajoReporte(
+        id_trabajo=fila.id,
+        estado=EstadoTrabajoReporte(fila.estado),
+        progreso=float(fila.progreso),
+        tipo_reporte=TipoReporte(fila.filtros["tipo_reporte"]),
+        fecha_creacion=fila.creado_en,
+        fecha_inicio_proceso=fila.iniciado_en,
+        fecha_fin_proceso=fila.terminado_en,
+        error=fila.error
+    )
+
+
+class ColaTrabajosReporte:
+    """
+    Cola de reportes respaldada por la tabla `reporte_trabajo`.
+
+    A lo sumo `trabajadores` reportes se generan a la vez en este proceso.
+    Un encolado local despierta a los trabajadores de inmediato; los
+    encolados por otras réplicas se detectan cada `intervalo_sondeo`.
+    Los trabajos en proceso sin avances durante `expiracion_segundos`
+    (p. ej. por una réplica caída) vuelven a quedar pendientes; se revisan
+    al iniciar y luego cada `intervalo_sondeo`.
+    """
+
+    def __init__(self, trabajadores: int, intervalo_sondeo: float, expiracion_segundos: float):
+        self.trabajadores = trabajadores
+        self.intervalo_sondeo = intervalo_sondeo
+        self.expiracion_segundos = expiracion_segundos
+        self._tareas: List[asyncio.Task] = []
+        self._aviso = asyncio.Event()
+
+    async def encolar(self, filtros: FiltrosReporte, configuracion: ConfiguracionReporte) -> TrabajoReporte:
+        """Crea el trabajo o devuelve el pendiente idéntico que ya existe"""
+        clave = clave_trabajo(filtros, configuracion)
+        insertar = text(f"""
+            INSERT INTO reporte_trabajo (id, clave, filtros, configuracion)
+            VALUES (:id, :clave, :filtros, :configuracion)
+            ON CONFLICT (clave) WHERE estado IN {ESTADOS_ACTIVOS} DO NOTHING
+        """).bindparams(
+            bindparam("filtros", type_=JSONB), bindparam("configuracion", type_=JSONB)
+        )
+        existente = text(f"""
+            SELECT id FROM reporte_trabajo
+            WHERE clave = :clave AND estado IN {ESTADOS_ACTIVOS}
+        """)
+
+        # Si el trabajo idéntico termina entre el INSERT y el SELECT, se reintenta
+        for _ in range(3):
+            async with engine.begin() as conn:
+                await conn.execute(insertar, {
+                    "id": str(uuid.uuid4()),
+                    "clave": clave,
+                    "filtros": a_json(filtros),
+                    "configuracion": a_json(configuracion),
+                })
+                id_trabajo = (await conn.execute(existente, {"clave": clave})).scalar()
+            if id_trabajo is not None:
+                self._aviso.set()
+                return await self.obtener(id_trabajo)
+        raise RuntimeError("No se pudo encolar el reporte")
+
+    async def obtener(self, id_trabajo: str) -> Optional[TrabajoReporte]:
+        """Estado y progreso de un trabajo (sin el resultado)"""
+        async with engine.connect() as conn:
+            fila = (await conn.execute(text("""
+                SELECT id, estado, progreso, filtros, error, creado_en, iniciado_en, terminado_en
+                FROM reporte_trabajo
+                WHERE id = :id
+            """), {"id": id_trabajo})).first()
+        return _trabajo_desde_fila(fila) if fila else None
+
+    async def resultado(self, id_trabajo: str) -> Optional[ReporteCompleto]:
+        """Reporte de un trabajo completado; None si no existe o no terminó"""
+        async with engine.connect() as conn:
+            resultado = (await conn.execute(text("""
+                SELECT resultado FROM reporte_trabajo
+                WHERE id = :id AND estado = 'completado'
+            """), {"id": id_trabajo})).scalar()
+        return desde_json(ReporteCompleto, resultado)
+
+    async def _tomar(self):
+        """Marca como en proceso el pendiente más antiguo y lo devuelve"""
+        async with engine.begin() as conn:
+            return (await conn.execute(text("""
+                UPDATE reporte_trabajo
+                SET estado = 'en_proceso', iniciado_en = now(), actualizado_en = now(),
+                    intentos = intentos + 1
+                WHERE id = (
+                    SELECT id FROM reporte_trabajo
+                    WHERE estado = 'pendiente'
+                    ORDER BY creado_en
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, filtros, configuracion
+            """))).first()
+
+    async def _actualizar(self, id_trabajo: str, sentencia: str, **parametros):
+        consulta = text(f"""
+            UPDATE reporte_trabajo SET {sentencia}, actualizado_en = now()
+            WHERE id = :id
+        """)
+        if "resultado" in parametros:
+            consulta = consulta.bindparams(bindparam("resultado", type_=JSONB))
+        async with engine.begin() as conn:
+            await conn.execute(consulta, {"id": id_trabajo, **parametros})
+
+    async def _ejecutar(self, trabajo):
+        filtros = desde_json(FiltrosReporte, trabajo.filtros)
+        configuracion = desde_json(ConfiguracionReporte, trabajo.configuracion)
+
+        async def avanzar(progreso: float):
+            await self._actualizar(trabajo.id, "progreso = :progreso", progreso=progreso)
+
+        try:
+            # El cupo se pide antes de abrir la sesión: en cola no se retiene una conexión
+            async with regulador_reportes.admitir(filtros.tipo_reporte.value), \
+                    enrutador_replicas.sesiones_lectura(REPORTES)() as sesion:
+                reporte = await ReportService(sesion).generar_reporte_completo(
+                    filtros, configuracion, al_avanzar=avanzar
+                )
+            await self._actualizar(
+                trabajo.id,
+                "estado = 'completado', progreso = 1, resultado = :resultado, terminado_en = now()",
+                resultado=a_json(reporte)
+            )
+            logger.info(f"📄 Reporte {trabajo.id} generado")
+        except ReportesSaturados as e:
+            # Sin cupo: el trabajo vuelve a pendientes y este trabajador espera
+            logger.info(f"⏳ Reporte {trabajo.id} sin cupo; se reintenta en {e.reintentar_en}s")
+            await self._actualizar(trabajo.id, "estado = 'pendiente', progreso = 0")
+            await asyncio.sleep(e.reintentar_en)
+        except asyncio.CancelledError:
+            # Al detener la cola el trabajo no queda en proceso bloqueando la deduplicación
+            logger.warning(f"⚠️ Reporte {trabajo.id} interrumpido; vuelve a la cola")
+            with suppress(Exception):
+                await asyncio.shield(self._actualizar(trabajo.id, "estado = 'pendiente', progreso = 0"))
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error generando reporte {trabajo.id}: {e}")
+            await self._actualizar(
+                trabajo.id,
+                "estado = 'fallido', error = :error, terminado_en = now()",
+                error=str(e)
+            )
+
+    async def recuperar_abandonados(self) -> int:
+        """Devuelve a pendientes los trabajos en proceso sin avances recientes"""
+        async with engine.begin() as conn:
+            resultado = await conn.execute(text("""
+                UPDATE reporte_trabajo
+                SET estado = 'pendiente', progreso = 0
+                WHERE estado = 'en_proceso'
+                    AND actualizado_en < now() - make_interval(secs => :expiracion)
+            """), {"expiracion": self.expiracion_segundos})
+        return resultado.rowcount
+
+    async def _recuperar(self):
+        try:
+            recuperados = await self.recuperar_abandonados()
+            if recuperados:
+                logger.warning(f"⚠️ {recuperados} reportes abandonados vuelven a la cola")
+                self._aviso.set()
+        except Exception as e:
+            logger.error(f"❌ Error recuperando reportes abandonados: {e}")
+
+    async def _vigilar_abandonados(self):
+        while True:
+            await asyncio.sleep(self.intervalo_sondeo)
+            await self._recuperar()
+
+    async def _trabajador(self):
+        while True:
+            try:
+                # Limpiar antes de tomar: un encolado posterior vuelve a despertar
+                self._aviso.clear()
+                trabajo = await self._tomar()
+                if trabajo is not None:
+                    await self._ejecutar(trabajo)
+                    continue
+            except Exception as e:
+                logger.error(f"❌ Error en la cola de reportes: {e}")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._aviso.wait(), self.intervalo_sondeo)
+
+    async def iniciar(self):
+        if self._tareas:
+            return
+        await self._recuperar()
+        self._tareas = [asyncio.create_task(self._trabajador()) for _ in range(self.trabajadores)]
+        self._tareas.append(asyncio.create_task(self._vigilar_abandonados()))
+
+    async def detener(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        for tarea in self._tareas:
+            with suppress(asyncio.CancelledError):
+                await tarea
+        self._tareas = []
+
+
+# Instancia global de la cola de reportes
+cola_reportes = ColaTrabajosReporte(
+    trabajadores=settings.reportes_trabajadores,
+    intervalo_sondeo=settings.reportes_intervalo_sondeo_segundos,
+    expiracion_segundos=settings.reportes_expiracion_segundos,
+)
@@ -0,0 +1,173 @@
+"""
+Trazas distribuidas al estilo OpenTelemetry
+
+Un span por operación GraphQL, uno por campo con resolver, uno por método
+de los servicios etiquetados y uno (hoja) por sentencia SQL. El contexto
+llega del gateway en `traceparent` (W3C Trace Context) y viaja entre
+corrutinas en una variable de contexto.
+
+Muestreo en la cabecera de la traza: si el gateway envía `traceparent` se
+respeta su decisión; si no, se muestrea al azar con `trazas_muestreo`. En
+un request no muestreado `span_actual` es None y cada punto de
+instrumentación termina en esa comprobación.
+"""
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+@dataclass
+class Span:
+    nombre: str
+    trace_id: str
+    span_id: str
+    padre_id: Optional[str]
+    tipo: str = "INTERNAL"
+    inicio_ns: int = field(default_factory=time.time_ns)
+    fin_ns: Optional[int] = None
+    atributos: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def como_dict(self) -> Dict[str, Any]:
+        """Representación cercana al JSON de OTLP"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.padre_id,
+            "name": self.nombre,
+            "kind": self.tipo,
+            "startTimeUnixNano": self.inicio_ns,
+            "endTimeUnixNano": self.fin_ns,
+            "attributes": self.atributos,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+
+# Span en curso; None fuera de una traza muestreada
+span_actual: ContextVar[Optional[Span]] = ContextVar("span_actual", default=None)
+
+
+def _id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def parsear_traceparent(valor: Optional[str]):
+    """(trace_id, span_id padre, muestreado) o None si falta o es inválido"""
+    coincidencia = _TRACEPARENT.match(valor.strip().lower()) if valor else None
+    if coincidencia is None:
+        return None
+    version, trace_id, padre_id, banderas = coincidencia.groups()
+    if version == "ff" or trace_id == "0" * 32 or padre_id == "0" * 16:
+        return None
+    return trace_id, padre_id, bool(int(banderas, 16) & 1)
+
+
+class ExportadorMemoria:
+    """Guarda los últimos spans terminados; pensado para pruebas y diagnóstico"""
+
+    def __init__(self, max_spans: int):
+        self.spans: "deque[Span]" = deque(maxlen=max_spans)
+
+    def exportar(self, span: Span):
+        self.spans.append(span)
+
+    def traza(self, trace_id: str) -> List[Span]:
+        return [span for span in self.spans if span.trace_id == trace_id]
+
+    def limpiar(self):
+        self.spans.clear()
+
+
+class ExportadorArchivo:
+    """Escribe cada span como una línea JSON desde un hilo aparte"""
+
+    def __init__(self, ruta: str):
+        self.ruta = Path(ruta)
+        self._cola: "queue.SimpleQueue[Span]" = queue.SimpleQueue()
+        self._hilo: Optional[threading.Thread] = None
+
+    def _escribir(self):
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            lote = [self._cola.get()]
+            while not self._cola.empty() and len(lote) < 500:
+                lote.append(self._cola.get_nowait())
+            try:
+                with open(self.ruta, "a", encoding="utf-8") as archivo:
+                    for span in lote:
+                        archivo.write(json.dumps(span.como_dict(), default=str) + "\n")
+            except OSError as e:
+                logger.error(f"❌ No se pudieron escribir {len(lote)} spans: {e}")
+
+    def exportar(self, span: Span):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._escribir, name="exportador-trazas", daemon=True)
+            self._hilo.start()
+        self._cola.put(span)
+
+
+class Trazador:
+    def __init__(self, exportador, habilitado: bool, muestreo: float):
+        self.exportador = exportador
+        self.habilitado = habilitado
+        self.muestreo = muestreo
+
+    def iniciar_traza(self, nombre: str, traceparent: Optional[str] = None, **atributos) -> Optional[Span]:
+        """Span raíz del request, o None si la traza no se muestrea"""
+        if not self.habilitado:
+            return None
+        padre = parsear_traceparent(traceparent)
+        if padre is not None:
+            trace_id, padre_id, muestreado = padre
+        else:
+            trace_id, padre_id, muestreado = _id(128), None, random.random() < self.muestreo
+        if not muestreado:
+            return None
+        return Span(nombre, trace_id, _id(64), padre_id, tipo="SERVER", atributos=atributos)
+
+    def iniciar_span(self, nombre: str, tipo: str = "INTERNAL", inicio_ns: Optional[int] = None, **atributos) -> Optional[Span]:
+        """Hijo del span en curso; None si no hay traza muestreada"""
+        padre = span_actual.get()
+        if padre is None:
+            return None
+        span = Span(nombre, padre.trace_id, _id(64), padre.span_id, tipo=tipo, atributos=atributos)
+        if inicio_ns is not None:
+            span.inicio_ns = inicio_ns
+        return span
+
+    def terminar(self, span: Span, error: Optional[BaseException] = None):
+        span.fin_ns = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        self.exportador.exportar(span)
+
+
+def _crear_trazador() -> Trazador:
+    if settings.trazas_exportador == "archivo":
+        exportador = ExportadorArchivo(settings.trazas_archivo)
+    else:
+        exportador = ExportadorMemoria(settings.trazas_max_spans_memoria)
+    return Trazador(exportador, settings.trazas_habilitadas, settings.trazas_muestreo)
+
+
+# Trazador global
+trazador = _crear_trazador()
@@ -0,0 +1,58 @@
+"""
+Versión de los datos de la veterinaria, vigilada en segundo plano
+
+La versión es la suma de los contadores de cambios de `kpi_resumen_global`
+(ver `app/migrations/resumen_kpi.py`). Se lee cada `intervalo_segundos`,
+de modo que quien la consulta (p. ej. el cache de respuestas) no toca la
+base de datos en cada request.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from app.config.database import engine
+from app.config.settings import settings
+from app.migrations.resumen_kpi import version_datos
+
+logger = logging.getLogger(__name__)
+
+
+class VigiaVersionDatos:
+    """Mantiene la última versión conocida; None si no se pudo leer"""
+
+    def __init__(self, intervalo_segundos: float):
+        self.intervalo_segundos = intervalo_segundos
+        self.version: Optional[int] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def actualizar(self):
+        async with engine.connect() as conn:
+            self.version = await version_datos(conn)
+
+    async def _ciclo(self):
+        while True:
+            try:
+                await self.actualizar()
+            except Exception as e:
+                # Sin versión confiable nada se sirve desde cache
+                if self.version is not None:
+                    logger.error(f"❌ Error leyendo la versión de datos: {e}")
+                self.version = None
+            await asyncio.sleep(self.intervalo_segundos)
+
+    def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+
+# Instancia global del vigía de versión
+vigia_version = VigiaVersionDatos(intervalo_segundos=settings.version_datos_intervalo_segundos)
@@ -2,6 +2,7 @@
 Script de inicialización del microservicio de KPIs
 Compatible con Windows, Linux y macOS
 """
+import argparse
 import asyncio
 import sys
 import os
@@ -13,18 +14,24 @@ app_dir = current_dir / "app"
 sys.path.insert(0, str(app_dir))
 
 try:
-    from app.config.database import test_connection, engine
+    from sqlalchemy import text
+    from app.config.database import test_connection, motores, REPORTES
     from app.config.settings import settings
+    from app.services.refresco_vistas import VISTAS_KPI
+    from app.migrations import resumen_kpi, trabajos_reporte, reportes_programados
 except ImportError as e:
     print(f"❌ Error importando módulos: {e}")
     print("💡 Asegúrate de que las dependencias estén instaladas:")
     print("   pip install -r requirements.txt")
     sys.exit(1)
 
+# Índices, vistas y reconstrucción de resúmenes superan el statement_timeout interactivo
+engine = motores[REPORTES]
+
 
 async def init_database():
     """
-    Inicializar la base de datos y crear vistas para KPIs
+    Inicializar la base de datos y crear vistas materializadas para KPIs
     """
     print("🔧 Inicializando base de datos para KPIs...")
     
@@ -39,14 +46,28 @@ async def init_database():
         # Crear tablas si no existen (aunque ya deberían existir)
         async with engine.begin() as conn:
             # En este caso, no creamos las tablas porque ya existen
-            # Solo vamos a crear vistas útiles para KPIs
-            
-            # Vista para estadísticas mensuales de citas
-            await conn.execute("""
-                CREATE OR REPLACE VIEW vista_citas_mensuales AS
+            # Solo vamos a crear vistas materializadas útiles para KPIs
+
+            # Las versiones anteriores creaban vistas normales con los mismos nombres
+            for vista in VISTAS_KPI:
+                await conn.execute(text(f"""
+                    DO $$
+                    BEGIN
+                        IF EXISTS (
+                            SELECT 1 FROM pg_class
+                            WHERE relname = '{vista}' AND relkind = 'v'
+                        ) THEN
+                            DROP VIEW {vista};
+                        END IF;
+                    END $$;
+                """))
+
+            # Vista materializada para estadísticas mensuales de citas
+            await conn.execute(text("""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS vista_citas_mensuales AS
                 SELECT 
-                    EXTRACT(YEAR FROM fechareserva) as año,
-                    EXTRACT(MONTH FROM fechareserva) as mes,
+                    EXTRACT(YEAR FROM fechareserva)::int as anio,
+                    EXTRACT(MONTH FROM fechareserva)::int as mes,
                     COUNT(*) as total_citas,
                     COUNT(CASE WHEN estado = 3 THEN 1 END) as citas_completadas,
                     COUNT(CASE WHEN estado = 4 THEN 1 END) as citas_canceladas,
@@ -57,87 +78,143 @@ async def init_database():
                 FROM cita 
                 GROUP BY 
                     EXTRACT(YEAR FROM fechareserva),
-                    EXTRACT(MONTH FROM fechareserva)
-                ORDER BY año DESC, mes DESC;
-            """)
-            
-            # Vista para estadísticas de doctores
-            await conn.execute("""
-                CREATE OR REPLACE VIEW vista_doctor_performance AS
+                    EXTRACT(MONTH FROM fechareserva);
+            """))
+            await conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_vista_citas_mensuales
+                ON vista_citas_mensuales(anio, mes);
+            """))
+
+            # Vista materializada de rendimiento por doctor y mes
+            await conn.execute(text("""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS vista_doctor_performance AS
                 SELECT 
-                    d.id,
-                    d.nombre || ' ' || d.apellido as doctor_nombre,
+                    c.doctor_id,
+                    EXTRACT(YEAR FROM c.fechareserva)::int as anio,
+                    EXTRACT(MONTH FROM c.fechareserva)::int as mes,
                     COUNT(c.id) as total_citas,
                     COUNT(CASE WHEN c.estado = 3 THEN 1 END) as citas_completadas,
-                    ROUND(
-                        COUNT(CASE WHEN c.estado = 3 THEN 1 END) * 100.0 / 
-                        NULLIF(COUNT(c.id), 0), 
-                        2
-                    ) as tasa_completitud,
-                    COALESCE(
-                        (SELECT ROUND(AVG(diag_count), 2) 
-                         FROM (
-                             SELECT COUNT(diag.id) as diag_count
-                             FROM cita c2 
-                             LEFT JOIN diagnostico diag ON c2.id = diag.cita_id
-                             WHERE c2.doctor_id = d.id
-                             GROUP BY c2.id
-                         ) subq),
-                        0
-                    ) as promedio_diagnosticos_por_cita
-                FROM doctor d
-                LEFT JOIN cita c ON d.id = c.doctor_id
-                GROUP BY d.id, d.nombre, d.apellido
-                HAVING COUNT(c.id) > 0;
-            """)
-            
-            # Vista para vacunaciones próximas
-            await conn.execute("""
-                CREATE OR REPLACE VIEW vista_vacunaciones_proximas AS
+                    COALESCE(SUM(diag.total), 0) as total_diagnosticos
+                FROM cita c
+                LEFT JOIN (
+                    SELECT cita_id, COUNT(*) as total
+                    FROM diagnostico
+                    GROUP BY cita_id
+                ) diag ON diag.cita_id = c.id
+                GROUP BY
+                    c.doctor_id,
+                    EXTRACT(YEAR FROM c.fechareserva),
+                    EXTRACT(MONTH FROM c.fechareserva);
+            """))
+            await conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_vista_doctor_performance
+                ON vista_doctor_performance(doctor_id, anio, mes);
+            """))
+
+            # Vista materializada para vacunaciones próximas
+            # (días y prioridad dependen de CURRENT_DATE y se calculan al leer)
+            await conn.execute(text("""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS vista_vacunaciones_proximas AS
                 SELECT 
+                    dv.id as detalle_vacunacion_id,
                     m.id as mascota_id,
                     m.nombre as mascota_nombre,
                     cl.nombre || ' ' || cl.apellido as cliente_nombre,
                     cl.telefono as cliente_telefono,
                     v.descripcion as vacuna,
-                    dv.proximavacunacion,
-                    CASE 
-                        WHEN dv.proximavacunacion < CURRENT_DATE THEN 
-                            CURRENT_DATE - dv.proximavacunacion
-                        ELSE 0 
-                    END as dias_vencida,
-                    CASE 
-                        WHEN dv.proximavacunacion < CURRENT_DATE THEN 'VENCIDA'
-                        WHEN dv.proximavacunacion <= CURRENT_DATE + INTERVAL '7 days' THEN 'URGENTE'
-                        WHEN dv.proximavacunacion <= CURRENT_DATE + INTERVAL '15 days' THEN 'PRÓXIMA'
-                        ELSE 'PROGRAMADA'
-                    END as urgencia
+                    dv.fechavacunacion,
+                    dv.proximavacunacion
                 FROM detalle_vacunacion dv
                 JOIN carnet_vacunacion cv ON dv.carnet_vacunacion_id = cv.id
                 JOIN mascota m ON cv.mascota_id = m.id
                 JOIN cliente cl ON m.cliente_id = cl.id
                 JOIN vacuna v ON dv.vacuna_id = v.id
-                WHERE dv.proximavacunacion IS NOT NULL
-                ORDER BY dv.proximavacunacion;
-            """)
+                WHERE dv.proximavacunacion IS NOT NULL;
+            """))
+            await conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_vista_vacunaciones_proximas
+                ON vista_vacunaciones_proximas(detalle_vacunacion_id);
+            """))
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_vista_vacunaciones_proximas_fecha
+                ON vista_vacunaciones_proximas(proximavacunacion);
+            """))
+
+            # Registro del último refresco de cada vista materializada
+            await conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS kpi_refresco_vistas (
+                    vista VARCHAR(64) PRIMARY KEY,
+                    refrescada_en TIMESTAMPTZ NOT NULL
+                );
+            """))
+            await conn.execute(text("""
+                INSERT INTO kpi_refresco_vistas (vista, refrescada_en)
+                SELECT unnest(CAST(:vistas AS text[])), now()
+                ON CONFLICT (vista) DO NOTHING;
+            """), {"vistas": list(VISTAS_KPI)})
             
             # Índices para optimizar consultas de KPIs
-            await conn.execute("""
+            await conn.execute(text("""
                 CREATE INDEX IF NOT EXISTS idx_cita_fecha_reserva 
                 ON cita(fechareserva);
-            """)
+            """))
             
-            await conn.execute("""
+            await conn.execute(text("""
                 CREATE INDEX IF NOT EXISTS idx_cita_estado 
                 ON cita(estado);
-            """)
-            
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_detalle_vacunacion_proxima 
-                ON detalle_vacunacion(proximavacunacion);
-            """)
+            """))
             
-            print("✅ Vistas y índices para KPIs creados correctamente")
+            # Alertas de vacunación: rangos de fecha y paginación por clave
+            # (proximavacunacion, id); reemplaza al índice de una sola columna
+            await conn.execute(text("DROP INDEX IF EXISTS idx_detalle_vacunacion_proxima;"))
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_detalle_vacunacion_proxima_id
+                ON detalle_vacunacion(proximavacunacion, id)
+                WHERE proximavacunacion IS NOT NULL;
+            """))
+
+            # Alertas filtradas por vacuna, en el mismo orden de paginación
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_detalle_vacunacion_vacuna_proxima
+                ON detalle_vacunacion(vacuna_id, proximavacunacion, id)
+                WHERE proximavacunacion IS NOT NULL;
+            """))
+
+            # Rendimiento por doctor: rango de fechas dentro de cada doctor
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_cita_doctor_fecha
+                ON cita(doctor_id, fechareserva);
+            """))
+
+            # Joins de reportes y rendimiento por doctor (las FK no se indexan solas)
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_diagnostico_cita
+                ON diagnostico(cita_id);
+            """))
+
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_tratamiento_diagnostico
+                ON tratamiento(diagnostico_id);
+            """))
+
+            # Vacunas aplicadas por período en el reporte clínico
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_detalle_vacunacion_fecha
+                ON detalle_vacunacion(fechavacunacion);
+            """))
+
+            print("✅ Vistas materializadas e índices para KPIs creados correctamente")
+
+        # Tablas resumen mantenidas por triggers (en su propia transacción)
+        async with engine.begin() as conn:
+            await resumen_kpi.instalar(conn)
+            print("✅ Tablas resumen y triggers de KPIs instalados")
+
+        # Cola persistente de trabajos de reportes
+        async with engine.begin() as conn:
+            await trabajos_reporte.instalar(conn)
+            await reportes_programados.instalar(conn)
+            print("✅ Tablas de trabajos y programación de reportes creadas")
             
     except Exception as e:
         print(f"❌ Error al inicializar base de datos: {e}")
@@ -146,12 +223,48 @@ async def init_database():
     return True
 
 
+async def verificar_resumenes(reparar: bool = False):
+    """
+    Concilia las tablas resumen con las tablas base
+    """
+    print("🔍 Verificando tablas resumen de KPIs...")
+    async with engine.begin() as conn:
+        diferencias = await resumen_kpi.verificar(conn)
+        for diferencia in diferencias:
+            print(f"   ⚠️ {diferencia}")
+
+        if not diferencias:
+            print("✅ Las tablas resumen coinciden con las tablas base")
+            return True
+
+        print(f"❌ {len(diferencias)} diferencias encontradas")
+        if reparar:
+            await resumen_kpi.reconstruir(conn)
+            print("🔧 Tablas resumen reconstruidas")
+            return True
+        return False
+
+
 async def main():
     """Función principal"""
+    parser = argparse.ArgumentParser(description="Inicialización de la base de datos del subgrafo KPI")
+    parser.add_argument(
+        "--verificar-resumenes", action="store_true",
+        help="Compara las tablas resumen con las tablas base en lugar de inicializar"
+    )
+    parser.add_argument(
+        "--reparar", action="store_true",
+        help="Con --verificar-resumenes, reconstruye los resúmenes si hay diferencias"
+    )
+    args = parser.parse_args()
+
     print("🚀 Iniciando script de inicialización...")
     print(f"📊 Configuración: {settings.api_title}")
     print(f"🗄️  Base de datos: {settings.postgres_host}:{settings.postgres_port}/{settings.postgres_db}")
     
+    if args.verificar_resumenes:
+        return 0 if await verificar_resumenes(args.reparar) else 1
+
     if await init_database():
         print("✅ Inicialización completada exitosamente")
         return 0
@@ -161,4 +274,5 @@ async def main():
 
 
 if __name__ == "__main__":
-    exit_code = asyncio.run(main())
\ No newline at end of file
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
\ No newline at end of file
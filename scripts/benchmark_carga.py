@@ -0,0 +1,290 @@
+"""
+Benchmark de carga del endpoint /graphql
+
+Reproduce las operaciones de GRAPHQL_EXAMPLES.md contra un subgrafo en
+ejecución y reporta latencia p50/p95/p99 y throughput por campo raíz.
+Las operaciones se ajustan al schema real (obtenido por introspección):
+se descartan campos y argumentos que no existen y cada campo raíz se
+mide por separado.
+
+Uso:
+    python scripts/benchmark_carga.py --url http://localhost:9090/graphql \\
+        --concurrencia 32 --duracion 60 --salida resultados/base.json
+    python scripts/benchmark_carga.py --comparar resultados/base.json resultados/nuevo.json
+"""
+import argparse
+import asyncio
+import json
+import re
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+from graphql import (
+    REMOVE, FieldNode, FragmentDefinitionNode, OperationDefinitionNode, OperationType, TypeInfo,
+    TypeInfoVisitor, Visitor, build_client_schema, get_introspection_query,
+    parse, print_ast, validate, visit,
+)
+from graphql.error import GraphQLSyntaxError
+
+RAIZ = Path(__file__).resolve().parent.parent
+EJEMPLOS = RAIZ / "GRAPHQL_EXAMPLES.md"
+
+BLOQUE_GRAPHQL = re.compile(r"```graphql\n(.*?)```(?:\s*\*\*Variables:\*\*\s*```json\n(.*?)```)?", re.S)
+
+
+class _PodarInvalidos(Visitor):
+    """Elimina campos y argumentos que no existen en el schema"""
+
+    def __init__(self, type_info: TypeInfo):
+        super().__init__()
+        self.type_info = type_info
+
+    def enter_field(self, node, *_):
+        if self.type_info.get_field_def() is None:
+            return REMOVE
+
+    def enter_argument(self, node, *_):
+        if self.type_info.get_argument() is None:
+            return REMOVE
+
+
+def _quitar_selecciones_vacias(documento):
+    """Quita los campos compuestos que se quedaron sin subcampos tras la poda"""
+    class Visitante(Visitor):
+        def leave_field(self, node, *_):
+            if node.selection_set is not None and not node.selection_set.selections:
+                return REMOVE
+    return visit(documento, Visitante())
+
+
+def _nombres_usados(nodo, tipo: str) -> set:
+    """Nombres de variables (`variable`) o fragmentos (`fragment_spread`) usados en un nodo"""
+    usados = set()
+
+    class Visitante(Visitor):
+        pass
+
+    setattr(Visitante, f"enter_{tipo}", lambda self, node, *_: usados.add(node.name.value))
+    visit(nodo, Visitante())
+    return usados
+
+
+def _fragmentos_necesarios(campo, fragmentos: Dict[str, FragmentDefinitionNode]) -> list:
+    """Fragmentos usados por un campo, incluidos los anidados"""
+    pendientes = list(_nombres_usados(campo, "fragment_spread"))
+    necesarios = {}
+    while pendientes:
+        nombre = pendientes.pop()
+        if nombre in necesarios or nombre not in fragmentos:
+            continue
+        necesarios[nombre] = fragmentos[nombre]
+        pendientes.extend(_nombres_usados(fragmentos[nombre], "fragment_spread"))
+    return list(necesarios.values())
+
+
+def cargar_operaciones(schema) -> List[Dict[str, Any]]:
+    """Extrae las consultas de GRAPHQL_EXAMPLES.md y las divide por campo raíz"""
+    operaciones = []
+    texto = EJEMPLOS.read_text(encoding="utf-8")
+    for consulta, variables in BLOQUE_GRAPHQL.findall(texto):
+        # Los ejemplos usan `año`, que no es un nombre GraphQL válido
+        consulta = consulta.replace("año", "anio")
+        variables = json.loads(variables.replace("año", "anio")) if variables else {}
+        try:
+            documento = parse(consulta)
+        except GraphQLSyntaxError as e:
+            print(f"⚠️ Ejemplo omitido (sintaxis): {e.message}")
+            continue
+
+        type_info = TypeInfo(schema)
+        documento = visit(documento, TypeInfoVisitor(type_info, _PodarInvalidos(type_info)))
+        documento = _quitar_selecciones_vacias(documento)
+
+        for definicion in documento.definitions:
+            if not isinstance(definicion, OperationDefinitionNode):
+                continue
+            if definicion.operation != OperationType.QUERY:
+                continue
+            fragmentos = {
+                d.name.value: d for d in documento.definitions if isinstance(d, FragmentDefinitionNode)
+            }
+            for campo in definicion.selection_set.selections:
+                if not isinstance(campo, FieldNode):
+                    continue
+                usadas = _nombres_usados(campo, "variable")
+                operacion = definicion.__class__(
+                    operation=definicion.operation,
+                    name=None,
+                    variable_definitions=tuple(
+                        v for v in definicion.variable_definitions if v.variable.name.value in usadas
+                    ),
+                    directives=definicion.directives,
+                    selection_set=definicion.selection_set.__class__(selections=(campo,)),
+                )
+                documento_campo = documento.__class__(
+                    definitions=(operacion, *_fragmentos_necesarios(campo, fragmentos))
+                )
+                if validate(schema, documento_campo):
+                    continue
+                operaciones.append({
+                    "campo": campo.name.value,
+                    "query": print_ast(documento_campo),
+                    "variables": {k: v for k, v in variables.items() if k in usadas},
+                })
+
+    # Una misma consulta puede repetirse entre ejemplos
+    unicas = {}
+    for operacion in operaciones:
+        unicas[(operacion["query"], json.dumps(operacion["variables"], sort_keys=True))] = operacion
+    return list(unicas.values())
+
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+async def ejecutar_carga(
+    url: str,
+    operaciones: List[Dict[str, Any]],
+    concurrencia: int,
+    duracion: float,
+    calentamiento: float
+) -> Dict[str, Any]:
+    latencias: Dict[str, List[float]] = defaultdict(list)
+    errores: Dict[str, int] = defaultdict(int)
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+
+    async with httpx.AsyncClient(timeout=60.0, limits=limites) as cliente:
+        inicio_medicion = time.perf_counter() + calentamiento
+        fin = inicio_medicion + duracion
+
+        async def trabajador(desplazamiento: int):
+            i = desplazamiento
+            while time.perf_counter() < fin:
+                operacion = operaciones[i % len(operaciones)]
+                i += 1
+                inicio = time.perf_counter()
+                try:
+                    respuesta = await cliente.post(url, json={
+                        "query": operacion["query"], "variables": operacion["variables"]
+                    })
+                    fallo = respuesta.status_code != 200 or bool(respuesta.json().get("errors"))
+                except (httpx.HTTPError, ValueError):
+                    fallo = True
+                transcurrido = time.perf_counter() - inicio
+                if inicio < inicio_medicion:
+                    continue
+                if fallo:
+                    errores[operacion["campo"]] += 1
+                else:
+                    latencias[operacion["campo"]].append(transcurrido * 1000)
+
+        await asyncio.gather(*(trabajador(n) for n in range(concurrencia)))
+
+    campos = {}
+    for campo in sorted(set(latencias) | set(errores)):
+        valores = latencias[campo]
+        campos[campo] = {
+            "peticiones": len(valores),
+            "errores": errores[campo],
+            "throughput_rps": round(len(valores) / duracion, 2),
+            "media_ms": round(statistics.fmean(valores), 2) if valores else 0.0,
+            "p50_ms": round(percentil(valores, 50), 2),
+            "p95_ms": round(percentil(valores, 95), 2),
+            "p99_ms": round(percentil(valores, 99), 2),
+            "max_ms": round(max(valores), 2) if valores else 0.0,
+        }
+    total = sum(c["peticiones"] for c in campos.values())
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "url": url,
+        "concurrencia": concurrencia,
+        "duracion_s": duracion,
+        "throughput_total_rps": round(total / duracion, 2),
+        "campos": campos,
+    }
+
+
+def imprimir(resultado: Dict[str, Any]):
+    print(f"\n{'campo':<34}{'req':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for campo, m in resultado["campos"].items():
+        print(f"{campo:<34}{m['peticiones']:>8}{m['errores']:>6}{m['throughput_rps']:>9}"
+              f"{m['p50_ms']:>9}{m['p95_ms']:>9}{m['p99_ms']:>9}")
+    print(f"\nThroughput total: {resultado['throughput_total_rps']} req/s")
+
+
+def comparar(base: Dict[str, Any], nuevo: Dict[str, Any]):
+    """Imprime la variación porcentual de cada métrica entre dos corridas"""
+    def delta(a: float, b: float) -> str:
+        return f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+
+    print(f"\n{'campo':<34}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for campo in sorted(set(base["campos"]) | set(nuevo["campos"])):
+        a, b = base["campos"].get(campo), nuevo["campos"].get(campo)
+        if a is None or b is None:
+            print(f"{campo:<34}{'(solo en una corrida)':>40}")
+            continue
+        print(f"{campo:<34}{delta(a['throughput_rps'], b['throughput_rps']):>10}"
+              f"{delta(a['p50_ms'], b['p50_ms']):>10}{delta(a['p95_ms'], b['p95_ms']):>10}"
+              f"{delta(a['p99_ms'], b['p99_ms']):>10}")
+
+
+async def obtener_schema(url: str):
+    async with httpx.AsyncClient(timeout=30.0) as cliente:
+        respuesta = await cliente.post(url, json={"query": get_introspection_query()})
+        respuesta.raise_for_status()
+        return build_client_schema(respuesta.json()["data"])
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de carga del subgrafo KPI")
+    parser.add_argument("--url", default="http://localhost:9090/graphql")
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--duracion", type=float, default=30.0, help="Segundos de medición")
+    parser.add_argument("--calentamiento", type=float, default=5.0, help="Segundos iniciales no medidos")
+    parser.add_argument("--campos", nargs="*", help="Limitar a estos campos raíz")
+    parser.add_argument("--salida", type=Path, help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", nargs=2, type=Path, metavar=("BASE", "NUEVO"),
+                        help="Compara dos archivos de resultados y termina")
+    args = parser.parse_args()
+
+    if args.comparar:
+        base, nuevo = (json.loads(p.read_text(encoding="utf-8")) for p in args.comparar)
+        comparar(base, nuevo)
+        return 0
+
+    schema = await obtener_schema(args.url)
+    operaciones = cargar_operaciones(schema)
+    if args.campos:
+        operaciones = [o for o in operaciones if o["campo"] in args.campos]
+    if not operaciones:
+        print("❌ No hay operaciones válidas para ejecutar")
+        return 1
+
+    print(f"🏁 {len(operaciones)} operaciones, concurrencia {args.concurrencia}, "
+          f"{args.duracion}s (+{args.calentamiento}s de calentamiento)")
+    resultado = await ejecutar_carga(
+        args.url, operaciones, args.concurrencia, args.duracion, args.calentamiento
+    )
+    resultado["operaciones"] = operaciones
+    imprimir(resultado)
+
+    if args.salida:
+        args.salida.parent.mkdir(parents=True, exist_ok=True)
+        args.salida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"💾 Resultados guardados en {args.salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
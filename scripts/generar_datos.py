@@ -0,0 +1,318 @@
+"""
+Generador de datos sintéticos para pruebas de carga del subgrafo KPI
+
+Llena una base PostgreSQL local siguiendo app/models/database_models.py.
+El factor de escala multiplica los tamaños base; con --escala 200 se
+generan unos 10 millones de citas.
+
+Uso:
+    python scripts/generar_datos.py --escala 1
+    python scripts/generar_datos.py --escala 200 --crear-esquema --semilla 7
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from datetime import date, datetime, time as hora, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import text
+
+from app.config.database import REPORTES, Base, motores
+from app.models import database_models  # noqa: F401  (registra las tablas en Base)
+
+# Carga masiva: el pool de reportes tiene un statement_timeout más amplio
+engine = motores[REPORTES]
+
+# Tamaños con escala 1
+TAMANOS_BASE = {
+    "doctor": 20,
+    "cliente": 2_000,
+    "mascota": 3_000,
+    "cita": 50_000,
+}
+
+# Tablas en orden de dependencias (para truncar y fijar secuencias)
+TABLAS = (
+    "especie", "vacuna", "bloque_horario", "doctor", "cliente", "mascota",
+    "cita", "diagnostico", "tratamiento", "carnet_vacunacion", "detalle_vacunacion",
+)
+
+LOTE = 50_000
+
+NOMBRES = [
+    "Ana", "Luis", "María", "Carlos", "Lucía", "Jorge", "Sofía", "Miguel", "Valeria",
+    "Diego", "Camila", "Andrés", "Paula", "Fernando", "Daniela", "Ricardo", "Gabriela",
+]
+APELLIDOS = [
+    "Pérez", "Gómez", "Rodríguez", "Fernández", "López", "Martínez", "Sánchez",
+    "Romero", "Torres", "Flores", "Vargas", "Rojas", "Mendoza", "Gutiérrez",
+]
+ESPECIES = {
+    "Perro": ["Labrador", "Pastor Alemán", "Poodle", "Bulldog", "Mestizo", "Chihuahua"],
+    "Gato": ["Siamés", "Persa", "Mestizo", "Maine Coon", "Bengalí"],
+    "Ave": ["Periquito", "Canario", "Loro"],
+    "Conejo": ["Holland Lop", "Cabeza de León"],
+    "Hámster": ["Sirio", "Ruso"],
+}
+PESOS_ESPECIE = [55, 35, 4, 4, 2]
+NOMBRES_MASCOTA = [
+    "Max", "Luna", "Rocky", "Nala", "Toby", "Milo", "Kira", "Simba", "Lola", "Coco",
+    "Bruno", "Mía", "Thor", "Canela", "Pelusa", "Zeus", "Chispa", "Manchas",
+]
+VACUNAS = {
+    "Antirrábica": 365,
+    "Séxtuple": 365,
+    "Triple felina": 365,
+    "Leucemia felina": 365,
+    "Parvovirus": 180,
+    "Bordetella": 180,
+    "Desparasitación": 90,
+}
+MOTIVOS = [
+    "Consulta general", "Vacunación", "Control", "Vómitos", "Diarrea", "Cojera",
+    "Problemas de piel", "Revisión dental", "Control post-operatorio", "Otitis",
+]
+DIAGNOSTICOS = [
+    "Gastroenteritis", "Dermatitis alérgica", "Otitis externa", "Parasitosis intestinal",
+    "Sano", "Sobrepeso", "Enfermedad periodontal", "Luxación de rótula", "Conjuntivitis",
+]
+TRATAMIENTOS = [
+    ("Antibiótico", "Amoxicilina 10 mg/kg cada 12 h"),
+    ("Antiinflamatorio", "Meloxicam 0.1 mg/kg cada 24 h"),
+    ("Antiparasitario", "Praziquantel dosis única"),
+    ("Dieta", "Dieta gastrointestinal por 7 días"),
+    ("Limpieza", "Limpieza ótica cada 48 h"),
+    ("Control", "Revisión en 15 días"),
+]
+# Estados de cita: 1 pendiente, 2 confirmada, 3 completada, 4 cancelada
+ESTADOS_PASADO = ([3, 4, 1], [78, 17, 5])
+ESTADOS_FUTURO = ([1, 2, 4], [55, 40, 5])
+
+
+def nombre_persona(rnd: random.Random):
+    return rnd.choice(NOMBRES), f"{rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+
+
+class Generador:
+    """Genera y copia los datos por lotes con COPY de asyncpg"""
+
+    def __init__(self, escala: float, anios: int, semilla: int):
+        self.rnd = random.Random(semilla)
+        self.tamanos = {tabla: max(1, int(n * escala)) for tabla, n in TAMANOS_BASE.items()}
+        self.hoy = date.today()
+        self.inicio = self.hoy - timedelta(days=365 * anios)
+        self.dias_rango = (self.hoy + timedelta(days=60) - self.inicio).days
+        self.ids = {}
+
+    async def _siguiente_id(self, conn, tabla: str) -> int:
+        resultado = await conn.execute(text(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {tabla}"))
+        return int(resultado.scalar())
+
+    async def _copiar(self, conn, tabla: str, columnas, filas):
+        """Copia un lote con COPY usando la conexión asyncpg subyacente"""
+        if not filas:
+            return
+        cruda = await conn.get_raw_connection()
+        await cruda.driver_connection.copy_records_to_table(tabla, records=filas, columns=columnas)
+
+    async def _catalogos(self, conn):
+        self.ids["especie"] = {}
+        inicio = await self._siguiente_id(conn, "especie")
+        filas = []
+        for i, especie in enumerate(ESPECIES):
+            self.ids["especie"][especie] = inicio + i
+            filas.append((inicio + i, especie))
+        await self._copiar(conn, "especie", ["id", "descripcion"], filas)
+
+        inicio = await self._siguiente_id(conn, "vacuna")
+        self.ids["vacuna"] = [(inicio + i, dias) for i, dias in enumerate(VACUNAS.values())]
+        await self._copiar(conn, "vacuna", ["id", "descripcion"],
+                           [(inicio + i, nombre) for i, nombre in enumerate(VACUNAS)])
+
+        inicio = await self._siguiente_id(conn, "bloque_horario")
+        filas = []
+        for dia in range(1, 7):
+            for h in range(8, 18):
+                filas.append((inicio + len(filas), dia, hora(h), hora(h + 1), 1))
+        self.ids["bloque_horario"] = [fila[0] for fila in filas]
+        await self._copiar(conn, "bloque_horario",
+                           ["id", "diasemana", "horainicio", "horafinal", "activo"], filas)
+
+    async def _personas(self, conn, tabla: str):
+        rnd = self.rnd
+        inicio = await self._siguiente_id(conn, tabla)
+        total = self.tamanos[tabla]
+        self.ids[tabla] = (inicio, inicio + total)
+        columnas = ["id", "nombre", "apellido", "ci", "telefono", "fotourl"]
+        if tabla == "doctor":
+            columnas.insert(5, "email")
+        for desde in range(0, total, LOTE):
+            filas = []
+            for i in range(desde, min(desde + LOTE, total)):
+                nombre, apellido = nombre_persona(rnd)
+                fila = [inicio + i, nombre, apellido, f"{tabla[0].upper()}{inicio + i:09d}",
+                        f"7{rnd.randint(0, 9999999):07d}", None]
+                if tabla == "doctor":
+                    fila.insert(5, f"doctor{inicio + i}@veterinaria.local")
+                filas.append(tuple(fila))
+            await self._copiar(conn, tabla, columnas, filas)
+
+    async def _mascotas(self, conn):
+        rnd = self.rnd
+        inicio = await self._siguiente_id(conn, "mascota")
+        total = self.tamanos["mascota"]
+        self.ids["mascota"] = (inicio, inicio + total)
+        clientes = self.ids["cliente"]
+        especies = list(ESPECIES)
+        for desde in range(0, total, LOTE):
+            filas = []
+            for i in range(desde, min(desde + LOTE, total)):
+                especie = rnd.choices(especies, PESOS_ESPECIE)[0]
+                nacimiento = self.hoy - timedelta(days=rnd.randint(60, 15 * 365))
+                filas.append((
+                    inicio + i, rnd.choice(NOMBRES_MASCOTA), nacimiento,
+                    rnd.choice(ESPECIES[especie]), rnd.choice(["Macho", "Hembra"]), None,
+                    rnd.randrange(*clientes), self.ids["especie"][especie],
+                ))
+            await self._copiar(conn, "mascota", [
+                "id", "nombre", "fechanacimiento", "raza", "sexo", "fotourl", "cliente_id", "especie_id"
+            ], filas)
+
+    async def _citas(self, conn):
+        """Citas con sus diagnósticos y tratamientos (solo las completadas tienen diagnóstico)"""
+        rnd = self.rnd
+        id_cita = await self._siguiente_id(conn, "cita")
+        id_diag = await self._siguiente_id(conn, "diagnostico")
+        id_trat = await self._siguiente_id(conn, "tratamiento")
+        total = self.tamanos["cita"]
+        doctores, mascotas = self.ids["doctor"], self.ids["mascota"]
+        bloques = self.ids["bloque_horario"]
+
+        for desde in range(0, total, LOTE):
+            citas, diagnosticos, tratamientos = [], [], []
+            for _ in range(desde, min(desde + LOTE, total)):
+                dia = self.inicio + timedelta(days=rnd.randrange(self.dias_rango))
+                reserva = datetime.combine(dia, hora(rnd.randint(8, 17), rnd.choice([0, 15, 30, 45])))
+                creacion = reserva - timedelta(days=rnd.randint(0, 30), hours=rnd.randint(0, 23))
+                estados, pesos = ESTADOS_PASADO if dia < self.hoy else ESTADOS_FUTURO
+                estado = rnd.choices(estados, pesos)[0]
+                citas.append((
+                    id_cita, creacion, rnd.choice(MOTIVOS), reserva, estado,
+                    rnd.randrange(*doctores), rnd.randrange(*mascotas), rnd.choice(bloques),
+                ))
+                if estado == 3:
+                    for _ in range(rnd.choices([1, 2, 3], [75, 20, 5])[0]):
+                        diagnosticos.append((
+                            id_diag, rnd.choice(DIAGNOSTICOS), reserva + timedelta(minutes=30),
+                            "Sin observaciones adicionales", id_cita,
+                        ))
+                        for _ in range(rnd.choices([0, 1, 2], [30, 55, 15])[0]):
+                            nombre, descripcion = rnd.choice(TRATAMIENTOS)
+                            tratamientos.append((id_trat, nombre, descripcion, "Seguimiento normal", id_diag))
+                            id_trat += 1
+                        id_diag += 1
+                id_cita += 1
+
+            await self._copiar(conn, "cita", [
+                "id", "fechacreacion", "motivo", "fechareserva", "estado",
+                "doctor_id", "mascota_id", "bloque_horario_id"
+            ], citas)
+            await self._copiar(conn, "diagnostico", [
+                "id", "descripcion", "fecharegistro", "observaciones", "cita_id"
+            ], diagnosticos)
+            await self._copiar(conn, "tratamiento", [
+                "id", "nombre", "descripcion", "observaciones", "diagnostico_id"
+            ], tratamientos)
+            print(f"   📅 {min(desde + LOTE, total):,} / {total:,} citas")
+
+    async def _vacunaciones(self, conn):
+        """Un carnet para el 85% de las mascotas, con 1 a 6 aplicaciones cada uno"""
+        rnd = self.rnd
+        id_carnet = await self._siguiente_id(conn, "carnet_vacunacion")
+        id_detalle = await self._siguiente_id(conn, "detalle_vacunacion")
+        carnets, detalles = [], []
+
+        async def volcar():
+            await self._copiar(conn, "carnet_vacunacion", ["id", "fechaemision", "mascota_id"], carnets)
+            await self._copiar(conn, "detalle_vacunacion", [
+                "id", "fechavacunacion", "proximavacunacion", "carnet_vacunacion_id", "vacuna_id"
+            ], detalles)
+            carnets.clear()
+            detalles.clear()
+
+        for mascota_id in range(*self.ids["mascota"]):
+            if rnd.random() > 0.85:
+                continue
+            emision = self.inicio + timedelta(days=rnd.randrange(self.dias_rango - 60))
+            carnets.append((id_carnet, datetime.combine(emision, hora(10)), mascota_id))
+            for _ in range(rnd.randint(1, 6)):
+                vacuna_id, intervalo = rnd.choice(self.ids["vacuna"])
+                aplicada = emision + timedelta(days=rnd.randint(0, max(1, (self.hoy - emision).days)))
+                proxima = aplicada + timedelta(days=intervalo) if rnd.random() < 0.9 else None
+                detalles.append((id_detalle, aplicada, proxima, id_carnet, vacuna_id))
+                id_detalle += 1
+            id_carnet += 1
+            if len(detalles) >= LOTE:
+                await volcar()
+        await volcar()
+
+    async def generar(self, conn):
+        pasos = [
+            ("catálogos", self._catalogos),
+            ("doctores", lambda c: self._personas(c, "doctor")),
+            ("clientes", lambda c: self._personas(c, "cliente")),
+            ("mascotas", self._mascotas),
+            ("citas, diagnósticos y tratamientos", self._citas),
+            ("carnets y vacunaciones", self._vacunaciones),
+        ]
+        for nombre, paso in pasos:
+            inicio = time.perf_counter()
+            await paso(conn)
+            print(f"✅ {nombre} ({time.perf_counter() - inicio:.1f}s)")
+
+        # Las filas se insertaron con ids explícitos; alinear las secuencias
+        for tabla in TABLAS:
+            await conn.execute(text(f"""
+                SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), COALESCE(MAX(id), 1))
+                FROM {tabla}
+                WHERE pg_get_serial_sequence('{tabla}', 'id') IS NOT NULL
+            """))
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Generador de datos sintéticos para el subgrafo KPI")
+    parser.add_argument("--escala", type=float, default=1.0,
+                        help="Factor de escala (1 = 50 mil citas, 200 = 10 millones)")
+    parser.add_argument("--anios", type=int, default=3, help="Años de historia de citas")
+    parser.add_argument("--semilla", type=int, default=42, help="Semilla para datos reproducibles")
+    parser.add_argument("--crear-esquema", action="store_true",
+                        help="Crea las tablas de database_models.py si no existen")
+    parser.add_argument("--truncar", action="store_true",
+                        help="Vacía las tablas antes de generar (¡borra datos!)")
+    args = parser.parse_args()
+
+    generador = Generador(args.escala, args.anios, args.semilla)
+    print(f"🧪 Generando datos con escala {args.escala}: " +
+          ", ".join(f"{tabla}={n:,}" for tabla, n in generador.tamanos.items()))
+
+    inicio = time.perf_counter()
+    async with engine.begin() as conn:
+        if args.crear_esquema:
+            await conn.run_sync(Base.metadata.create_all)
+        if args.truncar:
+            await conn.execute(text(f"TRUNCATE {', '.join(TABLAS)} RESTART IDENTITY CASCADE"))
+        await generador.generar(conn)
+        await conn.execute(text(f"ANALYZE {', '.join(TABLAS)}"))
+
+    await engine.dispose()
+    print(f"🎉 Datos generados en {time.perf_counter() - inicio:.1f}s")
+    print("💡 Ejecuta `python init_db.py` para crear vistas, índices y tablas resumen")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,392 @@
+"""
+Regresión de planes de consulta de los servicios
+
+Ejecuta los métodos de KPIServiceReal (en sus modos base, vista y resumen),
+KPIService y ReportService contra una base local sembrada, captura cada
+sentencia SQL que emiten y la vuelve a correr con
+EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON).
+
+Falla (código de salida 1) si algún plan:
+- hace Seq Scan sobre una tabla grande (por estadísticas de pg_class),
+  salvo las excepciones documentadas en EXCEPCIONES
+- supera el presupuesto de buffers compartidos (hit + read)
+- no se pudo ejecutar
+
+Por cada sentencia escribe un reporte legible (.txt) y el plan crudo (.json).
+
+Preparación:
+    python scripts/generar_datos.py --escala 20 --crear-esquema
+    python init_db.py
+
+Uso:
+    python scripts/regresion_planes.py --reporte planes/
+    python scripts/regresion_planes.py --modos base --presupuesto-buffers 5000
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import event, text
+
+from app.config.database import AsyncSessionLocal, engine
+from app.config.settings import settings
+from app.models.report_models import FiltrosReporte, TipoReporte
+from app.services.kpi_service import KPIService
+from app.services.kpi_service_real import KPIServiceReal
+from app.services.report_service import ReportService
+
+MODOS = ("base", "vista", "resumen")
+
+
+@dataclass
+class Excepcion:
+    """Seq Scan aceptado: la sentencia necesita leer la tabla completa"""
+    caso: str        # regex sobre el nombre del caso
+    relacion: str    # regex sobre la tabla escaneada
+    sentencia: str   # regex sobre la sentencia normalizada
+    motivo: str
+
+
+EXCEPCIONES = [
+    Excepcion(
+        r"KPIServiceReal:(base|vista)\.get_dashboard_resumen", r"mascota|cliente|cita",
+        r"SELECT COUNT\(\*\) FROM \w+",
+        "Conteo total; el modo resumen lo lee de kpi_resumen_global",
+    ),
+    Excepcion(
+        r"KPIService\.get_dashboard_resumen", r"mascota|cliente",
+        r"SELECT count\(\w+\.id\) AS count_1 FROM \w+",
+        "Conteo total",
+    ),
+    Excepcion(
+        r"KPIService\.get_dashboard_resumen", r"detalle_vacunacion", r".*proximavacunacion < .*",
+        "Vencidas sobre todo el historial de vacunación",
+    ),
+    Excepcion(
+        r"KPIService(Real:\w+)?\.get_mascotas_por_especie", r"mascota", r".*",
+        "Distribución sobre todas las mascotas",
+    ),
+    Excepcion(
+        r"KPIService(Real:\w+)?\.get_vacunacion_estadisticas", r"detalle_vacunacion", r".*",
+        "Estadísticas sobre todo el historial de vacunación",
+    ),
+]
+
+
+@dataclass
+class Sentencia:
+    caso: str
+    sql: str
+    parametros: Any
+    plan: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    fallos: List[str] = field(default_factory=list)
+    avisos: List[str] = field(default_factory=list)
+
+    @property
+    def normalizada(self) -> str:
+        return " ".join(self.sql.split())
+
+
+class Capturador:
+    """Registra las sentencias que llegan al cursor mientras hay un caso activo"""
+
+    def __init__(self):
+        self.caso: Optional[str] = None
+        self.sentencias: List[Sentencia] = []
+        self._vistas = set()
+
+    def registrar(self, conn, cursor, statement, parameters, context, executemany):
+        if self.caso is None or executemany:
+            return
+        if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return
+        clave = (self.caso, statement, repr(parameters))
+        if clave in self._vistas:
+            return
+        self._vistas.add(clave)
+        self.sentencias.append(Sentencia(self.caso, statement, parameters))
+
+
+def casos(modos: List[str]) -> List[Tuple[str, Callable[[Any], Awaitable[Any]]]]:
+    """Llamadas representativas de cada método de los servicios"""
+    hoy = date.today()
+    resultado = []
+
+    for modo in modos:
+        def servicio(db, modo=modo):
+            return KPIServiceReal(db, usar_vistas=modo == "vista", usar_resumenes=modo == "resumen")
+        prefijo = f"KPIServiceReal:{modo}"
+        resultado += [
+            (f"{prefijo}.get_dashboard_resumen", lambda db, s=servicio: s(db).get_dashboard_resumen()),
+            (f"{prefijo}.get_citas_por_mes", lambda db, s=servicio: s(db).get_citas_por_mes(hoy.year)),
+            (f"{prefijo}.get_mascotas_por_especie", lambda db, s=servicio: s(db).get_mascotas_por_especie()),
+            (f"{prefijo}.get_doctor_performance",
+             lambda db, s=servicio: s(db).get_doctor_performance(hoy.month, hoy.year)),
+            (f"{prefijo}.get_vacunacion_estadisticas",
+             lambda db, s=servicio: s(db).get_vacunacion_estadisticas()),
+            (f"{prefijo}.get_alertas_vacunacion", lambda db, s=servicio: s(db).get_alertas_vacunacion(30)),
+        ]
+
+    # Páginas de alertas: primera página, continuación por cursor y filtros
+    resultado += [
+        ("KPIServiceReal.get_alertas_vacunacion_pagina",
+         lambda db: KPIServiceReal(db).get_alertas_vacunacion_pagina(50)),
+        ("KPIServiceReal.get_alertas_vacunacion_pagina:despues",
+         lambda db: KPIServiceReal(db).get_alertas_vacunacion_pagina(50, (hoy - timedelta(days=365), 1))),
+        ("KPIServiceReal.get_alertas_vacunacion_pagina:prioridades",
+         lambda db: KPIServiceReal(db).get_alertas_vacunacion_pagina(50, prioridades=["URGENTE", "PRÓXIMA"])),
+        ("KPIServiceReal.get_alertas_vacunacion_pagina:especie",
+         lambda db: KPIServiceReal(db).get_alertas_vacunacion_pagina(50, especie="Perro")),
+    ]
+
+    resultado += [
+        ("KPIService.get_dashboard_resumen", lambda db: KPIService(db).get_dashboard_resumen()),
+        ("KPIService.get_citas_por_mes", lambda db: KPIService(db).get_citas_por_mes(hoy.year)),
+        ("KPIService.get_mascotas_por_especie", lambda db: KPIService(db).get_mascotas_por_especie()),
+        ("KPIService.get_doctor_performance",
+         lambda db: KPIService(db).get_doctor_performance(hoy.month, hoy.year)),
+        ("KPIService.get_vacunacion_estadisticas", lambda db: KPIService(db).get_vacunacion_estadisticas()),
+        ("KPIService.get_alertas_vacunacion", lambda db: KPIService(db).get_alertas_vacunacion(30)),
+    ]
+
+    def filtros(tipo: TipoReporte) -> FiltrosReporte:
+        return FiltrosReporte(fecha_inicio=hoy - timedelta(days=90), fecha_fin=hoy, tipo_reporte=tipo)
+
+    resultado += [
+        ("ReportService.generar_reporte_financiero",
+         lambda db: ReportService(db).generar_reporte_financiero(filtros(TipoReporte.FINANCIERO))),
+        ("ReportService.generar_reporte_clinico",
+         lambda db: ReportService(db).generar_reporte_clinico(filtros(TipoReporte.CLINICO))),
+        ("ReportService.generar_reporte_operacional",
+         lambda db: ReportService(db).generar_reporte_operacional(filtros(TipoReporte.OPERACIONAL))),
+    ]
+    return resultado
+
+
+async def capturar(modos: List[str]) -> Tuple[List[Sentencia], List[str]]:
+    """
+    Ejecuta los casos y devuelve las sentencias emitidas y los casos que
+    terminaron con error (sus sentencias previas al error se analizan igual)
+    """
+    capturador = Capturador()
+    event.listen(engine.sync_engine, "before_cursor_execute", capturador.registrar)
+    errores = []
+    try:
+        for nombre, llamada in casos(modos):
+            capturador.caso = nombre
+            try:
+                async with AsyncSessionLocal() as sesion:
+                    await llamada(sesion)
+                    await sesion.rollback()
+            except Exception as e:
+                errores.append(f"{nombre}: {type(e).__name__}: {e}")
+            finally:
+                capturador.caso = None
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capturador.registrar)
+    return capturador.sentencias, errores
+
+
+async def tablas_grandes(umbral_filas: int) -> Dict[str, int]:
+    """Tablas y vistas materializadas con al menos `umbral_filas` filas estimadas"""
+    async with engine.connect() as conn:
+        resultado = await conn.execute(text("""
+            SELECT c.relname, c.reltuples::bigint
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'm', 'p')
+                AND n.nspname = current_schema()
+                AND c.reltuples >= :umbral
+        """), {"umbral": umbral_filas})
+        return {nombre: filas for nombre, filas in resultado.fetchall()}
+
+
+async def explicar(sentencia: Sentencia):
+    """EXPLAIN ANALYZE de la sentencia con sus mismos parámetros, sin dejar efectos"""
+    async with engine.connect() as conn:
+        try:
+            resultado = await conn.exec_driver_sql(
+                "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sentencia.sql, sentencia.parametros
+            )
+            plan = resultado.scalar()
+            sentencia.plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+        except Exception as e:
+            sentencia.error = f"{type(e).__name__}: {e}"
+        finally:
+            await conn.rollback()
+
+
+def _nodos(nodo: Dict[str, Any]):
+    yield nodo
+    for hijo in nodo.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+def _exceptuado(sentencia: Sentencia, relacion: str) -> Optional[Excepcion]:
+    for excepcion in EXCEPCIONES:
+        if (re.fullmatch(excepcion.caso, sentencia.caso)
+                and re.fullmatch(excepcion.relacion, relacion)
+                and re.fullmatch(excepcion.sentencia, sentencia.normalizada, re.S)):
+            return excepcion
+    return None
+
+
+def buffers(plan: Dict[str, Any]) -> int:
+    """Bloques compartidos leídos por la ejecución (el nodo raíz acumula los de sus hijos)"""
+    raiz = plan["Plan"]
+    return raiz.get("Shared Hit Blocks", 0) + raiz.get("Shared Read Blocks", 0)
+
+
+def evaluar(sentencia: Sentencia, grandes: Dict[str, int], presupuesto_buffers: int):
+    if sentencia.error:
+        sentencia.fallos.append(f"Error: {sentencia.error}")
+        return
+
+    exceptuada = False
+    for nodo in _nodos(sentencia.plan["Plan"]):
+        if nodo["Node Type"] != "Seq Scan":
+            continue
+        relacion = nodo.get("Relation Name", "?")
+        if relacion not in grandes:
+            continue
+        excepcion = _exceptuado(sentencia, relacion)
+        if excepcion:
+            exceptuada = True
+            sentencia.avisos.append(f"Seq Scan permitido sobre {relacion}: {excepcion.motivo}")
+            continue
+        filtro = f" (filtro: {nodo['Filter']})" if "Filter" in nodo else ""
+        sentencia.fallos.append(f"Seq Scan sobre {relacion} (~{grandes[relacion]} filas){filtro}")
+
+    usados = buffers(sentencia.plan)
+    if usados > presupuesto_buffers:
+        mensaje = f"{usados} buffers compartidos > presupuesto de {presupuesto_buffers}"
+        # Las lecturas completas aceptadas no pueden cumplir el presupuesto por definición
+        (sentencia.avisos if exceptuada else sentencia.fallos).append(mensaje)
+
+
+def _linea_nodo(nodo: Dict[str, Any]) -> str:
+    partes = [nodo["Node Type"]]
+    if "Index Name" in nodo:
+        partes.append(f"using {nodo['Index Name']}")
+    if "Relation Name" in nodo:
+        partes.append(f"on {nodo['Relation Name']}")
+        if nodo.get("Alias") and nodo["Alias"] != nodo["Relation Name"]:
+            partes.append(nodo["Alias"])
+    detalle = (
+        f"filas est. {nodo.get('Plan Rows')}, reales {nodo.get('Actual Rows')} x{nodo.get('Actual Loops')}, "
+        f"{nodo.get('Actual Total Time', 0):.2f} ms, "
+        f"buffers hit={nodo.get('Shared Hit Blocks', 0)} read={nodo.get('Shared Read Blocks', 0)}"
+    )
+    return f"{' '.join(partes)}  ({detalle})"
+
+
+def _arbol(nodo: Dict[str, Any], nivel: int = 0) -> List[str]:
+    sangria = "   " * nivel
+    lineas = [f"{sangria}-> {_linea_nodo(nodo)}"]
+    for clave in ("Index Cond", "Recheck Cond", "Hash Cond", "Merge Cond", "Join Filter", "Filter"):
+        if clave in nodo:
+            lineas.append(f"{sangria}     {clave}: {nodo[clave]}")
+    if nodo.get("Rows Removed by Filter"):
+        lineas.append(f"{sangria}     Rows Removed by Filter: {nodo['Rows Removed by Filter']}")
+    for hijo in nodo.get("Plans", []):
+        lineas += _arbol(hijo, nivel + 1)
+    return lineas
+
+
+def reporte_texto(sentencia: Sentencia) -> str:
+    lineas = [
+        f"Caso: {sentencia.caso}",
+        f"Resultado: {'FALLA' if sentencia.fallos else 'OK'}",
+    ]
+    lineas += [f"  ❌ {fallo}" for fallo in sentencia.fallos]
+    lineas += [f"  ⚠️ {aviso}" for aviso in sentencia.avisos]
+    if sentencia.plan:
+        lineas += [
+            f"Planificación: {sentencia.plan.get('Planning Time', 0):.2f} ms",
+            f"Ejecución: {sentencia.plan.get('Execution Time', 0):.2f} ms",
+            f"Buffers compartidos: {buffers(sentencia.plan)}",
+        ]
+    lineas += ["", "SQL:", sentencia.sql.strip(), "", f"Parámetros: {sentencia.parametros!r}"]
+    if sentencia.plan:
+        lineas += ["", "Plan:"] + _arbol(sentencia.plan["Plan"])
+    return "\n".join(lineas) + "\n"
+
+
+def escribir_reportes(sentencias: List[Sentencia], errores: List[str], directorio: Path):
+    directorio.mkdir(parents=True, exist_ok=True)
+    for anterior in list(directorio.glob("*.txt")) + list(directorio.glob("*.json")):
+        anterior.unlink()
+
+    indice = []
+    for numero, sentencia in enumerate(sentencias, start=1):
+        base = f"{numero:03d}_{re.sub(r'[^A-Za-z0-9_.]+', '_', sentencia.caso)}"
+        (directorio / f"{base}.txt").write_text(reporte_texto(sentencia), encoding="utf-8")
+        if sentencia.plan:
+            (directorio / f"{base}.json").write_text(
+                json.dumps([sentencia.plan], indent=2, ensure_ascii=False), encoding="utf-8"
+            )
+        estado = "FALLA" if sentencia.fallos else "OK"
+        tiempo = f"{sentencia.plan.get('Execution Time', 0):.2f}" if sentencia.plan else "-"
+        usados = buffers(sentencia.plan) if sentencia.plan else "-"
+        indice.append(f"{estado:<6}{tiempo:>12}{usados!s:>10}  {base}")
+
+    encabezado = f"{'':<6}{'ms':>12}{'buffers':>10}  reporte"
+    lineas = [encabezado] + indice
+    if errores:
+        lineas += ["", "Casos terminados con error:"] + [f"  {error}" for error in errores]
+    (directorio / "resumen.txt").write_text("\n".join(lineas) + "\n", encoding="utf-8")
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Regresión de planes de las consultas de los servicios")
+    parser.add_argument("--modos", nargs="+", choices=MODOS, default=list(MODOS),
+                        help="Modos de KPIServiceReal a ejecutar")
+    parser.add_argument("--filas-tabla-grande", type=int, default=10_000,
+                        help="Filas estimadas a partir de las cuales un Seq Scan es un fallo")
+    parser.add_argument("--presupuesto-buffers", type=int, default=10_000,
+                        help="Máximo de buffers compartidos (hit + read) por sentencia")
+    parser.add_argument("--reporte", type=Path, default=Path("planes"),
+                        help="Directorio donde escribir un reporte por sentencia")
+    args = parser.parse_args()
+
+    # Cada llamada debe llegar a la base para capturar su SQL
+    settings.cache_kpi_habilitado = False
+
+    print(f"🔎 Capturando sentencias ({', '.join(args.modos)})...")
+    sentencias, errores = await capturar(args.modos)
+    for error in errores:
+        print(f"⚠️ Caso con error: {error}")
+    grandes = await tablas_grandes(args.filas_tabla_grande)
+    if not grandes:
+        print(f"⚠️ Ninguna tabla supera {args.filas_tabla_grande} filas; ¿está sembrada la base "
+              "(scripts/generar_datos.py) y analizada?")
+
+    for sentencia in sentencias:
+        await explicar(sentencia)
+        evaluar(sentencia, grandes, args.presupuesto_buffers)
+
+    escribir_reportes(sentencias, errores, args.reporte)
+    await engine.dispose()
+
+    fallidas = [s for s in sentencias if s.fallos]
+    for sentencia in fallidas:
+        print(f"❌ {sentencia.caso}: {'; '.join(sentencia.fallos)}")
+    print(f"📄 Reportes en {args.reporte}/ ({len(sentencias)} sentencias)")
+    if fallidas:
+        print(f"❌ {len(fallidas)} sentencias fuera de los límites")
+        return 1
+    print("✅ Todos los planes dentro de los límites")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))